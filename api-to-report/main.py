@@ -1,17 +1,28 @@
 import os
 import json
 import logging
-import tempfile
-from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
+from typing import List, Optional, TYPE_CHECKING
 
-import pandas as pd
 from fastapi import FastAPI, HTTPException
-from fastapi.responses import HTMLResponse
 from pydantic import BaseModel
-from sqlalchemy import create_engine, text
-from report_generator import ReportGenerator
+from sqlalchemy import text
 from dotenv import load_dotenv
 
+from common.concurrency import run_blocking, shutdown_executor
+from common.data_version import DataVersion
+from common.db import get_engine
+from common.llm import add_llm_stats_route, add_priority_middleware, get_llm_gateway
+from common.metrics import add_metrics
+from common.readiness import Readiness, add_health_routes
+from common.resilience import add_deadline_middleware
+from common.singleflight import SingleFlight, make_key, normalize_text
+from common.tracing import add_tracing
+
+if TYPE_CHECKING:
+    from common.streaming import StreamResult
+    from report_generator import ReportGenerator
+
 # Load environment variables
 load_dotenv()
 
@@ -22,8 +33,28 @@ logging.basicConfig(
 )
 logger = logging.getLogger("report-api")
 
+POSTGRES_URI = os.getenv("POSTGRES_URI", "postgresql://postgres:postgres@db:5432/northwind")
+data_version = DataVersion(POSTGRES_URI)
+
+readiness = Readiness("api-to-report")
+report_flight = SingleFlight("generate-report")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    readiness.start()
+    yield
+    await readiness.stop()
+    await get_llm_gateway().aclose()
+    shutdown_executor()
+
 # Create FastAPI app
-app = FastAPI(title="API to Report Service", version="1.0.0")
+app = FastAPI(title="API to Report Service", version="1.0.0", lifespan=lifespan)
+add_health_routes(app, readiness)
+add_priority_middleware(app)
+add_tracing(app, "api-to-report")
+add_metrics(app)
+add_deadline_middleware(app)
+add_llm_stats_route(app)
 
 # Data models
 class ReportRequest(BaseModel):
@@ -32,24 +63,64 @@ class ReportRequest(BaseModel):
     sql_query: str
     plots: List[str]
     image_urls: Optional[List[str]] = None  # Optional image URLs
+    model: Optional[str] = None  # routed to the stage default when omitted
+    previous_data_summary: Optional[str] = None  # set on refreshes: keep the old report if the data barely changed
 
 class ReportResponse(BaseModel):
     html_report: str
     success: bool
     message: str
+    model: Optional[str] = None  # model that wrote the report
+    data_summary: Optional[str] = None  # the summary the report was written from
+    reused: bool = False  # data summary unchanged: html_report is empty, the previous report still applies
+
+def build_report_generator() -> "ReportGenerator":
+    """Import LangChain and build the report generator once per process so its HTTP client is reused."""
+    from report_generator import ReportGenerator
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not configured")
+    return ReportGenerator(api_key)
+
+def warm_database() -> None:
+    """Open the first pooled connection so the first report does not pay for it."""
+    with get_engine(POSTGRES_URI).connect() as conn:
+        conn.execute(text("SELECT 1"))
+
+readiness.register("report_generator", build_report_generator)
+readiness.register("database", warm_database)
+
+def execute_sql_query(sql_query: str) -> "StreamResult":
+    """Execute SQL query against PostgreSQL database (blocking, run it on the executor).
+
+    Rows are streamed in chunks; statistics cover every row even when the kept frame is a sample.
+    """
+    from common.result_cache import get_result_cache
+    from common.rollups import get_rollups
+    from common.streaming import stream_query
+
+    def run_sql(sql: str) -> "StreamResult":
+        rollups = get_rollups(POSTGRES_URI, data_version)
+        # query-to-plots already counted this statement for the same request.
+        sql = rollups.rewrite(sql, track=False) if rollups is not None else sql
+        return stream_query(sql, get_engine(POSTGRES_URI))
 
-def execute_sql_query(sql_query: str) -> pd.DataFrame:
-    """Execute SQL query against PostgreSQL database."""
     try:
-        postgres_uri = os.getenv("POSTGRES_URI", "postgresql://postgres:postgres@db:5432/northwind")
-        if not postgres_uri:
+        if not POSTGRES_URI:
             raise ValueError("POSTGRES_URI not found in environment variables")
         
         logger.info("Executing SQL query...")
-        engine = create_engine(postgres_uri)
-        df = pd.read_sql_query(text(sql_query), engine)
-        logger.info(f"SQL query returned {len(df)} rows")
-        return df
+        cache = get_result_cache(data_version)
+        if cache is None:
+            result = run_sql(sql_query)
+        else:
+            # Shared with query-to-plots, which usually ran the same SQL moments earlier.
+            result, cached = cache.read_sql(sql_query, data_version, run_sql)
+            if cached:
+                logger.info("SQL result served from the result cache")
+        logger.info(f"SQL query returned {result.total_rows} rows" + (" (sampled)" if result.sampled else ""))
+        return result
     except Exception as e:
         logger.error(f"Database query failed: {e}")
         raise HTTPException(status_code=500, detail=f"Database query failed: {str(e)}")
@@ -58,16 +129,28 @@ def execute_sql_query(sql_query: str) -> pd.DataFrame:
 async def generate_report(request: ReportRequest):
     """Generate a comprehensive report from SQL query and visualization output."""
     logger.info("Received report generation request")
+    key = make_key(
+        normalize_text(request.original_query),
+        normalize_text(request.reformulated_query),
+        normalize_text(request.sql_query, lowercase=False),
+        json.dumps(request.plots),
+        json.dumps(request.image_urls),
+        normalize_text(request.model or ""),
+        request.previous_data_summary,
+    )
+    return await report_flight.do(key, lambda: build_report(request))
+
+async def build_report(request: ReportRequest) -> ReportResponse:
     try:
         api_key = os.getenv("OPENAI_API_KEY")
         if not api_key:
             logger.error("OPENAI_API_KEY not configured")
             raise HTTPException(status_code=500, detail="OpenAI API key not configured")
 
-        report_generator = ReportGenerator(api_key)
+        report_generator = await readiness.get("report_generator")
 
-        df = execute_sql_query(request.sql_query)
-        if df.empty:
+        result = await run_blocking(execute_sql_query, request.sql_query)
+        if not result.total_rows:
             logger.warning("SQL query returned no data")
             raise HTTPException(status_code=400, detail="SQL query returned no data")
 
@@ -77,29 +160,42 @@ async def generate_report(request: ReportRequest):
 
         # Add image URLs if present
         logger.info(request.image_urls)
-        image_urls = [url.replace("localhost", "minio") for url in request.image_urls if url]
+        image_urls = [url.replace("localhost", "minio") for url in (request.image_urls or []) if url]
         logger.info(image_urls)
 
+        from report_generator import summary_changed
+
+        data_summary = await run_blocking(report_generator._prepare_data_summary, result)
+        if request.previous_data_summary is not None and not summary_changed(request.previous_data_summary, data_summary):
+            logger.info("Data summary unchanged; keeping the previous report")
+            return ReportResponse(
+                html_report="",
+                success=True,
+                message="Data summary unchanged; the previous report still applies",
+                data_summary=data_summary,
+                reused=True,
+            )
+
         query_for_analysis = request.reformulated_query or request.original_query
         logger.info("Generating report content...")
-        report_content, plots = report_generator.generate_report(
+        report_content, plots, model = await report_generator.generate_report(
             original_query=query_for_analysis,
-            sql_results=df,
+            sql_results=result,
             plots=request.plots,
-            image_urls=image_urls
+            image_urls=image_urls,
+            model=request.model,
+            data_summary=data_summary
         )
 
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.html', delete=False) as tmp:
-            report_generator.save_report(report_content, plots, tmp.name)
-            with open(tmp.name, 'r', encoding='utf-8') as f:
-                html_content = f.read()
-            os.unlink(tmp.name)
+        html_content = report_generator.render_html(report_content, plots)
 
         logger.info("Report successfully generated and returned")
         return ReportResponse(
             html_report=html_content,
             success=True,
-            message=f"Report generated successfully from {len(df)} rows of data and {len(plots)} plots"
+            message=f"Report generated successfully from {result.total_rows} rows of data and {len(plots)} plots",
+            model=model,
+            data_summary=data_summary
         )
 
     except HTTPException:
@@ -108,15 +204,6 @@ async def generate_report(request: ReportRequest):
         logger.exception("Unexpected error during report generation")
         raise HTTPException(status_code=500, detail=f"Error generating report: {str(e)}")
 
-@app.get("/health")
-async def health_check():
-    """Health check endpoint"""
-    logger.info("Health check requested")
-    return {
-        "status": "healthy", 
-        "service": "api-to-report"
-    }
-
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
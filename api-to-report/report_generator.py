@@ -1,56 +1,96 @@
+import asyncio
 import logging
 import json
-import markdown
-import pandas as pd
-import requests
-import tempfile
 import os
+import re
+import markdown
+import aiohttp
 import base64
-from typing import List, Tuple, Dict, Any
-from langchain_openai import ChatOpenAI
+from typing import List, Tuple, Dict, Any, Optional
 from langchain.prompts import ChatPromptTemplate
 from langchain_core.messages import HumanMessage
 
+from common.concurrency import run_blocking
+from common.llm import get_llm_gateway, model_router
+from common.streaming import StreamResult
+from common.tracing import span
+
+# A report shorter than this is treated as a failed generation and escalated.
+MIN_REPORT_CHARS = 200
+# On a refresh, the narrative is rewritten only if a number in the data summary (row count,
+# mean, std, min, max) moved by more than this fraction, or columns or date ranges changed.
+REPORT_SUMMARY_TOLERANCE = float(os.getenv("REPORT_SUMMARY_TOLERANCE", "0.02"))
+
+DATE = re.compile(r"\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?")
+NUMBER = re.compile(r"-?\d+(?:\.\d+)?")
+
+
+def summary_changed(previous: str, current: str, tolerance: float = REPORT_SUMMARY_TOLERANCE) -> bool:
+    """Whether ``current`` differs meaningfully from ``previous`` (both from _prepare_data_summary)."""
+    if DATE.findall(previous) != DATE.findall(current):
+        return True
+    previous, current = DATE.sub("", previous), DATE.sub("", current)
+    if NUMBER.sub("#", previous) != NUMBER.sub("#", current):
+        return True  # different columns or wording
+    for old, new in zip(NUMBER.findall(previous), NUMBER.findall(current)):
+        old, new = float(old), float(new)
+        if abs(new - old) > tolerance * max(abs(old), abs(new)):
+            return True
+    return False
+
+
+# Built once per process and shared by every generator, so each report request sends
+# the same system prompt prefix and can benefit from provider-side prompt caching.
+REPORT_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", """You are a professional data analyst and report writer. Your task is to generate a concise, well-structured report that addresses the user's original query using:
+
+1. The original user intent
+2. A summary of the SQL query results
+3. Context from supporting visualizations (e.g., figures — referenced only by number)
+
+The report must include the following sections:
+
+- **Title**: Clear and focused
+- **Executive Summary**: A brief overview of the main insights (3–4 sentences)
+- **Main Findings**: Key observations from the data (e.g., top items, totals, comparisons)
+- **Trends and Comparisons**:
+    - Include relevant metrics like averages, variations, and distributions
+    - Reference standard deviation or rankings if useful
+- **Visual References**: Mention figures by number only (e.g., “Figure 1”) — **do not describe or include the images**
+- **Conclusion**: Summarize the findings and suggest possible actions or decisions
+
+Guidelines:
+- Write in clear, professional English
+- Use markdown for structure and emphasis
+- Do **not** include images or their descriptions
+- Do **not** output raw SQL or HTML
+- Focus on actionable insights, not visual design
+
+Your audience is business decision-makers seeking clarity and recommendations."""),
+    ("human", "{input}")
+])
+
 
 class ReportGenerator:
     def __init__(self, openai_api_key: str):
         """Initialize the report generator with OpenAI API key."""
-        self.llm = ChatOpenAI(
-            model="gpt-4o-mini",
-            temperature=0.1,
-            openai_api_key=openai_api_key
-        )
-
-        self.report_prompt = ChatPromptTemplate.from_messages([
-            ("system", """
-        You are a professional data analyst and report writer. Your task is to generate a concise, well-structured report that addresses the user's original query using:
-
-        1. The original user intent
-        2. A summary of the SQL query results
-        3. Context from supporting visualizations (e.g., figures — referenced only by number)
-
-        The report must include the following sections:
-
-        - **Title**: Clear and focused
-        - **Executive Summary**: A brief overview of the main insights (3–4 sentences)
-        - **Main Findings**: Key observations from the data (e.g., top items, totals, comparisons)
-        - **Trends and Comparisons**:
-            - Include relevant metrics like averages, variations, and distributions
-            - Reference standard deviation or rankings if useful
-        - **Visual References**: Mention figures by number only (e.g., “Figure 1”) — **do not describe or include the images**
-        - **Conclusion**: Summarize the findings and suggest possible actions or decisions
-
-        Guidelines:
-        - Write in clear, professional English
-        - Use markdown for structure and emphasis
-        - Do **not** include images or their descriptions
-        - Do **not** output raw SQL or HTML
-        - Focus on actionable insights, not visual design
-
-        Your audience is business decision-makers seeking clarity and recommendations.
-        """),
-            ("human", "{input}")
-        ])
+        self.openai_api_key = openai_api_key
+        self._llms: Dict[str, Any] = {}
+        self.llm = self._get_llm(model_router.route("report"))
+
+        # Shared, static system prompt: the per-request input is the only varying suffix.
+        self.report_prompt = REPORT_PROMPT
+
+    def _get_llm(self, model: str):
+        """One chat model per model name, created on first use."""
+        if model not in self._llms:
+            self._llms[model] = get_llm_gateway().chat_model(
+                model,
+                stage="report",
+                temperature=0.1,
+                openai_api_key=self.openai_api_key
+            )
+        return self._llms[model]
 
     def _get_plot_metadata(self, plots: List[str], image_urls: List[str]) -> List[Dict[str, str]]:
         return [
@@ -62,68 +102,68 @@ class ReportGenerator:
             } for i, url in enumerate(image_urls)
         ]
 
-    def _prepare_data_summary(self, df: pd.DataFrame) -> str:
-        summary_parts = [f"Dataset contains {len(df)} rows and {len(df.columns)} columns."]
+    def _prepare_data_summary(self, result: StreamResult) -> str:
+        """Summarize the full result from its streamed statistics (exact even when the frame is sampled)."""
+        df = result.frame
+        summary_parts = [f"Dataset contains {result.total_rows} rows and {len(df.columns)} columns."]
 
-        numeric_cols = df.select_dtypes(include=['number']).columns
-        if numeric_cols.any():
+        numeric_cols = [col for col, stats in result.stats.items() if stats.kind == "numeric" and stats.count]
+        if numeric_cols:
             summary_parts.append("\nNumeric columns summary:")
             for col in numeric_cols:
-                stats = df[col].describe()
+                stats = result.stats[col]
                 summary_parts.append(
-                    f"- {col}: mean={stats['mean']:.2f}, std={stats['std']:.2f}, "
-                    f"min={stats['min']:.2f}, max={stats['max']:.2f}"
+                    f"- {col}: mean={stats.mean:.2f}, std={stats.std:.2f}, "
+                    f"min={stats.min:.2f}, max={stats.max:.2f}"
                 )
 
-        date_cols = df.select_dtypes(include=['datetime64']).columns
-        if date_cols.any():
+        date_cols = [col for col, stats in result.stats.items() if stats.kind == "datetime" and stats.count]
+        if date_cols:
             summary_parts.append("\nDate columns:")
             for col in date_cols:
-                summary_parts.append(f"- {col}: from {df[col].min()} to {df[col].max()}")
+                summary_parts.append(f"- {col}: from {result.stats[col].min} to {result.stats[col].max}")
 
         return "\n".join(summary_parts)
 
-    import base64
-
-    def _download_images_as_bytes(self, image_urls: List[str]) -> Tuple[List[Dict[str, Any]], List[str]]:
-        image_blobs = []
-        temp_files = []
-
-        for idx, url in enumerate(image_urls):
-            try:
-                response = requests.get(url)
-                response.raise_for_status()
-
-                # Write to temp file
-                temp_file = tempfile.NamedTemporaryFile(delete=False, suffix=".png")
-                temp_file.write(response.content)
-                temp_file.close()
-                temp_files.append(temp_file.name)
-
-                # Read and encode image to base64
-                with open(temp_file.name, "rb") as f:
-                    encoded = base64.b64encode(f.read()).decode("utf-8")
-                    image_blobs.append({
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{encoded}"
-                        }
-                    })
-
-            except Exception as e:
-                print(f"Failed to download or read image {url}: {e}")
-
-        return image_blobs, temp_files
-
-
-    def generate_report(
+    async def _download_image(self, session: aiohttp.ClientSession, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            with span("s3.get_object", **{"http.url": url}):
+                async with session.get(url) as response:
+                    response.raise_for_status()
+                    content = await response.read()
+            encoded = base64.b64encode(content).decode("utf-8")
+            return {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/png;base64,{encoded}"
+                }
+            }
+        except Exception as e:
+            logging.warning(f"Failed to download or read image {url}: {e}")
+            return None
+
+    async def _download_images_as_bytes(self, image_urls: List[str]) -> List[Dict[str, Any]]:
+        """Download all chart images concurrently and return them as base64 message blobs."""
+        if not image_urls:
+            return []
+        timeout = aiohttp.ClientTimeout(total=30)
+        async with aiohttp.ClientSession(timeout=timeout) as session:
+            blobs = await asyncio.gather(*(self._download_image(session, url) for url in image_urls))
+        return [blob for blob in blobs if blob is not None]
+
+
+    async def generate_report(
         self,
         original_query: str,
-        sql_results: pd.DataFrame,
+        sql_results: StreamResult,
         plots: List[str],
-        image_urls: List[str]
-    ) -> Tuple[str, List[str]]:
-        data_summary = self._prepare_data_summary(sql_results)
+        image_urls: List[str],
+        model: Optional[str] = None,
+        data_summary: Optional[str] = None
+    ) -> Tuple[str, List[str], str]:
+        """Returns the markdown report, the plots and the model that wrote the report."""
+        if data_summary is None:
+            data_summary = await run_blocking(self._prepare_data_summary, sql_results)
         plot_metadata = self._get_plot_metadata(plots, image_urls)
 
         input_text = f"""
@@ -143,15 +183,12 @@ class ReportGenerator:
         logging.info("original len: " + str(len(input_text)))
         MAX_CHARS = 100000 * 3  # Approx 400,000 characters (~128K token context)
 
-        image_blobs, temp_files = self._download_images_as_bytes(image_urls)
+        image_blobs = await self._download_images_as_bytes(image_urls)
 
         # Prepare image part size
         serialized_image_blobs = [json.dumps(blob) for blob in image_blobs]
         image_blobs_size = sum(len(blob) for blob in serialized_image_blobs)
 
-        # Estimate max text size allowed
-        max_text_size = MAX_CHARS - image_blobs_size
-
         # Truncate input text so that combined JSON fits in MAX_CHARS
         truncated_text = input_text
         while True:
@@ -172,18 +209,16 @@ class ReportGenerator:
         message_content = [{"type": "text", "text": truncated_text}] #+ image_blobs
         message = HumanMessage(content=message_content)
 
-        try:
-            chain = self.report_prompt | self.llm
-            response = chain.invoke(message)
-            return response.content, plots
-        finally:
-            for f in temp_files:
-                try:
-                    os.remove(f)
-                except Exception as e:
-                    print(f"⚠️ Failed to delete temp file {f}: {e}")
+        model = model_router.route("report", model)
+        response = await (self.report_prompt | self._get_llm(model)).ainvoke(message)
+        stronger = model_router.escalate(model)
+        if len(response.content.strip()) < MIN_REPORT_CHARS and stronger:
+            logging.warning(f"Report from {model} is too short; escalating to {stronger}")
+            model = stronger
+            response = await (self.report_prompt | self._get_llm(model)).ainvoke(message)
+        return response.content, plots, model
 
-    def save_report(self, report_content: str, plots: List[str], output_path: str):
+    def render_html(self, report_content: str, plots: List[str]) -> str:
         html_report = markdown.markdown(report_content)
         html_content = f"""
         <!DOCTYPE html>
@@ -211,6 +246,8 @@ class ReportGenerator:
         </body>
         </html>
         """
+        return html_content
 
+    def save_report(self, report_content: str, plots: List[str], output_path: str):
         with open(output_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
+            f.write(self.render_html(report_content, plots))
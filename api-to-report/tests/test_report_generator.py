@@ -0,0 +1,59 @@
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("langchain")
+pytest.importorskip("langchain_openai")
+pytest.importorskip("markdown")
+pytest.importorskip("aiohttp")
+
+from common.streaming import StreamResult
+from report_generator import ReportGenerator, summary_changed
+
+SALES = pd.DataFrame({
+    "order_date": pd.to_datetime(["2023-01-01", "2023-06-15", "2023-12-31"]),
+    "region": ["EMEA", "APAC", "EMEA"],
+    "sales": [1500.0, 1520.0, 1540.0],
+})
+
+
+@pytest.fixture
+def summarize(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    generator = ReportGenerator(openai_api_key="test-key")
+    return lambda frame: generator._prepare_data_summary(StreamResult.from_frame(frame))
+
+
+def test_summary_lists_exact_stats_and_date_range(summarize):
+    summary = summarize(SALES)
+    assert summary.startswith("Dataset contains 3 rows and 3 columns.")
+    assert "- sales: mean=1520.00, std=20.00, min=1500.00, max=1540.00" in summary
+    assert "- order_date: from 2023-01-01 00:00:00 to 2023-12-31 00:00:00" in summary
+
+
+def test_identical_data_is_unchanged(summarize):
+    assert not summary_changed(summarize(SALES), summarize(SALES.copy()))
+
+
+def test_change_within_the_tolerance_is_unchanged(summarize):
+    nudged = SALES.assign(sales=SALES["sales"] + [0.0, 0.0, 3.0])
+    assert not summary_changed(summarize(SALES), summarize(nudged), tolerance=0.1)
+    # The same data change counts once the tolerance is tighter than the std moved.
+    assert summary_changed(summarize(SALES), summarize(nudged), tolerance=0.001)
+
+
+def test_new_rows_change_the_summary(summarize):
+    # Ten more percent of the same rows: the stats barely move, the row count does.
+    before = pd.concat([SALES] * 10, ignore_index=True)
+    after = pd.concat([SALES] * 11, ignore_index=True)
+    assert summary_changed(summarize(before), summarize(after), tolerance=0.05)
+    assert not summary_changed(summarize(before), summarize(after), tolerance=0.15)
+
+
+def test_moved_date_range_changes_the_summary(summarize):
+    later = SALES.assign(order_date=SALES["order_date"] + pd.Timedelta(days=1))
+    assert summary_changed(summarize(SALES), summarize(later), tolerance=0.5)
+
+
+def test_different_columns_change_the_summary(summarize):
+    renamed = SALES.rename(columns={"sales": "revenue"})
+    assert summary_changed(summarize(SALES), summarize(renamed))
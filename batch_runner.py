@@ -0,0 +1,121 @@
+"""
+Bulk report runner for the gateway's /pipeline/batch endpoint.
+
+Reads intents from a JSONL file (one {"id": ..., "intent": ..., "model": ...} object
+per line; "id" defaults to the line number and "model" to gpt-4o-mini), streams the
+results back and appends one JSON line per finished item to the output file.
+Re-running with the same output file skips items that already succeeded, so an
+interrupted nightly run resumes where it stopped.
+
+    python batch_runner.py intents.jsonl results.jsonl --concurrency 8 --reports-dir reports/
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Set
+
+import aiohttp
+
+
+def load_items(path: str, default_model: str) -> List[Dict[str, str]]:
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            items.append({
+                "id": str(record.get("id", line_number)),
+                "intent": record["intent"],
+                "model": record.get("model", default_model),
+            })
+    return items
+
+
+def load_completed_ids(path: str) -> Set[str]:
+    """Ids that already succeeded in a previous run of the same output file."""
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # a line cut short by the interruption
+            if record.get("success"):
+                completed.add(str(record["id"]))
+    return completed
+
+
+def save_report(record: Dict, reports_dir: str) -> None:
+    """Move the HTML out of the JSONL line into its own file."""
+    result = record.get("result") or {}
+    html = result.pop("html_report", None)
+    if html is None:
+        return
+    path = os.path.join(reports_dir, f"{record['id']}.html")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html)
+    result["report_file"] = path
+
+
+async def run_batch(args) -> None:
+    items = load_items(args.input, args.model)
+    completed = load_completed_ids(args.output)
+    pending = [item for item in items if item["id"] not in completed]
+    print(f"{len(items)} intents, {len(completed)} already done, {len(pending)} to run")
+    if args.reports_dir:
+        os.makedirs(args.reports_dir, exist_ok=True)
+
+    started = time.perf_counter()
+    done = failed = 0
+    timeout = aiohttp.ClientTimeout(total=None, sock_read=args.item_timeout)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        with open(args.output, "a", encoding="utf-8") as out:
+            # Chunks bound the work lost if the connection drops mid-batch.
+            for offset in range(0, len(pending), args.chunk_size):
+                chunk = pending[offset:offset + args.chunk_size]
+                payload = {"items": chunk, "concurrency": args.concurrency}
+                if args.stage_limits:
+                    payload["stage_limits"] = json.loads(args.stage_limits)
+                async with session.post(f"{args.url}/pipeline/batch", json=payload) as response:
+                    response.raise_for_status()
+                    async for line in response.content:
+                        if not line.strip():
+                            continue
+                        record = json.loads(line)
+                        if args.reports_dir and record.get("success"):
+                            save_report(record, args.reports_dir)
+                        out.write(json.dumps(record) + "\n")
+                        out.flush()
+                        if record.get("success"):
+                            done += 1
+                        else:
+                            failed += 1
+                        print(f"[{done + failed}/{len(pending)}] {record['id']}: "
+                              f"{'ok (' + record.get('cache', '') + ')' if record.get('success') else record.get('error')}")
+
+    elapsed = time.perf_counter() - started
+    print(f"Finished {done} ok, {failed} failed in {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of intents through the report pipeline")
+    parser.add_argument("input", help="JSONL file of intents")
+    parser.add_argument("output", help="JSONL file results are appended to (used to resume)")
+    parser.add_argument("--url", default="http://localhost:8074", help="Gateway base URL")
+    parser.add_argument("--model", default="gpt-4o-mini", help="Model for items that do not set one")
+    parser.add_argument("--concurrency", type=int, default=8, help="Pipelines running at once")
+    parser.add_argument("--stage-limits", help='JSON per-stage limits, e.g. \'{"sql": 2, "report": 2}\'')
+    parser.add_argument("--chunk-size", type=int, default=50, help="Items sent per batch request")
+    parser.add_argument("--item-timeout", type=float, default=900, help="Max seconds without a finished item")
+    parser.add_argument("--reports-dir", help="Write each HTML report to <dir>/<id>.html instead of the JSONL")
+    asyncio.run(run_batch(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Chart payload benchmark for report viewing.
+
+Builds scatter and line charts over synthetic frames of increasing size, once as
+before (plain Plotly Express with its default render_mode="auto" and the columns as
+loaded) and once with query-to-plots' chart functions, and reports what the browser has
+to download and parse for each figure: trace type, figure JSON bytes (raw and gzipped, as served with GZip), whether
+the data went out as typed arrays, and the time to build, serialize and parse the
+figure. JSON parse time is a stand-in for the browser's JSON.parse of the embedded
+figure; Plotly.js itself is excluded from the sizes since it is the same for every
+chart. --export also times the Kaleido PNG export. --decimal loads the measure as
+Decimal objects, as psycopg2 returns NUMERIC columns.
+
+    python benchmarks/chart_bench.py --points 1000 10000 100000 --charts scatter_plot line_chart --output charts.json
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from decimal import Decimal
+from typing import Any, Dict, List
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "query-to-plots"))
+
+import numpy as np  # noqa: E402
+import pandas as pd  # noqa: E402
+import plotly.express as px  # noqa: E402
+import plotly.io as pio  # noqa: E402
+
+import utils  # noqa: E402
+
+
+# The chart functions before WebGL thresholds and typed columns: Plotly Express defaults.
+BASELINE = {"scatter_plot": px.scatter, "line_chart": px.line}
+
+
+def make_frame(points: int, groups: int, decimal: bool, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    freight = rng.gamma(2.0, 30.0, points).round(2)
+    return pd.DataFrame({
+        "order_date": pd.date_range("2020-01-01", periods=points, freq="min"),
+        "quantity": rng.integers(1, 100, points),
+        "freight": [Decimal(str(v)) for v in freight] if decimal else freight,
+        "region": rng.choice([f"region_{i}" for i in range(groups)], points),
+    })
+
+
+def measure(chart: str, mode: str, df: pd.DataFrame, groups: int, export: bool) -> Dict[str, Any]:
+    x = "order_date" if chart == "line_chart" else "quantity"
+    grouped = groups > 1
+
+    started = time.perf_counter()
+    if mode == "baseline":
+        fig = BASELINE[chart](df, x=x, y="freight", title=chart, color="region" if grouped else None)
+    else:
+        fig = getattr(utils, chart)(df, x=x, y="freight", title=chart, **({"group_by": "region"} if grouped else {}))
+    build_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    html = pio.to_html(fig, full_html=False, include_plotlyjs=False)
+    serialize_s = time.perf_counter() - started
+
+    payload = fig.to_json()
+    started = time.perf_counter()
+    json.loads(payload)
+    parse_s = time.perf_counter() - started
+
+    result = {
+        "trace_type": fig.data[0].type,
+        "typed_arrays": '"bdata"' in payload,
+        "figure_bytes": len(payload.encode()),
+        "figure_gzip_bytes": len(gzip.compress(payload.encode())),
+        "html_bytes": len(html.encode()),
+        "build_s": round(build_s, 4),
+        "serialize_s": round(serialize_s, 4),
+        "parse_s": round(parse_s, 4),
+    }
+    if export:
+        started = time.perf_counter()
+        result["png_bytes"] = len(fig.to_image(format="png", engine="kaleido"))
+        result["export_s"] = round(time.perf_counter() - started, 4)
+    return result
+
+
+def run(args) -> Dict[str, Any]:
+    results: List[Dict[str, Any]] = []
+    for points in args.points:
+        df = make_frame(points, args.groups, args.decimal)
+        for chart in args.charts:
+            for mode in ("baseline", "current"):
+                row = measure(chart, mode, df, args.groups, args.export)
+                results.append({"chart": chart, "points": points, "mode": mode, **row})
+                print(f"{chart} points={points} mode={mode}: {row['trace_type']}, "
+                      f"{row['figure_gzip_bytes'] / 1024:.0f} KiB gzipped, parse {row['parse_s']}s", file=sys.stderr)
+    return {"webgl_point_threshold": utils.WEBGL_POINT_THRESHOLD, "groups": args.groups, "decimal": args.decimal,
+            "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure chart figure size and parse cost, before and after")
+    parser.add_argument("--points", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--charts", nargs="+", default=["scatter_plot", "line_chart"],
+                        choices=["scatter_plot", "line_chart"])
+    parser.add_argument("--groups", type=int, default=1, help="Distinct group_by values (1: no grouping)")
+    parser.add_argument("--decimal", action="store_true", help="Load the measure as Decimal objects")
+    parser.add_argument("--export", action="store_true", help="Also time the Kaleido PNG export")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    args = parser.parse_args()
+
+    report = run(args)
+    text = json.dumps(report, indent=2, default=str)
+    print(text)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Concurrent load generator for any KHWARIZMI endpoint.
+
+Fires a fixed number of identical POST requests with a bounded number in flight
+and reports throughput and latency percentiles, e.g.
+
+    python benchmarks/load_test.py --url http://localhost:8073/generate-report \
+        --payload payload.json --requests 50 --concurrency 10
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Any, Dict, List
+
+import aiohttp
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_load(url: str, payload: Dict[str, Any], total: int, concurrency: int, timeout: float) -> Dict[str, Any]:
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(session: aiohttp.ClientSession):
+        nonlocal errors
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                async with session.post(url, json=payload) as response:
+                    await response.read()
+                    if response.status >= 400:
+                        errors += 1
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    async with aiohttp.ClientSession(timeout=client_timeout) as session:
+        started = time.perf_counter()
+        await asyncio.gather(*(one(session) for _ in range(total)))
+        elapsed = time.perf_counter() - started
+
+    return {
+        "url": url,
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(total / elapsed, 3) if elapsed else 0.0,
+        "latency_mean_s": round(statistics.mean(latencies), 3) if latencies else 0.0,
+        "latency_p50_s": round(percentile(latencies, 50), 3),
+        "latency_p95_s": round(percentile(latencies, 95), 3),
+        "latency_p99_s": round(percentile(latencies, 99), 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure endpoint throughput under concurrent load")
+    parser.add_argument("--url", required=True, help="Endpoint to POST to")
+    parser.add_argument("--payload", required=True, help="Path to a JSON file with the request body")
+    parser.add_argument("--requests", type=int, default=50, help="Total number of requests")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 5, 10],
+                        help="One or more concurrency levels to measure")
+    parser.add_argument("--timeout", type=float, default=300.0, help="Per-request timeout in seconds")
+    args = parser.parse_args()
+
+    with open(args.payload, "r", encoding="utf-8") as f:
+        payload = json.load(f)
+
+    for level in args.concurrency:
+        result = asyncio.run(run_load(args.url, payload, args.requests, level, args.timeout))
+        print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+Service startup benchmark.
+
+Starts a service with uvicorn (no reload) several times and measures how long it
+takes until /health answers (process is live) and until /ready answers 200
+(agent, schema and renderer are warm), e.g.
+
+    python benchmarks/startup_bench.py --service query-to-plots --port 8072 --runs 3
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from typing import Dict, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _status(url: str) -> Optional[int]:
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except Exception:
+        return None
+
+
+def measure_once(service: str, port: int, timeout: float) -> Dict[str, Optional[float]]:
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=os.path.join(ROOT, service),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    started = time.perf_counter()
+    health_s = ready_s = None
+    try:
+        while time.perf_counter() - started < timeout:
+            if process.poll() is not None:
+                break
+            if health_s is None and _status(f"http://127.0.0.1:{port}/health") == 200:
+                health_s = time.perf_counter() - started
+            if health_s is not None and _status(f"http://127.0.0.1:{port}/ready") == 200:
+                ready_s = time.perf_counter() - started
+                break
+            time.sleep(0.05)
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+    return {
+        "health_s": round(health_s, 3) if health_s is not None else None,
+        "ready_s": round(ready_s, 3) if ready_s is not None else None,
+        "crashed": process.returncode not in (None, 0, -15) and health_s is None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure time to /health and /ready for a service")
+    parser.add_argument("--service", required=True, help="Service directory, e.g. intent-to-query")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    runs = [measure_once(args.service, args.port, args.timeout) for _ in range(args.runs)]
+    health = [r["health_s"] for r in runs if r["health_s"] is not None]
+    ready = [r["ready_s"] for r in runs if r["ready_s"] is not None]
+    print(json.dumps({
+        "service": args.service,
+        "runs": runs,
+        "health_median_s": statistics.median(health) if health else None,
+        "ready_median_s": statistics.median(ready) if ready else None,
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+Answers POST /v1/chat/completions (and /v1/embeddings) after a configurable latency and enforces its own
+requests-per-minute limit, returning 429 with a retry-after header when exceeded, so
+the shared LLM gateway (common/llm.py) can be exercised without a real key:
+
+    python benchmarks/stub_llm.py --port 8090 --latency 0.5 --rpm 60
+    OPENAI_BASE_URL=http://localhost:8090/v1 OPENAI_API_KEY=stub uvicorn main:app
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import json
+import math
+import random
+import re
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List
+
+from aiohttp import web
+
+
+def completion(model: str, content: str, prompt_tokens: int, completion_tokens: int, call_id: int) -> Dict[str, Any]:
+    return {
+        "id": f"chatcmpl-stub-{call_id}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        },
+    }
+
+
+EMBEDDING_DIMENSIONS = 256
+
+
+def embed_text(text: str) -> List[float]:
+    vector = [0.0] * EMBEDDING_DIMENSIONS
+    for word in re.findall(r"[a-z0-9]+", text.lower()):
+        vector[int(hashlib.md5(word.encode()).hexdigest(), 16) % EMBEDDING_DIMENSIONS] += 1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class StubLLM:
+    def __init__(self, latency: float, jitter: float, rpm: int, error_rate: float, reply: str):
+        self.latency = latency
+        self.jitter = jitter
+        self.rpm = rpm
+        self.error_rate = error_rate
+        self.reply = reply
+        self.recent: Deque[float] = deque()
+        self.ids = itertools.count(1)
+        self.stats = {"calls": 0, "rate_limited": 0, "errors": 0}
+
+    def respond(self, messages: List[Dict[str, Any]]) -> str:
+        """Reply text for a conversation; override for stage-specific answers."""
+        return self.reply
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        now = time.monotonic()
+        while self.recent and now - self.recent[0] > 60:
+            self.recent.popleft()
+        if self.rpm and len(self.recent) >= self.rpm:
+            self.stats["rate_limited"] += 1
+            retry_after = max(0.1, 60 - (now - self.recent[0]))
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_exceeded", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"retry-after": f"{retry_after:.2f}"},
+            )
+        self.recent.append(now)
+        self.stats["calls"] += 1
+
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if self.error_rate and random.random() < self.error_rate:
+            self.stats["errors"] += 1
+            return web.json_response({"error": {"message": "Stub server error", "type": "server_error"}}, status=500)
+
+        messages = body.get("messages", [])
+        content = self.respond(messages)
+        prompt_tokens = sum(len(json.dumps(m.get("content", ""))) for m in messages) // 4
+        return web.json_response(
+            completion(body.get("model", "stub"), content, prompt_tokens, len(content) // 4, next(self.ids))
+        )
+
+    async def embeddings(self, request: web.Request) -> web.Response:
+        """Deterministic bag-of-words vectors, so similar texts get similar embeddings."""
+        body = await request.json()
+        texts = body.get("input", [])
+        if isinstance(texts, str):
+            texts = [texts]
+        self.stats["embeddings"] = self.stats.get("embeddings", 0) + len(texts)
+        data = [{"object": "embedding", "index": i, "embedding": embed_text(text)} for i, text in enumerate(texts)]
+        tokens = sum(len(text) for text in texts) // 4
+        return web.json_response({
+            "object": "list", "data": data, "model": body.get("model", "stub"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    async def get_stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.stats)
+
+    def app(self) -> web.Application:
+        application = web.Application()
+        application.router.add_post("/v1/chat/completions", self.chat_completions)
+        application.router.add_post("/v1/embeddings", self.embeddings)
+        application.router.add_get("/stats", self.get_stats)
+        return application
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible chat completions server")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--latency", type=float, default=0.5, help="Seconds per completion")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Uniform +/- seconds added to latency")
+    parser.add_argument("--rpm", type=int, default=0, help="Requests per minute before 429s (0 = unlimited)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of calls answered with 500")
+    parser.add_argument("--reply", default="stub response", help="Content of every completion")
+    args = parser.parse_args()
+    stub = StubLLM(args.latency, args.jitter, args.rpm, args.error_rate, args.reply)
+    web.run_app(stub.app(), port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Helpers shared by the KHWARIZMI services (copied into every service image)."""
@@ -0,0 +1,50 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+from common.metrics import EXECUTOR_TASKS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Upper bound on blocking / CPU-bound work (pandas, Plotly, Kaleido, sync DB calls)
+# running at the same time in one worker process.
+CPU_WORKERS = int(os.getenv("CPU_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """Return the process-wide bounded executor, creating it on first use."""
+    global _executor
+    if _executor is None:
+        logger.info("Starting bounded executor with %d workers", CPU_WORKERS)
+        _executor = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix="cpu-worker")
+    return _executor
+
+
+async def run_blocking(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run a blocking callable on the bounded executor without blocking the event loop.
+
+    The caller's context variables are carried over to the worker thread.
+    """
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    EXECUTOR_TASKS.inc()
+    try:
+        return await loop.run_in_executor(get_executor(), functools.partial(ctx.run, func, *args, **kwargs))
+    finally:
+        EXECUTOR_TASKS.dec()
+
+
+def shutdown_executor() -> None:
+    """Stop the bounded executor; safe to call when it was never started."""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
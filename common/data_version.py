@@ -0,0 +1,79 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, List, Optional
+
+from sqlalchemy import text
+
+from common.db import get_engine
+
+logger = logging.getLogger(__name__)
+
+# Seconds a fetched data version is trusted before Postgres is asked again.
+DATA_VERSION_TTL = float(os.getenv("DATA_VERSION_TTL", "5"))
+
+# Schema holding materialized rollups and their bookkeeping (common/rollups.py). It only
+# contains data derived from the other tables, so it is left out of the data version.
+ROLLUP_SCHEMA = os.getenv("ROLLUP_SCHEMA", "khwarizmi_rollups")
+
+# Fingerprint of every user table's modification counters. Inserts, updates and
+# deletes bump the tuple counters; TRUNCATE and table rewrites change the filenode;
+# created or dropped tables change the set of rows being hashed.
+DATA_VERSION_SQL = text("""
+    SELECT md5(COALESCE(string_agg(
+        relid::text || ':' || n_tup_ins || ':' || n_tup_upd || ':' || n_tup_del
+            || ':' || COALESCE(pg_relation_filenode(relid)::text, ''),
+        ',' ORDER BY relid
+    ), ''))
+    FROM pg_stat_user_tables
+    WHERE schemaname <> :rollup_schema
+""")
+
+UNKNOWN_VERSION = "unknown"
+
+
+class DataVersion:
+    """
+    Cheap signal of whether the data in Postgres has changed.
+
+    The version is read from pg_stat_user_tables at most once per ``ttl`` seconds.
+    Callbacks registered with ``subscribe`` run (in the calling thread) whenever a
+    newly read version differs from the previous one, so caches can drop stale entries.
+    """
+
+    def __init__(self, uri: str, ttl: float = DATA_VERSION_TTL):
+        self.uri = uri
+        self.ttl = ttl
+        self._version: Optional[str] = None
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[Optional[str], str], None]] = []
+
+    def subscribe(self, callback: Callable[[Optional[str], str], None]) -> None:
+        """Register ``callback(old_version, new_version)`` for data changes."""
+        self._listeners.append(callback)
+
+    def get(self) -> str:
+        """Return the current data version (blocking, run it on the executor)."""
+        with self._lock:
+            if self._version is not None and time.monotonic() - self._fetched_at < self.ttl:
+                return self._version
+            try:
+                with get_engine(self.uri).connect() as conn:
+                    version = conn.execute(DATA_VERSION_SQL, {"rollup_schema": ROLLUP_SCHEMA}).scalar() or ""
+            except Exception as e:
+                logger.warning("Could not read data version: %s", e)
+                return self._version or UNKNOWN_VERSION
+            previous = self._version
+            self._version = version
+            self._fetched_at = time.monotonic()
+
+        if previous is not None and previous != version:
+            logger.info("Data version changed %s -> %s", previous[:8], version[:8])
+            for callback in self._listeners:
+                try:
+                    callback(previous, version)
+                except Exception:
+                    logger.exception("Data version listener failed")
+        return version
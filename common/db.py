@@ -0,0 +1,54 @@
+import logging
+import threading
+from typing import Dict
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+from common import metrics, tracing
+from common.resilience import statement_timeout_ms
+
+logger = logging.getLogger(__name__)
+
+_engines: Dict[str, Engine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_engine(uri: str) -> Engine:
+    """Return a pooled SQLAlchemy engine, shared by every request for the same URI."""
+    if not uri:
+        raise ValueError("POSTGRES_URI is not set in environment variables.")
+    engine = _engines.get(uri)
+    if engine is None:
+        with _engines_lock:
+            engine = _engines.get(uri)
+            if engine is None:
+                logger.info("Creating SQLAlchemy engine")
+                engine = create_engine(uri, pool_pre_ping=True, pool_size=5, max_overflow=10)
+                tracing.instrument_engine(engine)
+                metrics.instrument_engine(engine)
+                apply_deadlines(engine)
+                _engines[uri] = engine
+    return engine
+
+
+def apply_deadlines(engine: Engine) -> None:
+    """Cap statements with the current request's remaining deadline (set on checkout, cleared for callers without one)."""
+
+    @event.listens_for(engine.pool, "checkout")
+    def set_statement_timeout(dbapi_connection, connection_record, connection_proxy):
+        timeout = statement_timeout_ms()
+        if timeout is None and not connection_record.info.get("statement_timeout"):
+            return
+        cursor = dbapi_connection.cursor()
+        try:
+            cursor.execute("SET statement_timeout = %s", (timeout or 0,))
+        finally:
+            cursor.close()
+        connection_record.info["statement_timeout"] = timeout or 0
+
+
+def dispose_engines() -> None:
+    """Drop pooled connections inherited from a parent process (call after fork)."""
+    for engine in _engines.values():
+        engine.dispose(close=False)
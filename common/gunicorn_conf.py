@@ -0,0 +1,66 @@
+"""
+Gunicorn settings for SERVER_MODE=production.
+
+All values can be overridden through environment variables:
+
+WEB_CONCURRENCY      number of uvicorn worker processes (default: available cores)
+PRELOAD_APP          import the app once in the master before forking (default: true)
+PRELOAD_MODULES      comma-separated heavy modules to import in the master, e.g. "pandas,plotly.express"
+MAX_REQUESTS         recycle a worker after this many requests to cap memory (default: 500, 0 disables)
+MAX_REQUESTS_JITTER  random spread so workers do not all restart together (default: 50)
+WORKER_TIMEOUT       seconds a silent worker is allowed before it is killed (default: 180)
+GRACEFUL_TIMEOUT     seconds in-flight requests get to finish on restart (default: 30)
+PROMETHEUS_MULTIPROC_DIR  where workers write metric samples for /metrics (default: /tmp/khwarizmi-metrics)
+"""
+import glob
+import importlib
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name, "").strip()
+    return int(value) if value else default
+
+
+def _available_cores() -> int:
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = _env_int("WEB_CONCURRENCY", _available_cores())
+preload_app = os.getenv("PRELOAD_APP", "true").strip().lower() in ("1", "true", "yes")
+max_requests = _env_int("MAX_REQUESTS", 500)
+max_requests_jitter = _env_int("MAX_REQUESTS_JITTER", 50)
+timeout = _env_int("WORKER_TIMEOUT", 180)
+graceful_timeout = _env_int("GRACEFUL_TIMEOUT", 30)
+keepalive = 5
+accesslog = "-"
+errorlog = "-"
+
+# Set before the app (and prometheus_client) is imported so every process writes its
+# samples to files that /metrics can aggregate; files from a previous run are removed.
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/khwarizmi-metrics")
+os.makedirs(metrics_dir, exist_ok=True)
+for stale in glob.glob(os.path.join(metrics_dir, "*.db")):
+    os.remove(stale)
+
+
+def on_starting(server):
+    for module in filter(None, (m.strip() for m in os.getenv("PRELOAD_MODULES", "").split(","))):
+        server.log.info("Preloading %s", module)
+        importlib.import_module(module)
+
+
+def post_fork(server, worker):
+    # Connections opened while preloading belong to the master; give each worker its own pool.
+    from common.db import dispose_engines
+    dispose_engines()
+
+
+def child_exit(server, worker):
+    # Drop the worker's live gauges (in-flight, queue depth) so they stop counting towards the total.
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,66 @@
+"""LangChain adapters for common.llm (imported lazily so services without LangChain stay light)."""
+import json
+from typing import Any, List, Optional
+
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatResult
+from langchain_openai import ChatOpenAI
+from pydantic import PrivateAttr
+
+from common.llm import LLM_EXPECTED_COMPLETION_TOKENS, LLMGateway, estimate_tokens
+
+
+class GatewayChatOpenAI(ChatOpenAI):
+    """
+    ChatOpenAI whose requests go through ``LLMGateway._call``, like ``LLMGateway.chat``.
+
+    Each request reserves RPM/TPM budget sized from its messages in the caller's priority
+    lane, settles it against the reported usage, and is retried by the gateway alone (the
+    SDK's own retries are off, so every 429 is seen by the limiter). Streaming is disabled,
+    so ``astream`` (used by agents) also makes one budgeted request. Synchronous calls
+    (``invoke``) take the same path through ``LLMGateway._call_blocking`` and the gateway's
+    sync HTTP client, blocking the calling thread; run them off the event loop.
+    """
+
+    _gateway: LLMGateway = PrivateAttr()
+    _stage: str = PrivateAttr()
+
+    def _reservation(self, messages: List[BaseMessage], kwargs: Any) -> int:
+        prompt = estimate_tokens([{"content": message.content} for message in messages])
+        # Tool schemas bound by agents are sent with every request.
+        prompt += len(json.dumps(kwargs.get("tools") or [])) // 4
+        return prompt + int(kwargs.get("max_tokens") or self.max_tokens or LLM_EXPECTED_COMPLETION_TOKENS)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        generate = super()._agenerate
+        return await self._gateway._call(
+            self._stage, self.model_name, self._reservation(messages, kwargs), None,
+            lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            usage_of=lambda result: (result.llm_output or {}).get("token_usage"),
+        )
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        generate = super()._generate
+        return self._gateway._call_blocking(
+            self._stage, self.model_name, self._reservation(messages, kwargs), None,
+            lambda: generate(messages, stop=stop, run_manager=run_manager, **kwargs),
+            usage_of=lambda result: (result.llm_output or {}).get("token_usage"),
+        )
+
+
+def build_chat_model(gateway: LLMGateway, model: str, stage: str, temperature: float = 0.0,
+                     **kwargs: Any) -> GatewayChatOpenAI:
+    chat_model = GatewayChatOpenAI(
+        model=model,
+        temperature=temperature,
+        http_client=gateway.sync_http_client,
+        http_async_client=gateway.http_client,
+        max_retries=0,
+        disable_streaming=True,
+        **kwargs,
+    )
+    chat_model._gateway = gateway
+    chat_model._stage = stage
+    return chat_model
@@ -0,0 +1,481 @@
+"""
+Shared LLM client layer used by every service.
+
+All OpenAI traffic from a process goes through one ``LLMGateway``:
+
+- one pooled HTTP client (connection reuse across calls and services' LangChain models)
+- token-bucket scheduling against requests-per-minute and tokens-per-minute budgets
+- priority lanes: interactive callers are served before batch callers when budget is short
+- adaptive backoff: a 429 pauses the whole process for the provider's retry-after and
+  lowers the effective rate, which recovers gradually on success (AIMD)
+- per-call latency and token metrics, grouped by stage and model
+- per-stage model routing with escalation to a stronger model (ModelRouter)
+
+Budgets are per process; set LLM_RPM / LLM_TPM to the provider limit divided by the
+number of processes sharing the key. Point OPENAI_BASE_URL at a stub server
+(see benchmarks/stub_llm.py) to exercise it locally.
+"""
+import asyncio
+import heapq
+import itertools
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional, Tuple
+
+import httpx
+from openai import APIConnectionError, APITimeoutError, AsyncOpenAI, InternalServerError, RateLimitError
+
+from common.metrics import LLM_QUEUE_DEPTH, LLM_SECONDS, LLM_TOKENS
+from common.resilience import check_deadline, within_deadline
+from common.tracing import span
+
+logger = logging.getLogger(__name__)
+
+LLM_RPM = float(os.getenv("LLM_RPM", "500"))
+LLM_TPM = float(os.getenv("LLM_TPM", "200000"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "5"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "120"))
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "50"))
+# Completion tokens reserved up front when a call does not set max_tokens.
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "512"))
+# How often a synchronous caller re-checks the budget while async callers are queued.
+LLM_SYNC_POLL_SECONDS = 0.05
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+# Model tiers. LLM_STAGE_MODELS pins stages to a tier or a model name, e.g.
+# "reformulate=fast,sql=gpt-4o"; pinned stages ignore the model a request asks for.
+LLM_FAST_MODEL = os.getenv("LLM_FAST_MODEL", "gpt-4o-mini")
+LLM_STRONG_MODEL = os.getenv("LLM_STRONG_MODEL", "gpt-4o")
+LLM_STAGE_MODELS = os.getenv("LLM_STAGE_MODELS", "")
+LLM_DEFAULT_TIER = os.getenv("LLM_DEFAULT_TIER", "fast")
+LLM_EMBEDDING_MODEL = os.getenv("LLM_EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Priority of the request being served; set from the X-Priority header by add_priority_middleware.
+request_priority: ContextVar[str] = ContextVar("request_priority", default="interactive")
+
+
+def estimate_tokens(messages: List[Dict[str, Any]]) -> int:
+    """Rough prompt size (~4 characters per token) used for budgeting before the call."""
+    chars = 0
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            chars += sum(len(part.get("text", "")) for part in content if isinstance(part, dict))
+    return chars // 4 + 4 * len(messages)
+
+
+def parse_retry_after(headers: Any) -> Optional[float]:
+    """Seconds to wait from retry-after-ms / retry-after headers, if present."""
+    if headers is None:
+        return None
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+class TokenBucket:
+    """Continuously refilling budget; ``rate`` is units per minute."""
+
+    def __init__(self, rate_per_minute: float):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60.0
+        self.level = rate_per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, scale: float) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate * scale)
+        self.updated = now
+
+    def wait_time(self, amount: float, scale: float) -> float:
+        self._refill(scale)
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / (self.rate * scale)
+
+    def take(self, amount: float) -> None:
+        self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float) -> None:
+        """Refund (positive) or charge (negative) after the real usage is known."""
+        self.level = min(self.capacity, self.level + delta)
+
+
+class RateLimiter:
+    """
+    Schedules calls against RPM and TPM buckets with priority lanes and AIMD backoff.
+
+    Waiting callers form a heap ordered by (priority, arrival); only the head may take
+    budget, so a batch caller never overtakes an interactive one. Synchronous callers
+    (``acquire_blocking``, from worker threads) share the budget but not the heap: they
+    take budget only while no async caller is waiting.
+    """
+
+    def __init__(self, rpm: float = LLM_RPM, tpm: float = LLM_TPM):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.scale = 1.0  # fraction of the configured rate currently in use
+        self.blocked_until = 0.0
+        self._waiters: List[Tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._changed: Optional[asyncio.Condition] = None
+        # Guards the buckets, which synchronous callers touch from other threads.
+        self._lock = threading.Lock()
+
+    def _condition(self) -> asyncio.Condition:
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        return self._changed
+
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _take(self, tokens: int) -> float:
+        """Take one request and ``tokens`` if both are available now; otherwise the seconds to wait."""
+        with self._lock:
+            wait = max(
+                self.blocked_until - time.monotonic(),
+                self.requests.wait_time(1, self.scale),
+                self.tokens.wait_time(tokens, self.scale),
+            )
+            if wait <= 0:
+                self.requests.take(1)
+                self.tokens.take(tokens)
+        return wait
+
+    async def acquire(self, tokens: int, priority: str = "interactive") -> None:
+        ticket = (PRIORITIES.get(priority, max(PRIORITIES.values())), next(self._sequence))
+        changed = self._condition()
+        async with changed:
+            heapq.heappush(self._waiters, ticket)
+            LLM_QUEUE_DEPTH.labels(priority).inc()
+            try:
+                while True:
+                    if self._waiters[0] == ticket:
+                        wait = self._take(tokens)
+                        if wait <= 0:
+                            return
+                        try:
+                            await asyncio.wait_for(changed.wait(), timeout=wait)
+                        except asyncio.TimeoutError:
+                            pass
+                    else:
+                        await changed.wait()
+            finally:
+                LLM_QUEUE_DEPTH.labels(priority).dec()
+                self._waiters.remove(ticket)
+                heapq.heapify(self._waiters)
+                changed.notify_all()
+
+    def acquire_blocking(self, tokens: int, priority: str = "interactive") -> None:
+        """``acquire`` for a synchronous caller: sleeps the calling thread until budget is free."""
+        LLM_QUEUE_DEPTH.labels(priority).inc()
+        try:
+            while True:
+                wait = LLM_SYNC_POLL_SECONDS if self._waiters else self._take(tokens)
+                if wait <= 0:
+                    return
+                time.sleep(wait)
+        finally:
+            LLM_QUEUE_DEPTH.labels(priority).dec()
+
+    def settle(self, reserved_tokens: int, used_tokens: int) -> None:
+        with self._lock:
+            self.tokens.adjust(reserved_tokens - used_tokens)
+
+    def on_rate_limited(self, retry_after: Optional[float]) -> float:
+        """Pause everyone until retry-after and halve the effective rate. Returns the pause."""
+        pause = retry_after if retry_after is not None else 1.0 / max(self.scale, 0.1)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+        self.scale = max(0.1, self.scale * 0.5)
+        logger.warning("LLM rate limited: pausing %.1fs, rate scaled to %.0f%%", pause, self.scale * 100)
+        return pause
+
+    def on_success(self) -> None:
+        if self.scale < 1.0:
+            self.scale = min(1.0, self.scale + 0.05)
+
+
+class ModelRouter:
+    """
+    Chooses the model for each pipeline stage.
+
+    A stage pinned in LLM_STAGE_MODELS always uses its pinned model; otherwise the
+    model requested by the caller is used, falling back to the default tier. When a
+    stage's output fails validation, ``escalate`` names the stronger model to retry with.
+    """
+
+    def __init__(self, fast: str = LLM_FAST_MODEL, strong: str = LLM_STRONG_MODEL,
+                 stage_models: str = LLM_STAGE_MODELS, default_tier: str = LLM_DEFAULT_TIER):
+        self.tiers = {"fast": fast, "strong": strong}
+        self.default = self.resolve(default_tier)
+        self.pinned: Dict[str, str] = {}
+        for part in filter(None, (p.strip() for p in stage_models.split(","))):
+            stage, _, model = part.partition("=")
+            self.pinned[stage.strip()] = self.resolve(model.strip())
+
+    def resolve(self, name: str) -> str:
+        """Map a tier name to its model; any other value is taken as a model name."""
+        return self.tiers.get(name, name)
+
+    def route(self, stage: str, requested: Optional[str] = None) -> str:
+        if stage in self.pinned:
+            return self.pinned[stage]
+        return self.resolve(requested) if requested else self.default
+
+    def escalate(self, model: str) -> Optional[str]:
+        """Stronger model to retry with after a validation failure, or None if already strongest."""
+        strong = self.tiers["strong"]
+        return strong if model != strong else None
+
+
+model_router = ModelRouter()
+
+
+class LLMMetrics:
+    """Aggregated per (stage, model) call statistics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls: Dict[Tuple[str, str], Dict[str, float]] = {}
+
+    def record(self, stage: str, model: str, latency: float, prompt_tokens: int = 0,
+               completion_tokens: int = 0, cached_tokens: int = 0, status: str = "ok") -> None:
+        with self._lock:
+            entry = self.calls.setdefault((stage, model), {
+                "calls": 0, "errors": 0, "rate_limited": 0, "latency_s": 0.0, "max_latency_s": 0.0,
+                "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0,
+            })
+            entry["calls"] += 1
+            if status == "rate_limited":
+                entry["rate_limited"] += 1
+            elif status != "ok":
+                entry["errors"] += 1
+            entry["latency_s"] += latency
+            entry["max_latency_s"] = max(entry["max_latency_s"], latency)
+            entry["prompt_tokens"] += prompt_tokens
+            entry["completion_tokens"] += completion_tokens
+            entry["cached_tokens"] += cached_tokens
+        LLM_SECONDS.labels(stage, model, status).observe(latency)
+        for kind, count in (("prompt", prompt_tokens), ("completion", completion_tokens), ("cached", cached_tokens)):
+            if count:
+                LLM_TOKENS.labels(stage, model, kind).inc(count)
+        logger.info(
+            "LLM call stage=%s model=%s status=%s latency=%.2fs prompt_tokens=%d completion_tokens=%d cached_tokens=%d",
+            stage, model, status, latency, prompt_tokens, completion_tokens, cached_tokens,
+        )
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {"stage": stage, "model": model, **values,
+                 "mean_latency_s": round(values["latency_s"] / values["calls"], 3) if values["calls"] else 0.0,
+                 # Share of prompt tokens served from the provider's prompt cache.
+                 "cached_ratio": round(values["cached_tokens"] / values["prompt_tokens"], 3)
+                 if values["prompt_tokens"] else 0.0}
+                for (stage, model), values in self.calls.items()
+            ]
+
+
+def usage_counts(usage: Any) -> Tuple[int, int, int]:
+    """(prompt, completion, cached prompt) tokens from an OpenAI usage object or dict."""
+    if usage is None:
+        return 0, 0, 0
+    get = usage.get if isinstance(usage, dict) else lambda key, default=None: getattr(usage, key, default)
+    details = get("prompt_tokens_details", None)
+    if details is None:
+        cached = 0
+    elif isinstance(details, dict):
+        cached = details.get("cached_tokens") or 0
+    else:
+        cached = getattr(details, "cached_tokens", 0) or 0
+    return get("prompt_tokens", 0) or 0, get("completion_tokens", 0) or 0, cached
+
+
+class LLMGateway:
+    """Process-wide entry point for chat completions; obtain it with get_llm_gateway()."""
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.limiter = RateLimiter()
+        self.metrics = LLMMetrics()
+        limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+        timeout = httpx.Timeout(LLM_TIMEOUT, connect=10.0)
+        self.http_client = httpx.AsyncClient(limits=limits, timeout=timeout,
+                                             event_hooks={"response": [self._observe_response]})
+        # For synchronous LangChain calls, which cannot use the async client.
+        self.sync_http_client = httpx.Client(limits=limits, timeout=timeout,
+                                             event_hooks={"response": [self._observe_sync_response]})
+        # Retries are ours (budget-aware), not the SDK's.
+        self.client = AsyncOpenAI(api_key=api_key or os.getenv("OPENAI_API_KEY"),
+                                  http_client=self.http_client, max_retries=0)
+
+    async def _observe_response(self, response: httpx.Response) -> None:
+        # Also sees LangChain traffic sharing this HTTP client, so its 429s slow everyone down.
+        self._observe_sync_response(response)
+
+    def _observe_sync_response(self, response: httpx.Response) -> None:
+        if response.status_code == 429:
+            self.limiter.on_rate_limited(parse_retry_after(response.headers))
+
+    def _failed(self, stage: str, model: str, started: float, reserved: int, error: Exception,
+                attempt: int) -> Optional[float]:
+        """Account for a failed attempt; returns the delay before retrying, or None to re-raise."""
+        rate_limited = isinstance(error, RateLimitError)
+        self.metrics.record(stage, model, time.perf_counter() - started,
+                            status="rate_limited" if rate_limited else "error")
+        self.limiter.settle(reserved, 0)
+        if not isinstance(error, RETRYABLE_ERRORS) or attempt > LLM_MAX_RETRIES:
+            return None
+        if rate_limited:
+            # The response hook already paused the limiter; the next acquire waits it out.
+            logger.info("Retrying %s call after 429 (attempt %d)", stage, attempt)
+            return 0.0
+        return min(30.0, 2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+
+    def _succeeded(self, stage: str, model: str, started: float, reserved: int, usage: Any,
+                   attempt: int, current) -> None:
+        prompt_tokens, completion_tokens, cached_tokens = usage_counts(usage)
+        self.limiter.settle(reserved, prompt_tokens + completion_tokens)
+        self.limiter.on_success()
+        self.metrics.record(stage, model, time.perf_counter() - started,
+                            prompt_tokens, completion_tokens, cached_tokens)
+        current.set_attributes({
+            "llm.attempts": attempt,
+            "llm.prompt_tokens": prompt_tokens,
+            "llm.completion_tokens": completion_tokens,
+            "llm.cached_tokens": cached_tokens,
+        })
+
+    async def _call(self, stage: str, model: str, reserved: int, priority: Optional[str], create,
+                    usage_of=lambda response: response.usage):
+        """Run ``create()`` under the rate limiter with budget-aware retries; returns its response.
+
+        ``usage_of`` reads the token usage from the response (an OpenAI usage object or dict).
+        """
+        priority = priority or request_priority.get()
+        attempt = 0
+        with span(f"llm.{stage}", **{"llm.model": model, "llm.stage": stage, "llm.priority": priority}) as current:
+            while True:
+                attempt += 1
+                # Past the caller's deadline nobody is waiting for the answer: stop retrying and queueing.
+                check_deadline(f"{stage} LLM call")
+                await within_deadline(self.limiter.acquire(reserved, priority), f"{stage} rate-limit wait")
+                started = time.perf_counter()
+                try:
+                    response = await within_deadline(create(), f"{stage} LLM call")
+                except Exception as e:
+                    delay = self._failed(stage, model, started, reserved, e, attempt)
+                    if delay is None:
+                        raise
+                    await asyncio.sleep(delay)
+                    continue
+                self._succeeded(stage, model, started, reserved, usage_of(response), attempt, current)
+                return response
+
+    def _call_blocking(self, stage: str, model: str, reserved: int, priority: Optional[str], create,
+                       usage_of=lambda response: response.usage):
+        """``_call`` for synchronous callers (worker threads): same budget, retries and metrics.
+
+        The deadline is checked before each attempt but cannot interrupt one in progress.
+        """
+        priority = priority or request_priority.get()
+        attempt = 0
+        with span(f"llm.{stage}", **{"llm.model": model, "llm.stage": stage, "llm.priority": priority}) as current:
+            while True:
+                attempt += 1
+                check_deadline(f"{stage} LLM call")
+                self.limiter.acquire_blocking(reserved, priority)
+                started = time.perf_counter()
+                try:
+                    response = create()
+                except Exception as e:
+                    delay = self._failed(stage, model, started, reserved, e, attempt)
+                    if delay is None:
+                        raise
+                    time.sleep(delay)
+                    continue
+                self._succeeded(stage, model, started, reserved, usage_of(response), attempt, current)
+                return response
+
+    async def chat(self, messages: List[Dict[str, Any]], model: str, stage: str,
+                   priority: Optional[str] = None, **kwargs: Any):
+        """Rate-limited, retried chat completion. Returns the OpenAI ChatCompletion."""
+        reserved = estimate_tokens(messages) + int(kwargs.get("max_tokens") or LLM_EXPECTED_COMPLETION_TOKENS)
+        return await self._call(
+            stage, model, reserved, priority,
+            lambda: self.client.chat.completions.create(model=model, messages=messages, **kwargs),
+        )
+
+    async def embed(self, texts: List[str], stage: str, model: str = LLM_EMBEDDING_MODEL,
+                    priority: Optional[str] = None) -> List[List[float]]:
+        """Rate-limited, retried embeddings; one vector per input text, in order."""
+        reserved = sum(len(text) for text in texts) // 4 + len(texts)
+        response = await self._call(
+            stage, model, reserved, priority,
+            lambda: self.client.embeddings.create(model=model, input=texts),
+        )
+        return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+    def chat_model(self, model: str, stage: str, temperature: float = 0.0, **kwargs: Any):
+        """LangChain ChatOpenAI that shares this gateway's HTTP pools, budgets, retries and metrics."""
+        from common.langchain_llm import build_chat_model
+
+        return build_chat_model(self, model, stage, temperature, **kwargs)
+
+    async def aclose(self) -> None:
+        await self.http_client.aclose()
+        self.sync_http_client.close()
+
+
+_gateway: Optional[LLMGateway] = None
+_gateway_lock = threading.Lock()
+
+
+def get_llm_gateway() -> LLMGateway:
+    global _gateway
+    if _gateway is None:
+        with _gateway_lock:
+            if _gateway is None:
+                _gateway = LLMGateway()
+    return _gateway
+
+
+def add_llm_stats_route(app) -> None:
+    """Expose this process's LLM call statistics (latency, tokens, cached-token ratio) at /llm/stats."""
+
+    @app.get("/llm/stats")
+    async def llm_stats():
+        gateway = get_llm_gateway()
+        return {
+            "calls": gateway.metrics.snapshot(),
+            "queue_depth": gateway.limiter.queue_depth(),
+            "rate_scale": gateway.limiter.scale,
+        }
+
+
+def add_priority_middleware(app) -> None:
+    """Read the caller's lane from the X-Priority header (interactive by default)."""
+
+    @app.middleware("http")
+    async def priority_middleware(request, call_next):
+        priority = request.headers.get("x-priority", "interactive").lower()
+        token = request_priority.set(priority if priority in PRIORITIES else "interactive")
+        try:
+            return await call_next(request)
+        finally:
+            request_priority.reset(token)
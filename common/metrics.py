@@ -0,0 +1,161 @@
+"""
+Prometheus metrics shared by every service.
+
+``add_metrics(app)`` serves GET /metrics in the Prometheus text format and records a
+latency histogram per endpoint (by route template, not raw path) plus the number of
+requests in flight. The other metrics are updated where the work happens: LLM calls in
+LLMMetrics.record, DB statements and pool checkouts through SQLAlchemy engine events,
+chart renders in query-to-plots, pipeline stages in the gateway.
+
+Under gunicorn every worker is a separate process, so common/gunicorn_conf.py sets
+PROMETHEUS_MULTIPROC_DIR; each process then writes its samples there and /metrics
+aggregates all of them, whichever worker answers the scrape.
+"""
+import os
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+
+# Seconds; LLM calls and whole pipeline stages are much slower than HTTP handlers or SQL.
+FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1, 2, 4, 8, 15, 30, 60, 120, 300)
+ROW_BUCKETS = (0, 1, 10, 100, 1_000, 10_000, 100_000, 1_000_000)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by endpoint",
+    ["method", "route", "status"], buckets=SLOW_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests currently being handled", multiprocess_mode="livesum",
+)
+
+STAGE_SECONDS = Histogram(
+    "pipeline_stage_duration_seconds", "Gateway time per pipeline stage, including the wait for a stage slot",
+    ["stage"], buckets=SLOW_BUCKETS,
+)
+STAGE_WAIT_SECONDS = Histogram(
+    "pipeline_stage_wait_seconds", "Time spent waiting for a stage concurrency slot",
+    ["stage"], buckets=FAST_BUCKETS,
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "job_queue_depth", "Batch jobs waiting for a worker", ["priority"], multiprocess_mode="livesum",
+)
+
+LLM_SECONDS = Histogram(
+    "llm_request_duration_seconds", "LLM call latency",
+    ["stage", "model", "status"], buckets=SLOW_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "llm_tokens", "LLM tokens used; kind is prompt, completion or cached (prompt tokens served from cache)",
+    ["stage", "model", "kind"],
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_queue_depth", "Calls waiting for rate-limit budget", ["priority"], multiprocess_mode="livesum",
+)
+
+DB_QUERY_SECONDS = Histogram("db_query_duration_seconds", "SQL statement execution time", buckets=FAST_BUCKETS)
+DB_ROWS = Histogram("db_rows_returned", "Rows returned per query", buckets=ROW_BUCKETS)
+DB_POOL_IN_USE = Gauge(
+    "db_pool_connections_in_use", "Pooled connections checked out", multiprocess_mode="livesum",
+)
+DB_POOL_CONNECTS = Counter("db_pool_connections_opened", "New database connections opened by the pool")
+
+EXECUTOR_TASKS = Gauge(
+    "executor_tasks", "Blocking calls queued or running on the bounded executor", multiprocess_mode="livesum",
+)
+CHART_RENDER_SECONDS = Histogram(
+    "chart_render_duration_seconds", "Chart build (render) and PNG export (export) time",
+    ["chart_type", "phase"], buckets=FAST_BUCKETS,
+)
+ADMISSION_IN_USE = Gauge(
+    "admission_slots_in_use", "Admission slots held, per limiter", ["limiter"], multiprocess_mode="livesum",
+)
+ADMISSION_QUEUED = Gauge(
+    "admission_queue_depth", "Callers waiting for an admission slot", ["limiter"], multiprocess_mode="livesum",
+)
+ADMISSION_REJECTED = Counter(
+    "admission_rejected", "Requests shed by admission control", ["limiter", "reason"],
+)
+SPECULATIVE_SQL_RUNS = Counter(
+    "speculative_sql_runs", "Speculative SQL generations by outcome (hit, miss, failed)", ["outcome"],
+)
+CACHE_REQUESTS = Counter("cache_requests", "Cache lookups by outcome", ["cache", "result"])
+SINGLEFLIGHT_CALLS = Counter(
+    "singleflight_calls", "Calls that started work (leader) or joined an in-flight call (follower)",
+    ["name", "role"],
+)
+
+
+def render_metrics() -> bytes:
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def add_metrics(app) -> None:
+    """Serve /metrics and time every other request by route template."""
+    from fastapi import Response
+
+    @app.middleware("http")
+    async def metrics_middleware(request, call_next):
+        if request.url.path == "/metrics":
+            return await call_next(request)
+        REQUESTS_IN_FLIGHT.inc()
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            REQUESTS_IN_FLIGHT.dec()
+            route = request.scope.get("route")
+            REQUEST_SECONDS.labels(
+                request.method, getattr(route, "path", "unmatched"), str(status)
+            ).observe(time.perf_counter() - started)
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics():
+        return Response(render_metrics(), media_type=CONTENT_TYPE_LATEST)
+
+
+def instrument_engine(engine) -> None:
+    """Statement time, rows returned and pool usage for ``engine``."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.get("metrics_started")
+        if not started:
+            return
+        DB_QUERY_SECONDS.observe(time.perf_counter() - started.pop())
+        # Server-side cursors report -1 here; stream_query records their rows itself.
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            DB_ROWS.observe(cursor.rowcount)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        started = conn.info.get("metrics_started") if conn is not None else None
+        if started:
+            DB_QUERY_SECONDS.observe(time.perf_counter() - started.pop())
+
+    @event.listens_for(engine.pool, "connect")
+    def connect(dbapi_connection, connection_record):
+        DB_POOL_CONNECTS.inc()
+
+    @event.listens_for(engine.pool, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        DB_POOL_IN_USE.inc()
+
+    @event.listens_for(engine.pool, "checkin")
+    def checkin(dbapi_connection, connection_record):
+        DB_POOL_IN_USE.dec()
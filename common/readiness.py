@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Callable, Dict, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse
+
+from common.concurrency import run_blocking
+
+logger = logging.getLogger(__name__)
+
+# How long a request waits for a component that is still warming up before getting a 503.
+READY_WAIT_SECONDS = float(os.getenv("READY_WAIT_SECONDS", "30"))
+# Backoff between failed warm-up attempts (doubles up to WARMUP_MAX_RETRY_SECONDS).
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "2"))
+WARMUP_MAX_RETRY_SECONDS = float(os.getenv("WARMUP_MAX_RETRY_SECONDS", "30"))
+
+
+class _Component:
+    def __init__(self, name: str, loader: Callable[[], Any]):
+        self.name = name
+        self.loader = loader
+        self.value: Any = None
+        self.state = "pending"
+        self.error: Optional[str] = None
+        self.attempts = 0
+        self.load_seconds: Optional[float] = None
+        self.loaded = asyncio.Event()
+
+
+class Readiness:
+    """
+    Warms up heavy service components (agents, schemas, renderers) in the background.
+
+    Components are registered with a blocking loader that runs on the bounded executor
+    after startup. Failures are logged and retried with backoff instead of crashing the
+    process, so /health answers immediately and /ready reports when everything is warm.
+    """
+
+    def __init__(self, service: str):
+        self.service = service
+        self.started_at = time.monotonic()
+        self._components: Dict[str, _Component] = {}
+        self._tasks: list = []
+
+    def register(self, name: str, loader: Callable[[], Any]) -> None:
+        self._components[name] = _Component(name, loader)
+
+    async def _warm(self, component: _Component) -> None:
+        delay = WARMUP_RETRY_SECONDS
+        while True:
+            component.attempts += 1
+            started = time.perf_counter()
+            try:
+                component.value = await run_blocking(component.loader)
+            except Exception as e:
+                component.state = "failed"
+                component.error = str(e)
+                logger.error("Warm-up of %s failed (attempt %d): %s", component.name, component.attempts, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, WARMUP_MAX_RETRY_SECONDS)
+                continue
+            component.load_seconds = round(time.perf_counter() - started, 3)
+            component.state = "ready"
+            component.error = None
+            component.loaded.set()
+            logger.info("%s ready in %.3fs", component.name, component.load_seconds)
+            return
+
+    def start(self) -> None:
+        """Schedule warm-up of every registered component on the running loop."""
+        for component in self._components.values():
+            self._tasks.append(asyncio.create_task(self._warm(component)))
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    @property
+    def ready(self) -> bool:
+        return all(c.state == "ready" for c in self._components.values())
+
+    async def get(self, name: str, timeout: float = READY_WAIT_SECONDS) -> Any:
+        """Return a warmed component, waiting up to ``timeout`` seconds; raises 503 otherwise."""
+        component = self._components[name]
+        if component.state != "ready":
+            try:
+                await asyncio.wait_for(component.loaded.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(
+                    status_code=503,
+                    detail=f"{name} is not ready yet",
+                    headers={"Retry-After": str(int(WARMUP_RETRY_SECONDS) or 1)},
+                )
+        return component.value
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "service": self.service,
+            "ready": self.ready,
+            "uptime_s": round(time.monotonic() - self.started_at, 3),
+            "components": {
+                c.name: {
+                    "state": c.state,
+                    "attempts": c.attempts,
+                    "load_seconds": c.load_seconds,
+                    "error": c.error,
+                }
+                for c in self._components.values()
+            },
+        }
+
+
+def add_health_routes(app: FastAPI, readiness: Readiness) -> None:
+    """Expose /health (liveness, never touches heavy components) and /ready (warm-up status)."""
+
+    @app.get("/health")
+    async def health_check():
+        return {"status": "healthy", "service": readiness.service}
+
+    @app.get("/ready")
+    async def readiness_check():
+        return JSONResponse(status_code=200 if readiness.ready else 503, content=readiness.status())
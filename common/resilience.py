@@ -0,0 +1,244 @@
+"""
+Deadlines, circuit breakers and hedged requests between the gateway and the agents.
+
+Deadlines: the gateway gives every pipeline run an end-to-end budget and sends the
+remaining seconds to each service in the X-Request-Timeout header. ``add_deadline_middleware``
+turns that into ``request_deadline`` for the request; the context variable is copied into
+single-flight tasks and executor threads, so the LLM gateway stops retrying or waiting for
+rate-limit budget once it passes and ``statement_timeout_ms`` caps SQL statements.
+
+Circuit breakers: after CIRCUIT_FAILURE_THRESHOLD consecutive failures a dependency is
+skipped for CIRCUIT_RESET_TIMEOUT seconds, then a single probe decides whether it closes.
+
+Hedging: ``hedged`` starts a duplicate of a slow idempotent call on another replica and
+keeps whichever answers first.
+
+Disconnects: the gateway cancels calls it no longer needs (the losing hedge, a discarded
+speculative SQL call) by closing the connection. ``cancel_on_disconnect`` notices that on
+the receiving side and cancels the handler's work.
+"""
+import asyncio
+import contextvars
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DEADLINE_HEADER = "X-Request-Timeout"
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))
+# Seconds between checks of whether the caller of a long request has gone away.
+DISCONNECT_POLL_INTERVAL = float(os.getenv("DISCONNECT_POLL_INTERVAL", "1"))
+
+# Monotonic time by which the current request must be answered; None means no deadline.
+request_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+def remaining() -> Optional[float]:
+    """Seconds left before the current deadline (never negative), or None without one."""
+    deadline = request_deadline.get()
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+def check_deadline(what: str = "request") -> None:
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f"Deadline passed before {what}")
+
+
+def set_deadline(seconds: float) -> contextvars.Token:
+    """Start a budget of ``seconds``, or keep the current deadline if it is earlier."""
+    deadline = time.monotonic() + seconds
+    current = request_deadline.get()
+    return request_deadline.set(deadline if current is None else min(current, deadline))
+
+
+async def within_deadline(awaitable: Awaitable[T], what: str = "call") -> T:
+    """Await ``awaitable``, cancelling it when the current deadline passes."""
+    left = remaining()
+    if left is None:
+        return await awaitable
+    try:
+        return await asyncio.wait_for(awaitable, left)
+    except asyncio.TimeoutError:
+        raise DeadlineExceeded(f"Deadline passed during {what}") from None
+
+
+def deadline_headers(headers: Dict[str, str]) -> Dict[str, str]:
+    left = remaining()
+    if left is not None:
+        headers[DEADLINE_HEADER] = f"{left:.3f}"
+    return headers
+
+
+def statement_timeout_ms() -> Optional[int]:
+    """Postgres statement_timeout for the rest of the deadline (at least 1 ms), or None."""
+    left = remaining()
+    return None if left is None else max(1, int(left * 1000))
+
+
+def add_deadline_middleware(app) -> None:
+    """Honour the caller's X-Request-Timeout: expose it as request_deadline and answer 504 when it passes."""
+    from fastapi.responses import JSONResponse
+
+    @app.middleware("http")
+    async def deadline_middleware(request, call_next):
+        value = request.headers.get(DEADLINE_HEADER.lower())
+        try:
+            seconds = float(value) if value else None
+        except ValueError:
+            seconds = None
+        if seconds is None:
+            return await call_next(request)
+        token = set_deadline(seconds)
+        try:
+            return await within_deadline(call_next(request), f"{request.method} {request.url.path}")
+        except DeadlineExceeded as e:
+            logger.warning("%s", e)
+            return JSONResponse(status_code=504, content={"detail": str(e)})
+        finally:
+            request_deadline.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Closed -> open after ``failure_threshold`` consecutive failures; open -> half-open after
+    ``reset_timeout`` seconds, when one probe call is let through; its outcome closes the
+    circuit or opens it again.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead now; in half-open state only the first caller probes."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info("Circuit %s closed", self.name)
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self._probing or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self._probing:
+                    logger.warning("Circuit %s open after %d failures", self.name, self.failures)
+                self.opened_at = time.monotonic()
+                self._probing = False
+
+    def release_probe(self) -> None:
+        """A probe ended without a verdict (e.g. it was cancelled); let the next caller probe."""
+        with self._lock:
+            self._probing = False
+
+    def stats(self) -> Dict[str, object]:
+        return {"state": self.state, "consecutive_failures": self.failures}
+
+
+class LatencyWindow:
+    """Recent latencies of one call type, for choosing when to hedge."""
+
+    def __init__(self, size: int = 200):
+        self._values: Deque[float] = deque(maxlen=size)
+
+    def add(self, seconds: float) -> None:
+        self._values.append(seconds)
+
+    def quantile(self, q: float, default: float) -> float:
+        if len(self._values) < 20:
+            return default
+        ordered = sorted(self._values)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+
+async def hedged(attempts: List[Callable[[], Awaitable[T]]], delay: float) -> T:
+    """
+    Run ``attempts[0]``; each ``delay`` seconds without an answer starts the next one.
+    The first attempt to succeed wins and the others are cancelled. When every started
+    attempt fails, the last error is raised. Only use for idempotent calls.
+    """
+    pending: List[asyncio.Task] = []
+    error: Optional[BaseException] = None
+    try:
+        for index, attempt in enumerate(attempts):
+            pending.append(asyncio.ensure_future(attempt()))
+            last = index == len(attempts) - 1
+            while pending:
+                done, _ = await asyncio.wait(pending, timeout=None if last else delay,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    break  # still waiting after ``delay``: hedge on the next attempt
+                for task in done:
+                    pending.remove(task)
+                    if task.exception() is None:
+                        return task.result()
+                    error = task.exception()
+                if not last:
+                    break  # an attempt failed: start the next one at once
+        raise error if error is not None else RuntimeError("No attempts to run")
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def cancel_on_disconnect(request, awaitable: Awaitable[T]) -> T:
+    """
+    Await ``awaitable`` while the client of ``request`` is connected; if it disconnects,
+    cancel the work and answer 499. Starlette keeps running a handler whose client has gone,
+    so without this an abandoned LLM call runs to the end.
+    """
+    from fastapi import HTTPException
+
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info("Client disconnected from %s; cancelling", request.url.path)
+                raise HTTPException(status_code=499, detail="Client closed request")
+    finally:
+        task.cancel()
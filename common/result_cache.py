@@ -0,0 +1,160 @@
+"""
+On-disk cache of SQL query results, shared by query-to-plots and api-to-report.
+
+Results are stored as zstd-compressed Parquet files named after the data version and
+a hash of the normalized SQL, so a repeat query against unchanged data is read back
+(memory-mapped) instead of being executed again. Files are written atomically, so
+several processes can share one directory; the least recently read files are deleted
+once the directory grows past RESULT_CACHE_MAX_BYTES. All methods are blocking.
+"""
+import glob
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import TYPE_CHECKING, Callable, Optional, Tuple
+
+from common.data_version import UNKNOWN_VERSION, DataVersion
+from common.metrics import CACHE_REQUESTS
+from common.singleflight import make_key, normalize_text
+from common.streaming import StreamResult
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+RESULT_CACHE_DIR = os.getenv("RESULT_CACHE_DIR", "/var/cache/khwarizmi/results")
+RESULT_CACHE_MAX_BYTES = int(os.getenv("RESULT_CACHE_MAX_BYTES", str(1024 ** 3)))
+RESULT_CACHE_COMPRESSION_LEVEL = int(os.getenv("RESULT_CACHE_COMPRESSION_LEVEL", "3"))
+
+
+class ResultCache:
+    def __init__(self, directory: str = RESULT_CACHE_DIR, max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, sql: str, data_version: str) -> str:
+        # The version prefix lets a data change drop every older result by file name.
+        digest = make_key(normalize_text(sql, lowercase=False))
+        return os.path.join(self.directory, f"{data_version[:16]}-{digest}.parquet")
+
+    def get(self, sql: str, data_version: str) -> Optional["pd.DataFrame"]:
+        import pyarrow.parquet as pq
+
+        path = self.path(sql, data_version)
+        try:
+            table = pq.read_table(path, memory_map=True)
+            os.utime(path)  # mtime doubles as the last-read time for LRU eviction
+        except FileNotFoundError:
+            self.misses += 1
+            CACHE_REQUESTS.labels("result", "miss").inc()
+            return None
+        except Exception as e:
+            logger.warning("Dropping unreadable cached result %s: %s", path, e)
+            self._remove(path)
+            self.misses += 1
+            CACHE_REQUESTS.labels("result", "miss").inc()
+            return None
+        self.hits += 1
+        CACHE_REQUESTS.labels("result", "hit").inc()
+        return table.to_pandas()
+
+    def put(self, sql: str, data_version: str, df: "pd.DataFrame") -> None:
+        path = self.path(sql, data_version)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            df.to_parquet(tmp_path, engine="pyarrow", compression="zstd",
+                          compression_level=RESULT_CACHE_COMPRESSION_LEVEL, index=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning("Could not cache query result: %s", e)
+            self._remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self) -> int:
+        """Delete least recently read files until the directory fits in max_bytes."""
+        with self._lock:
+            files = []
+            for path in glob.glob(os.path.join(self.directory, "*.parquet")):
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in files)
+            removed = 0
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+                removed += 1
+            return removed
+
+    def on_data_version_change(self, old_version: Optional[str], new_version: str) -> None:
+        """DataVersion listener: results computed on older data are never read again."""
+        keep = f"{new_version[:16]}-"
+        for path in glob.glob(os.path.join(self.directory, "*.parquet")):
+            if not os.path.basename(path).startswith(keep):
+                self._remove(path)
+
+    def read_sql(self, sql: str, data_version: DataVersion,
+                 execute: Callable[[str], StreamResult]) -> Tuple[StreamResult, bool]:
+        """``execute(sql)`` through the cache; returns (result, served_from_cache)."""
+        version = data_version.get()
+        if version == UNKNOWN_VERSION:
+            return execute(sql), False
+        df = self.get(sql, version)
+        if df is not None:
+            return StreamResult.from_frame(df), True
+        started = time.perf_counter()
+        result = execute(sql)
+        if result.sampled:
+            # A sample is not the query's result; caching it would hide the full row count and stats.
+            logger.info("Query ran in %.2fs; sampled result not cached", time.perf_counter() - started)
+        else:
+            logger.info("Query ran in %.2fs; caching %d rows", time.perf_counter() - started, result.total_rows)
+            self.put(sql, version, result.frame)
+        return result, False
+
+    def stats(self) -> dict:
+        files = glob.glob(os.path.join(self.directory, "*.parquet"))
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "files": len(files),
+            "bytes": sum(os.path.getsize(p) for p in files if os.path.exists(p)),
+            "max_bytes": self.max_bytes,
+        }
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+_cache: Optional[ResultCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_result_cache(data_version: DataVersion) -> Optional[ResultCache]:
+    """Process-wide cache subscribed to ``data_version``; None when RESULT_CACHE_ENABLED is off."""
+    global _cache
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = ResultCache()
+                data_version.subscribe(_cache.on_data_version_change)
+    return _cache
@@ -0,0 +1,628 @@
+"""
+Materialized rollups for aggregation queries that keep coming back.
+
+query-to-plots and api-to-report pass every query through ``Rollups.rewrite``. Aggregating
+SELECTs are counted in <ROLLUP_SCHEMA>.query_shapes by shape: the normalized query without
+its final ORDER BY / LIMIT / OFFSET, with the values of its ``column = literal`` filters
+replaced by ?. "Sales by category in 2023" and "sales by category in 2024" share a shape;
+the result cache already serves exact repeats.
+
+Once a shape has been seen ROLLUP_MIN_HITS times it is materialized as
+<ROLLUP_SCHEMA>.rollup_<key>: the query without those filters, grouped by the filter columns
+as well. Every filter pins its column to one value, so selecting the matching rows of the
+view gives exactly the original groups, whatever the aggregates. Later queries of the shape
+read that view with their own filter values, ORDER BY and LIMIT instead of scanning the
+fact tables.
+
+Hits are counted in memory and added to query_shapes every ROLLUP_FLUSH_INTERVAL seconds, so
+the request path never writes to Postgres.
+
+A rollup is used only while the data version it was refreshed at is current. A query that
+finds it stale runs against the base tables; the refresh is queued only when the shape comes
+back stale a second time, so a shape asked for once after a data change does not pay for a
+scan and a refresh. Flushes, creation and refreshes run on one background thread per process;
+creation and refreshes take a Postgres advisory lock, so workers never build the same rollup
+twice. The schema is excluded from the data version, so refreshing a rollup does not
+invalidate the result caches.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import text
+
+from common.data_version import ROLLUP_SCHEMA, UNKNOWN_VERSION, DataVersion
+from common.db import get_engine
+from common.metrics import CACHE_REQUESTS
+from common.singleflight import make_key
+
+logger = logging.getLogger(__name__)
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS_ENABLED", "false").strip().lower() in ("1", "true", "yes")
+# Times the same aggregation must be seen before it is materialized.
+ROLLUP_MIN_HITS = int(os.getenv("ROLLUP_MIN_HITS", "3"))
+# Upper bound on materialized rollups; further hot queries keep hitting the base tables.
+ROLLUP_MAX_COUNT = int(os.getenv("ROLLUP_MAX_COUNT", "50"))
+# Rollups whose grouped-by-filter-columns result exceeds this many rows are dropped (marked failed).
+ROLLUP_MAX_ROWS = int(os.getenv("ROLLUP_MAX_ROWS", "1000000"))
+# Seconds between writes of the hit counts gathered in memory to query_shapes.
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", "10"))
+# Seconds the list of rollups is trusted before it is read from Postgres again.
+ROLLUP_REGISTRY_TTL = float(os.getenv("ROLLUP_REGISTRY_TTL", "10"))
+# Seconds to wait before retrying after the schema could not be created.
+ROLLUP_SETUP_RETRY = 60.0
+
+TOKEN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?\*/)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<quoted>"(?:[^"]|"")*")
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<number>\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<space>\s+)
+  | (?P<op>::|<>|<=|>=|!=|\|\||.)
+""", re.S | re.X)
+
+AGGREGATES = {
+    "count", "sum", "avg", "min", "max", "stddev", "variance", "string_agg", "array_agg",
+    "bool_and", "bool_or", "percentile_cont", "percentile_disc",
+}
+# Statements that write, and functions whose result depends on when the query runs:
+# a rollup would freeze them.
+UNSAFE_WORDS = {
+    "insert", "update", "delete", "merge", "into", "now", "current_date", "current_time",
+    "current_timestamp", "localtime", "localtimestamp", "random", "clock_timestamp",
+    "statement_timestamp", "transaction_timestamp", "timeofday", "nextval", "setval",
+    "pg_sleep", "current_user", "session_user",
+}
+ROW_COLUMN = "__rollup_row"
+# Rollup column holding the value of the n-th (from 1) lifted filter.
+PARAM_COLUMN = "__rollup_p{}"
+# Top-level words after which a WHERE or GROUP BY clause has ended.
+CLAUSE_ENDS = {"group", "having", "window", "order", "limit", "offset", "fetch"}
+
+# (kind, value, offset in the statement); words are lowercased, comments and spaces dropped.
+Token = Tuple[str, str, int]
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class ParsedQuery:
+    """
+    An aggregating SELECT split into its core and its final ORDER BY / LIMIT / OFFSET, with
+    the core's ``column = literal`` filters lifted out as parameters of its shape.
+    """
+
+    def __init__(self, core_sql: str, shape_key: str, shape: str, rollup_sql: str, params: List[str],
+                 order_by: List[Tuple[str, object]], tail_sql: str):
+        self.core_sql = core_sql
+        self.shape_key = shape_key
+        self.shape = shape
+        self.rollup_sql = rollup_sql  # the core without the lifted filters, grouped by their columns
+        self.params = params  # SQL literal of each lifted filter, matching PARAM_COLUMN n
+        self.order_by = order_by  # ("column", name) or ("ordinal", n) per ORDER BY item
+        self.tail_sql = tail_sql
+
+
+def tokenize(sql: str) -> List[Token]:
+    tokens = []
+    for match in TOKEN.finditer(sql):
+        kind = match.lastgroup
+        if kind in ("comment", "space"):
+            continue
+        value = match.group()
+        tokens.append((kind, value.lower() if kind == "word" else value, match.start()))
+    return tokens
+
+
+def _is_aggregation(tokens: List[Token]) -> bool:
+    for (kind, value, _), (_, following, _) in zip(tokens, tokens[1:]):
+        if kind == "word" and ((value in AGGREGATES and following == "(") or (value == "group" and following == "by")):
+            return True
+    return False
+
+
+def _tail_start(tokens: List[Token]) -> Optional[int]:
+    """Index of the first top-level ORDER BY / LIMIT / OFFSET / FETCH, which can only end the statement."""
+    depth = 0
+    for i, (kind, value, _) in enumerate(tokens):
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+        elif depth == 0 and kind == "word":
+            if value in ("limit", "offset", "fetch"):
+                return i
+            if value == "order" and i + 1 < len(tokens) and tokens[i + 1][1] == "by":
+                return i
+    return None
+
+
+def _parse_tail(tokens: List[Token]) -> Optional[List[Tuple[str, object]]]:
+    """ORDER BY items of a tail made only of output-column references, LIMIT and OFFSET; None otherwise."""
+    values = [value for _, value, _ in tokens] + ["", ""]
+    items: List[Tuple[str, object]] = []
+    i = 0
+    if values[i] == "order":
+        i += 2
+        while True:
+            kind, value, _ = tokens[i] if i < len(tokens) else ("", "", 0)
+            if kind == "word":
+                items.append(("column", value))
+            elif kind == "quoted":
+                items.append(("column", value[1:-1].replace('""', '"')))
+            elif kind == "number" and value.isdigit():
+                items.append(("ordinal", int(value)))
+            else:
+                return None
+            i += 1
+            if values[i] in ("asc", "desc"):
+                i += 1
+            if values[i] == "nulls" and values[i + 1] in ("first", "last"):
+                i += 2
+            if values[i] != ",":
+                break
+            i += 1
+    if values[i] == "limit":
+        if not (values[i + 1] == "all" or values[i + 1].isdigit()):
+            return None
+        i += 2
+    if values[i] == "offset":
+        if not values[i + 1].isdigit():
+            return None
+        i += 2
+        if values[i] in ("row", "rows"):
+            i += 1
+    return items if i == len(tokens) else None
+
+
+def _match_ref(tokens: List[Token], i: int) -> int:
+    """End index of a (possibly table-qualified) column reference starting at ``i``, or ``i``."""
+    end = i
+    if i < len(tokens) and tokens[i][0] in ("word", "quoted"):
+        end = i + 1
+        if end + 1 < len(tokens) and tokens[end][1] == "." and tokens[end + 1][0] in ("word", "quoted"):
+            end += 2
+    return end
+
+
+def _match_literal(tokens: List[Token], i: int) -> int:
+    """End index of a string or number literal (optionally negative or ``::type`` cast) at ``i``, or ``i``."""
+    end = i + (i < len(tokens) and tokens[i][1] == "-")
+    if end >= len(tokens) or tokens[end][0] not in ("string", "number") or (end > i and tokens[end][0] != "number"):
+        return i
+    end += 1
+    if end + 1 < len(tokens) and tokens[end][1] == "::" and tokens[end + 1][0] == "word":
+        end += 2
+    return end
+
+
+def _lift_filters(tokens: List[Token], sql: str) -> Optional[Tuple[str, List[Tuple[int, int]], List[str]]]:
+    """
+    The core regrouped by its ``column = literal`` filters: (rollup SQL, token spans of the
+    lifted literals, their SQL). None when nothing can be lifted safely: no GROUP BY (an
+    aggregate over no rows still returns one row), set operations, window functions,
+    grouping sets, or a WHERE that is not a plain AND of conditions.
+    """
+    depth = 0
+    top: List[int] = []
+    for i, (_, value, _) in enumerate(tokens):
+        if value == "(":
+            depth += 1
+        elif value == ")":
+            depth -= 1
+        elif depth == 0:
+            top.append(i)
+    words = {tokens[i][1]: i for i in reversed(top) if tokens[i][0] == "word"}
+    if "where" not in words or "group" not in words or words.keys() & {"union", "intersect", "except", "over", "rollup", "cube", "grouping"}:
+        return None
+    if sum(tokens[i][1] == "select" for i in top) != 1:
+        return None
+    froms = [i for i in top if tokens[i][1] == "from" and tokens[i - 1][1] != "distinct"]
+    if not froms or froms[0] > words["where"]:
+        return None
+
+    where = words["where"]
+    clause_end = next((i for i in top if i > where and tokens[i][1] in CLAUSE_ENDS), len(tokens))
+    if any(tokens[i][1] in ("or", "between", "case") for i in top if where < i < clause_end):
+        return None
+    conditions: List[Tuple[int, int]] = []
+    start = where + 1
+    for i in [i for i in top if where < i < clause_end and tokens[i][1] == "and"] + [clause_end]:
+        conditions.append((start, i))
+        start = i + 1
+
+    def source(start: int, end: int) -> str:
+        return sql[tokens[start][2]:tokens[end - 1][2] + len(tokens[end - 1][1])]
+
+    columns: List[str] = []
+    literals: List[Tuple[int, int]] = []
+    kept: List[str] = []
+    for start, end in conditions:
+        ref_end = _match_ref(tokens, start)
+        if ref_end > start and ref_end < end and tokens[ref_end][1] == "=" and _match_literal(tokens, ref_end + 1) == end:
+            columns.append(source(start, ref_end))
+            literals.append((ref_end + 1, end))
+        elif start < end:
+            kept.append(source(start, end))
+    if not columns:
+        return None
+
+    group = words["group"]
+    if group < where or group + 2 >= len(tokens) or tokens[group + 1][1] != "by" or tokens[group + 2][1] in ("all", "distinct"):
+        return None
+    group_end = next((i for i in top if i > group and tokens[i][1] in CLAUSE_ENDS - {"group"}), len(tokens))
+    grouping = tokens[group_end - 1][2] + len(tokens[group_end - 1][1])
+    where_end = tokens[clause_end][2] if clause_end < len(tokens) else len(sql)
+    select_end = tokens[froms[0] - 1][2] + len(tokens[froms[0] - 1][1])
+    selected = "".join(f", {column} AS {PARAM_COLUMN.format(n)}" for n, column in enumerate(columns, 1))
+    edits = [
+        (select_end, select_end, selected),
+        (tokens[where][2], where_end, f"WHERE {' AND '.join(kept)} " if kept else ""),
+        (grouping, grouping, "".join(f", {column}" for column in columns)),
+    ]
+    rollup_sql = sql
+    for start, end, replacement in sorted(edits, key=lambda edit: edit[0], reverse=True):
+        rollup_sql = rollup_sql[:start] + replacement + rollup_sql[end:]
+    return rollup_sql.strip(), literals, [source(start, end) for start, end in literals]
+
+
+def parse(sql: str) -> Optional[ParsedQuery]:
+    """Split an aggregating, read-only SELECT into core and tail; None for anything a rollup cannot serve."""
+    sql = sql.strip().rstrip(";").strip()
+    tokens = tokenize(sql)
+    if not tokens or tokens[0][1] not in ("select", "with"):
+        return None
+    words = {value for kind, value, _ in tokens if kind == "word"}
+    if words & UNSAFE_WORDS or ROLLUP_SCHEMA.lower() in words:
+        return None
+    if any(kind == "op" and value in (";", "$") for kind, value, _ in tokens) or not _is_aggregation(tokens):
+        return None
+
+    core_tokens, core_sql, order_by, tail_sql = tokens, sql, [], ""
+    start = _tail_start(tokens)
+    if start is not None:
+        items = _parse_tail(tokens[start:])
+        if items is not None:
+            offset = tokens[start][2]
+            core_tokens, core_sql, order_by, tail_sql = tokens[:start], sql[:offset].strip(), items, sql[offset:]
+    rollup_sql, spans, params = core_sql, [], []
+    if _tail_start(core_tokens) is None:
+        rollup_sql, spans, params = _lift_filters(core_tokens, core_sql) or (core_sql, [], [])
+    lifted = dict(spans)
+    words, i = [], 0
+    while i < len(core_tokens):
+        if i in lifted:
+            words.append("?")
+            i = lifted[i]
+        else:
+            words.append(core_tokens[i][1])
+            i += 1
+    shape = " ".join(words)
+    return ParsedQuery(core_sql, make_key(shape), shape, rollup_sql, params, order_by, tail_sql)
+
+
+class Rollup:
+    def __init__(self, name: str, shape_key: str, columns: List[str], status: str, data_version: Optional[str]):
+        self.name = name
+        self.shape_key = shape_key
+        self.columns = columns
+        self.status = status  # "ready" or "failed"
+        self.data_version = data_version
+
+    def select_sql(self, parsed: ParsedQuery) -> Optional[str]:
+        """``parsed`` answered from this rollup, or None when its ORDER BY needs columns the rollup lacks."""
+        for kind, ref in parsed.order_by:
+            if kind == "ordinal" and not 1 <= ref <= len(self.columns):
+                return None
+            if kind == "column" and ref not in self.columns:
+                return None
+        columns = ", ".join(quote(c) for c in self.columns)
+        sql = f"SELECT {columns} FROM {quote(ROLLUP_SCHEMA)}.{quote(self.name)}"
+        if parsed.params:
+            sql += " WHERE " + " AND ".join(
+                f"{PARAM_COLUMN.format(n)} = {value}" for n, value in enumerate(parsed.params, 1)
+            )
+        if not parsed.order_by:
+            # Keep the core's own row order (if it had one) under the caller's LIMIT.
+            sql += f" ORDER BY {ROW_COLUMN}"
+        return f"{sql} {parsed.tail_sql}".strip()
+
+
+def _lock_id(key: str) -> int:
+    """Advisory lock key (a positive bigint) for a hex key."""
+    return int(key[:15], 16)
+
+
+class Rollups:
+    def __init__(self, uri: str, data_version: DataVersion, min_hits: int = ROLLUP_MIN_HITS,
+                 max_count: int = ROLLUP_MAX_COUNT):
+        self.uri = uri
+        self.data_version = data_version
+        self.min_hits = min_hits
+        self.max_count = max_count
+        self.schema = quote(ROLLUP_SCHEMA)
+        self._lock = threading.Lock()
+        self._registry: Dict[str, Rollup] = {}
+        self._registry_at: Optional[float] = None
+        self._ready = False
+        self._setup_failed_at: Optional[float] = None
+        self._pending: Set[str] = set()
+        # Hits per shape since the last flush, with a parsed query to create its rollup from.
+        self._hits: Dict[str, Tuple[ParsedQuery, int]] = {}
+        self._flushed_at = time.monotonic()
+        # Data version each rollup was at when this process last found it stale, by name.
+        self._stale_seen: Dict[str, Optional[str]] = {}
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rollups")
+        self.counts: Dict[str, int] = {"hit": 0, "stale": 0, "miss": 0}
+
+    def _setup(self) -> bool:
+        if self._ready:
+            return True
+        if self._setup_failed_at is not None and time.monotonic() - self._setup_failed_at < ROLLUP_SETUP_RETRY:
+            return False
+        try:
+            with get_engine(self.uri).begin() as conn:
+                # Serialize the IF NOT EXISTS statements across workers; they race otherwise.
+                conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _lock_id(make_key(ROLLUP_SCHEMA))})
+                conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {self.schema}"))
+                conn.execute(text(f"""
+                    CREATE TABLE IF NOT EXISTS {self.schema}.query_shapes (
+                        shape_key TEXT PRIMARY KEY,
+                        shape TEXT NOT NULL,
+                        rollup_sql TEXT NOT NULL,
+                        hits BIGINT NOT NULL,
+                        first_seen TIMESTAMPTZ NOT NULL DEFAULT now(),
+                        last_seen TIMESTAMPTZ NOT NULL DEFAULT now()
+                    )
+                """))
+                conn.execute(text(f"""
+                    CREATE TABLE IF NOT EXISTS {self.schema}.rollups (
+                        name TEXT PRIMARY KEY,
+                        shape_key TEXT NOT NULL UNIQUE,
+                        rollup_sql TEXT NOT NULL,
+                        columns TEXT[] NOT NULL,
+                        status TEXT NOT NULL,
+                        error TEXT,
+                        data_version TEXT,
+                        created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+                        refreshed_at TIMESTAMPTZ
+                    )
+                """))
+        except Exception as e:
+            logger.warning("Rollups unavailable, could not set up schema %s: %s", ROLLUP_SCHEMA, e)
+            self._setup_failed_at = time.monotonic()
+            return False
+        self._ready = True
+        return True
+
+    def rewrite(self, sql: str, track: bool = True) -> str:
+        """
+        The statement to run for ``sql``: a read of a fresh rollup of its shape, or ``sql`` (blocking).
+
+        Pass ``track=False`` for SQL generated around the user's statement (previews, chart
+        aggregates) and for a statement another service already counted: it is served from
+        an existing rollup but never counted towards one or towards its refresh.
+        """
+        parsed = parse(sql)
+        if parsed is None or not self._setup():
+            return sql
+        if track:
+            self._record(parsed)
+        try:
+            rollup = self._registry_entry(parsed.shape_key)
+        except Exception as e:
+            logger.warning("Rollup lookup failed: %s", e)
+            return sql
+
+        if rollup is None or rollup.status != "ready":
+            self._count("miss")
+            return sql
+        version = self.data_version.get()
+        if rollup.data_version != version:
+            self._count("stale")
+            if track and version != UNKNOWN_VERSION and self._stale_again(rollup):
+                self._submit(parsed.shape_key, lambda: self._refresh(rollup))
+            return sql
+        rewritten = rollup.select_sql(parsed)
+        if rewritten is None:
+            self._count("miss")
+            return sql
+        self._count("hit")
+        logger.info("Query served from rollup %s", rollup.name)
+        return rewritten
+
+    def _count(self, result: str) -> None:
+        with self._lock:
+            self.counts[result] += 1
+        CACHE_REQUESTS.labels("rollup", result).inc()
+
+    def _record(self, parsed: ParsedQuery) -> None:
+        """Count a hit in memory; the background thread writes the counts once per flush interval."""
+        with self._lock:
+            _, hits = self._hits.get(parsed.shape_key, (parsed, 0))
+            self._hits[parsed.shape_key] = (parsed, hits + 1)
+            due = time.monotonic() - self._flushed_at >= ROLLUP_FLUSH_INTERVAL
+        if due:
+            self._submit("flush", self._flush)
+
+    def _flush(self) -> None:
+        """Add the hits counted since the last flush to query_shapes and create the rollups now due."""
+        with self._lock:
+            hits, self._hits = self._hits, {}
+            self._flushed_at = time.monotonic()
+        if not hits:
+            return
+        with get_engine(self.uri).begin() as conn:
+            # In key order, so concurrent flushes from other workers cannot deadlock.
+            conn.execute(text(f"""
+                INSERT INTO {self.schema}.query_shapes (shape_key, shape, rollup_sql, hits)
+                VALUES (:shape_key, :shape, :rollup_sql, :hits)
+                ON CONFLICT (shape_key) DO UPDATE
+                SET hits = query_shapes.hits + excluded.hits, last_seen = now()
+            """), [
+                {"shape_key": key, "shape": parsed.shape, "rollup_sql": parsed.rollup_sql, "hits": count}
+                for key, (parsed, count) in sorted(hits.items())
+            ])
+            due = [row[0] for row in conn.execute(text(f"""
+                SELECT s.shape_key FROM {self.schema}.query_shapes s
+                LEFT JOIN {self.schema}.rollups r ON r.shape_key = s.shape_key
+                WHERE s.shape_key = ANY(:keys) AND s.hits >= :min_hits AND r.shape_key IS NULL
+            """), {"keys": list(hits), "min_hits": self.min_hits})]
+        for key in due:
+            self._create(hits[key][0])
+
+    def _stale_again(self, rollup: Rollup) -> bool:
+        """Whether this process already found ``rollup`` stale at its current data version."""
+        with self._lock:
+            again = self._stale_seen.get(rollup.name) == rollup.data_version
+            self._stale_seen[rollup.name] = rollup.data_version
+        return again
+
+    def _registry_entry(self, shape_key: str) -> Optional[Rollup]:
+        with self._lock:
+            if self._registry_at is not None and time.monotonic() - self._registry_at < ROLLUP_REGISTRY_TTL:
+                return self._registry.get(shape_key)
+        with get_engine(self.uri).connect() as conn:
+            rows = conn.execute(text(
+                f"SELECT name, shape_key, columns, status, data_version FROM {self.schema}.rollups"
+            )).all()
+        registry = {row.shape_key: Rollup(row.name, row.shape_key, list(row.columns), row.status, row.data_version)
+                    for row in rows}
+        with self._lock:
+            self._registry = registry
+            self._registry_at = time.monotonic()
+        return registry.get(shape_key)
+
+    def _submit(self, key: str, work: Callable[[], None]) -> None:
+        """Run ``work`` on the background thread unless work under the same key is already queued."""
+        with self._lock:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+
+        def run():
+            try:
+                work()
+            except Exception:
+                logger.exception("Rollup maintenance failed")
+            finally:
+                with self._lock:
+                    self._pending.discard(key)
+                    self._registry_at = None  # pick up the outcome on the next lookup
+
+        self._worker.submit(run)
+
+    def _create(self, parsed: ParsedQuery) -> None:
+        with self._lock:
+            if sum(r.status == "ready" for r in self._registry.values()) >= self.max_count:
+                return
+        version = self.data_version.get()
+        if version == UNKNOWN_VERSION:
+            return
+        name = f"rollup_{parsed.shape_key[:16]}"
+        relation = f"{self.schema}.{quote(name)}"
+        started = time.perf_counter()
+        try:
+            with get_engine(self.uri).begin() as conn:
+                if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"),
+                                    {"key": _lock_id(parsed.shape_key)}).scalar():
+                    return
+                exists = conn.execute(text(f"SELECT 1 FROM {self.schema}.rollups WHERE shape_key = :key"),
+                                      {"key": parsed.shape_key}).first()
+                if exists:
+                    return
+                conn.execute(text(
+                    f"CREATE MATERIALIZED VIEW {relation} AS "
+                    f"SELECT row_number() OVER () AS {ROW_COLUMN}, core.* FROM ({parsed.rollup_sql}) AS core"
+                ))
+                rows = conn.execute(text(f"SELECT count(*) FROM {relation}")).scalar()
+                if rows > ROLLUP_MAX_ROWS:
+                    # Grouping by a high-cardinality filter column (an id, say) multiplies the groups.
+                    raise ValueError(f"{rows} rows, more than ROLLUP_MAX_ROWS ({ROLLUP_MAX_ROWS})")
+                if parsed.params:
+                    params = ", ".join(PARAM_COLUMN.format(n) for n in range(1, len(parsed.params) + 1))
+                    conn.execute(text(f"CREATE INDEX ON {relation} ({params})"))
+                columns = [row[0] for row in conn.execute(text(
+                    "SELECT attname FROM pg_attribute WHERE attrelid = CAST(:relation AS regclass) "
+                    "AND attnum > 0 AND NOT attisdropped ORDER BY attnum"
+                ), {"relation": relation}) if not row[0].startswith("__rollup_")]
+                conn.execute(text(f"""
+                    INSERT INTO {self.schema}.rollups (name, shape_key, rollup_sql, columns, status, data_version, refreshed_at)
+                    VALUES (:name, :shape_key, :rollup_sql, :columns, 'ready', :version, now())
+                """), {"name": name, "shape_key": parsed.shape_key, "rollup_sql": parsed.rollup_sql,
+                       "columns": columns, "version": version})
+        except Exception as e:
+            # e.g. duplicate output column names; remember the failure so it is not retried on every query.
+            logger.warning("Could not create rollup %s: %s", name, e)
+            with get_engine(self.uri).begin() as conn:
+                conn.execute(text(f"""
+                    INSERT INTO {self.schema}.rollups (name, shape_key, rollup_sql, columns, status, error)
+                    VALUES (:name, :shape_key, :rollup_sql, '{{}}', 'failed', :error)
+                    ON CONFLICT DO NOTHING
+                """), {"name": name, "shape_key": parsed.shape_key, "rollup_sql": parsed.rollup_sql,
+                       "error": str(e)[:1000]})
+            return
+        logger.info("Created rollup %s in %.2fs", name, time.perf_counter() - started)
+
+    def _refresh(self, rollup: Rollup) -> None:
+        version = self.data_version.get()
+        if version in (UNKNOWN_VERSION, rollup.data_version):
+            return
+        started = time.perf_counter()
+        with get_engine(self.uri).begin() as conn:
+            if not conn.execute(text("SELECT pg_try_advisory_xact_lock(:key)"),
+                                {"key": _lock_id(rollup.shape_key)}).scalar():
+                return
+            current = conn.execute(text(f"SELECT data_version FROM {self.schema}.rollups WHERE name = :name"),
+                                   {"name": rollup.name}).scalar()
+            if current == version:
+                return  # another worker refreshed it already
+            conn.execute(text(f"REFRESH MATERIALIZED VIEW {self.schema}.{quote(rollup.name)}"))
+            conn.execute(text(
+                f"UPDATE {self.schema}.rollups SET data_version = :version, refreshed_at = now() WHERE name = :name"
+            ), {"version": version, "name": rollup.name})
+        logger.info("Refreshed rollup %s in %.2fs", rollup.name, time.perf_counter() - started)
+
+    def stats(self) -> dict:
+        """Query counts in this process, the most repeated shapes and every rollup (blocking)."""
+        with self._lock:
+            counts = dict(self.counts)
+            counts["unflushed_hits"] = sum(count for _, count in self._hits.values())
+        if not self._setup():
+            return {"enabled": True, "available": False, **counts}
+        with get_engine(self.uri).connect() as conn:
+            shapes = conn.execute(text(f"""
+                SELECT shape_key, left(shape, 300) AS shape, hits, last_seen
+                FROM {self.schema}.query_shapes ORDER BY hits DESC LIMIT 10
+            """)).mappings().all()
+            rollups = conn.execute(text(f"""
+                SELECT name, status, error, left(data_version, 12) AS data_version, created_at, refreshed_at
+                FROM {self.schema}.rollups ORDER BY created_at
+            """)).mappings().all()
+        return {
+            "enabled": True, "available": True, **counts,
+            "hot_shapes": [dict(row) for row in shapes],
+            "rollups": [dict(row) for row in rollups],
+        }
+
+
+_rollups: Optional[Rollups] = None
+_rollups_lock = threading.Lock()
+
+
+def get_rollups(uri: str, data_version: DataVersion) -> Optional[Rollups]:
+    """Process-wide rollup manager; None when ROLLUPS_ENABLED is off."""
+    global _rollups
+    if not ROLLUPS_ENABLED:
+        return None
+    if _rollups is None:
+        with _rollups_lock:
+            if _rollups is None:
+                _rollups = Rollups(uri, data_version)
+    return _rollups
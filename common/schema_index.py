@@ -0,0 +1,248 @@
+"""
+Compact, prunable description of the database schema for LLM prompts.
+
+A ``SchemaIndex`` holds, per table, the column types, primary and foreign keys and a
+few short sample values, rendered one line per table. ``select`` picks the tables
+relevant to an intent by keyword overlap (and, when table embeddings are loaded, by
+embedding similarity), then adds foreign-key neighbours so join paths stay complete.
+Schemas with at most SCHEMA_PRUNE_MIN_TABLES tables are never pruned: the full text is
+small and, being identical on every call, keeps the provider prompt cache warm.
+"""
+import asyncio
+import logging
+import math
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from sqlalchemy import column, inspect, select, table
+
+from common.concurrency import run_blocking
+from common.db import get_engine
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_SAMPLE_VALUES = int(os.getenv("SCHEMA_SAMPLE_VALUES", "3"))
+SCHEMA_SAMPLE_ROWS = int(os.getenv("SCHEMA_SAMPLE_ROWS", "50"))
+SCHEMA_MAX_TABLES = int(os.getenv("SCHEMA_MAX_TABLES", "8"))
+SCHEMA_PRUNE_MIN_TABLES = int(os.getenv("SCHEMA_PRUNE_MIN_TABLES", "20"))
+SCHEMA_INDEX_TTL = float(os.getenv("SCHEMA_INDEX_TTL", "3600"))
+SCHEMA_EMBEDDINGS = os.getenv("SCHEMA_EMBEDDINGS", "true").strip().lower() in ("1", "true", "yes")
+
+# Sample values longer than this are not shown (free text, blobs).
+MAX_SAMPLE_LENGTH = 30
+
+WORD = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(value: str) -> Set[str]:
+    """Lowercase word stems ("Orders", "order_details" -> order, details)."""
+    words = WORD.findall(value.lower().replace("_", " "))
+    return {w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words}
+
+
+def cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class TableInfo:
+    def __init__(self, name: str, columns: List[Tuple[str, str]], primary_key: List[str],
+                 foreign_keys: List[Tuple[List[str], str, List[str]]], samples: Dict[str, List[str]]):
+        self.name = name
+        self.columns = columns
+        self.primary_key = primary_key
+        self.foreign_keys = foreign_keys
+        self.samples = samples
+        self.name_tokens = tokenize(name)
+        self.column_tokens = set().union(*(tokenize(col) for col, _ in columns)) if columns else set()
+        self.sample_tokens = set().union(*(tokenize(v) for values in samples.values() for v in values)) \
+            if samples else set()
+
+    def render(self) -> str:
+        references = {}
+        for columns, target, target_columns in self.foreign_keys:
+            for col, target_col in zip(columns, target_columns):
+                references[col] = f"{target}.{target_col}"
+        parts = []
+        for col, col_type in self.columns:
+            part = f"{col} {col_type}"
+            if col in self.primary_key:
+                part += " PK"
+            if col in references:
+                part += f" FK->{references[col]}"
+            parts.append(part)
+        line = f"- {self.name}({', '.join(parts)})"
+        if self.samples:
+            examples = "; ".join(f"{col}: {', '.join(repr(v) for v in values)}" for col, values in self.samples.items())
+            line += f"\n  e.g. {examples}"
+        return line
+
+
+def _is_text(column_type) -> bool:
+    try:
+        return column_type.python_type is str
+    except NotImplementedError:
+        return False
+
+
+def _sample_values(conn, table_name: str, text_columns: List[str]) -> Dict[str, List[str]]:
+    if not text_columns or SCHEMA_SAMPLE_VALUES <= 0:
+        return {}
+    query = select(*(column(c) for c in text_columns)).select_from(table(table_name)).limit(SCHEMA_SAMPLE_ROWS)
+    samples: Dict[str, List[str]] = {}
+    for row in conn.execute(query):
+        for col, value in zip(text_columns, row):
+            if value is None or len(str(value)) > MAX_SAMPLE_LENGTH:
+                continue
+            values = samples.setdefault(col, [])
+            if str(value) not in values and len(values) < SCHEMA_SAMPLE_VALUES:
+                values.append(str(value))
+    return samples
+
+
+class SchemaIndex:
+    """Per-table schema summaries with relevance pruning; build it with ``SchemaIndex.build``."""
+
+    def __init__(self, tables: Iterable[TableInfo]):
+        self.tables: Dict[str, TableInfo] = {t.name: t for t in sorted(tables, key=lambda t: t.name)}
+        self.built_at = time.monotonic()
+        self.embeddings: Dict[str, List[float]] = {}
+        self._embedding_lock: Optional[asyncio.Lock] = None
+        # FK edges in both directions, for neighbour expansion.
+        self.neighbours: Dict[str, Set[str]] = {name: set() for name in self.tables}
+        for info in self.tables.values():
+            for _, target, _ in info.foreign_keys:
+                if target in self.tables and target != info.name:
+                    self.neighbours[info.name].add(target)
+                    self.neighbours[target].add(info.name)
+
+    @classmethod
+    def build(cls, uri: str, include_tables: Optional[List[str]] = None) -> "SchemaIndex":
+        """Introspect the database (blocking, run it on the executor)."""
+        engine = get_engine(uri)
+        inspector = inspect(engine)
+        names = include_tables or inspector.get_table_names()
+        tables = []
+        with engine.connect() as conn:
+            for name in names:
+                columns = inspector.get_columns(name)
+                text_columns = [c["name"] for c in columns if _is_text(c["type"])]
+                try:
+                    samples = _sample_values(conn, name, text_columns)
+                except Exception as e:
+                    logger.warning("No sample values for %s: %s", name, e)
+                    conn.rollback()
+                    samples = {}
+                tables.append(TableInfo(
+                    name,
+                    [(c["name"], str(c["type"]).lower()) for c in columns],
+                    inspector.get_pk_constraint(name).get("constrained_columns") or [],
+                    [(fk["constrained_columns"], fk["referred_table"], fk["referred_columns"])
+                     for fk in inspector.get_foreign_keys(name)],
+                    samples,
+                ))
+        logger.info("Built schema index for %d tables", len(tables))
+        return cls(tables)
+
+    @property
+    def table_names(self) -> List[str]:
+        return list(self.tables)
+
+    def render(self, table_names: Optional[Iterable[str]] = None) -> str:
+        names = self.tables if table_names is None else sorted(set(table_names) & set(self.tables))
+        return "Tables:\n" + "\n".join(self.tables[name].render() for name in names)
+
+    def keyword_scores(self, intent: str) -> Dict[str, float]:
+        words = tokenize(intent)
+        scores = {}
+        for name, info in self.tables.items():
+            score = 3 * len(words & info.name_tokens) + len(words & info.column_tokens) \
+                + 2 * len(words & info.sample_tokens)
+            if score:
+                scores[name] = float(score)
+        return scores
+
+    async def ensure_embeddings(self, gateway) -> None:
+        """Embed each table's summary once (in one call); later calls return immediately."""
+        if self.embeddings or not SCHEMA_EMBEDDINGS:
+            return
+        if self._embedding_lock is None:
+            self._embedding_lock = asyncio.Lock()
+        async with self._embedding_lock:
+            if self.embeddings:
+                return
+            names = self.table_names
+            vectors = await gateway.embed([self.tables[n].render() for n in names], stage="schema")
+            self.embeddings = dict(zip(names, vectors))
+
+    def select(self, intent: str, intent_embedding: Optional[List[float]] = None,
+               max_tables: int = SCHEMA_MAX_TABLES) -> List[str]:
+        """Tables relevant to the intent plus their FK neighbours, at most ``max_tables``."""
+        if len(self.tables) <= max(max_tables, SCHEMA_PRUNE_MIN_TABLES):
+            return self.table_names
+        scores = self.keyword_scores(intent)
+        if intent_embedding is not None and self.embeddings:
+            top_keyword = max(scores.values(), default=1.0)
+            for name, vector in self.embeddings.items():
+                # Similarity weighted to be comparable with the best keyword hit.
+                scores[name] = scores.get(name, 0.0) + cosine(intent_embedding, vector) * top_keyword
+        seeds = [name for name, score in sorted(scores.items(), key=lambda kv: -kv[1]) if score > 0]
+        if not seeds:
+            return self.table_names  # nothing matched: pruning would only guess
+        chosen: List[str] = seeds[:max(1, max_tables // 2)]
+        for name in list(chosen):
+            for neighbour in sorted(self.neighbours[name], key=lambda n: -scores.get(n, 0.0)):
+                if len(chosen) >= max_tables:
+                    break
+                if neighbour not in chosen:
+                    chosen.append(neighbour)
+        for name in seeds:
+            if len(chosen) >= max_tables:
+                break
+            if name not in chosen:
+                chosen.append(name)
+        return sorted(chosen)
+
+    async def prune(self, intent: str, gateway=None, max_tables: int = SCHEMA_MAX_TABLES) -> List[str]:
+        """``select`` with embedding similarity when a gateway is given; never raises on embedding errors."""
+        embedding = None
+        if gateway is not None and len(self.tables) > max(max_tables, SCHEMA_PRUNE_MIN_TABLES):
+            try:
+                await self.ensure_embeddings(gateway)
+                if self.embeddings:
+                    [embedding] = await gateway.embed([intent], stage="schema")
+            except Exception as e:
+                logger.warning("Schema pruning falls back to keywords: %s", e)
+        return self.select(intent, embedding, max_tables)
+
+
+class SchemaIndexProvider:
+    """Builds the index once (use ``load`` as a readiness loader) and rebuilds it after SCHEMA_INDEX_TTL."""
+
+    def __init__(self, uri: str, include_tables: Optional[List[str]] = None, ttl: float = SCHEMA_INDEX_TTL):
+        self.uri = uri
+        self.include_tables = include_tables
+        self.ttl = ttl
+        self._index: Optional[SchemaIndex] = None
+        self._rebuild: Optional[asyncio.Task] = None
+
+    def load(self) -> SchemaIndex:
+        self._index = SchemaIndex.build(self.uri, self.include_tables)
+        return self._index
+
+    async def get(self) -> SchemaIndex:
+        """Current index; a stale one is still returned while a rebuild runs in the background."""
+        if self._index is None:
+            return await run_blocking(self.load)
+        if time.monotonic() - self._index.built_at > self.ttl and (self._rebuild is None or self._rebuild.done()):
+            self._rebuild = asyncio.ensure_future(run_blocking(self.load))
+            self._rebuild.add_done_callback(self._log_rebuild)
+        return self._index
+
+    @staticmethod
+    def _log_rebuild(task: asyncio.Future) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Schema index rebuild failed, keeping the previous one: %s", task.exception())
@@ -0,0 +1,42 @@
+"""
+Launch a service in development or production mode.
+
+    python -m common.serve --port 8073
+
+SERVER_MODE=development (default) runs a single uvicorn process with --reload.
+SERVER_MODE=production runs gunicorn with uvicorn workers, configured by
+common/gunicorn_conf.py (worker count, preloading, worker recycling).
+"""
+import argparse
+import os
+
+GUNICORN_CONF = os.path.join(os.path.dirname(os.path.abspath(__file__)), "gunicorn_conf.py")
+
+
+def build_command(app: str, host: str, port: int, mode: str) -> list:
+    if mode == "production":
+        return [
+            "gunicorn", app,
+            "--config", GUNICORN_CONF,
+            "--bind", f"{host}:{port}",
+        ]
+    if mode == "development":
+        return ["uvicorn", app, "--host", host, "--port", str(port), "--reload"]
+    raise ValueError(f"Unknown SERVER_MODE '{mode}', expected 'development' or 'production'")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a KHWARIZMI service")
+    parser.add_argument("--app", default="main:app", help="ASGI application path")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, required=True)
+    args = parser.parse_args()
+
+    mode = os.getenv("SERVER_MODE", "development").strip().lower()
+    command = build_command(args.app, args.host, args.port, mode)
+    print(f"Starting in {mode} mode: {' '.join(command)}", flush=True)
+    os.execvp(command[0], command)
+
+
+if __name__ == "__main__":
+    main()
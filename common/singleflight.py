@@ -0,0 +1,92 @@
+import asyncio
+import hashlib
+import logging
+from typing import Awaitable, Callable, Dict, Optional, TypeVar
+
+from common.metrics import SINGLEFLIGHT_CALLS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+def normalize_text(value: Optional[str], lowercase: bool = True) -> str:
+    """Collapse whitespace (and optionally case) so trivially different requests share a key."""
+    if value is None:
+        return ""
+    collapsed = " ".join(value.split())
+    return collapsed.lower() if lowercase else collapsed
+
+
+def make_key(*parts: Optional[str]) -> str:
+    """Hash already-normalized key parts into a compact, fixed-size key."""
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update((part or "").encode("utf-8"))
+        digest.update(b"\x1f")
+    return digest.hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one in-flight computation.
+
+    The first caller (the leader) starts the work as a task; callers arriving while it
+    runs await the same task and receive its result or exception. The task is shielded,
+    so a leader that disconnects does not cancel the work for everyone else. With
+    ``cancel_abandoned`` the work is cancelled once every caller waiting on it has been
+    cancelled, since nobody is left to use the result. Nothing is cached once the task finishes.
+    """
+
+    def __init__(self, name: str, cancel_abandoned: bool = False):
+        self.name = name
+        self.cancel_abandoned = cancel_abandoned
+        self._inflight: Dict[str, "asyncio.Task"] = {}
+        self._waiting: Dict["asyncio.Task", int] = {}
+        self.leaders = 0
+        self.followers = 0
+        self.abandoned = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done, key=key: self._forget(key, done))
+            self.leaders += 1
+            SINGLEFLIGHT_CALLS.labels(self.name, "leader").inc()
+        else:
+            self.followers += 1
+            SINGLEFLIGHT_CALLS.labels(self.name, "follower").inc()
+            logger.info("%s: joining in-flight call %s", self.name, key[:12])
+        self._waiting[task] = self._waiting.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiting[task] -= 1
+            if not self._waiting[task]:
+                del self._waiting[task]
+                if self.cancel_abandoned and not task.done():
+                    self.abandoned += 1
+                    logger.info("%s: every caller of %s left, cancelling it", self.name, key[:12])
+                    task.cancel()
+
+    def _forget(self, key: str, task: "asyncio.Task") -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved when every caller has gone away.
+        if not task.cancelled():
+            task.exception()
+
+    def running(self, key: str) -> bool:
+        """Whether a call for ``key`` is in flight (a caller arriving now would join it)."""
+        task = self._inflight.get(key)
+        return task is not None and not task.done()
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._inflight)
+
+    def stats(self) -> Dict[str, int]:
+        return {"leaders": self.leaders, "followers": self.followers, "in_flight": self.in_flight,
+                "abandoned": self.abandoned}
@@ -0,0 +1,145 @@
+"""
+Memory-bounded loading of SQL results.
+
+``stream_query`` reads a query through a server-side cursor in chunks of
+STREAM_CHUNK_ROWS rows. Column statistics (count, mean, std, min, max) are updated
+incrementally from every chunk, so they are exact for the full result. Rows are kept
+until they would exceed STREAM_MEMORY_BUDGET_MB; beyond that the kept frame becomes a
+uniform random sample that fits the budget. Memory stays flat however large the result.
+"""
+import logging
+import math
+import os
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from common.metrics import DB_ROWS
+from common.tracing import span
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_ROWS = int(os.getenv("STREAM_CHUNK_ROWS", "10000"))
+STREAM_MEMORY_BUDGET_MB = float(os.getenv("STREAM_MEMORY_BUDGET_MB", "256"))
+
+# Column used to rank rows while sampling; removed before the frame is returned.
+_SAMPLE_KEY = "__sample_key__"
+
+
+class ColumnStats:
+    """Running statistics for one column, merged chunk by chunk (Chan et al. parallel variance)."""
+
+    def __init__(self, kind: str):
+        self.kind = kind  # "numeric" or "datetime"
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min: Any = None
+        self.max: Any = None
+
+    def update(self, values: "pd.Series") -> None:
+        values = values.dropna()
+        if values.empty:
+            return
+        low, high = values.min(), values.max()
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+        if self.kind != "numeric":
+            self.count += len(values)
+            return
+        n, mean = len(values), float(values.mean())
+        m2 = float(((values - mean) ** 2).sum())
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+    @property
+    def std(self) -> float:
+        """Sample standard deviation (ddof=1, as pandas' describe)."""
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else float("nan")
+
+
+class StreamResult:
+    def __init__(self, frame: "pd.DataFrame", total_rows: int, sampled: bool,
+                 stats: Dict[str, ColumnStats]):
+        self.frame = frame
+        self.total_rows = total_rows
+        self.sampled = sampled
+        self.stats = stats
+
+    @classmethod
+    def from_frame(cls, frame: "pd.DataFrame") -> "StreamResult":
+        """Wrap an already loaded (complete) frame."""
+        stats: Dict[str, ColumnStats] = {}
+        _update_stats(stats, frame)
+        return cls(frame, len(frame), False, stats)
+
+
+def _update_stats(stats: Dict[str, ColumnStats], chunk: "pd.DataFrame") -> None:
+    from pandas.api import types
+
+    for col in chunk.columns:
+        series = chunk[col]
+        if col not in stats:
+            if types.is_bool_dtype(series):
+                continue
+            if types.is_numeric_dtype(series):
+                stats[col] = ColumnStats("numeric")
+            elif types.is_datetime64_any_dtype(series):
+                stats[col] = ColumnStats("datetime")
+            else:
+                continue
+        stats[col].update(series)
+
+
+def stream_query(sql: str, engine, chunk_rows: int = STREAM_CHUNK_ROWS,
+                 memory_budget_mb: float = STREAM_MEMORY_BUDGET_MB, params: Optional[Dict] = None) -> StreamResult:
+    """Run ``sql`` with a server-side cursor, keeping at most ``memory_budget_mb`` of rows (blocking)."""
+    import numpy as np
+    import pandas as pd
+    from sqlalchemy import text
+
+    budget = memory_budget_mb * 1024 * 1024
+    rng = np.random.default_rng()
+    kept: List[pd.DataFrame] = []
+    kept_bytes = 0
+    sample: Optional[pd.DataFrame] = None
+    sample_size = 0
+    total_rows = 0
+    stats: Dict[str, ColumnStats] = {}
+
+    with span("db.stream", **{"db.chunk_rows": chunk_rows}) as current, engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunk_rows)
+        for chunk in pd.read_sql_query(text(sql), conn, params=params, chunksize=chunk_rows):
+            # Index rows by their position in the full result so a sample keeps the query's order.
+            chunk.index = pd.RangeIndex(total_rows, total_rows + len(chunk))
+            total_rows += len(chunk)
+            _update_stats(stats, chunk)
+            if sample is None:
+                kept.append(chunk)
+                kept_bytes += int(chunk.memory_usage(deep=True).sum())
+                if kept_bytes <= budget:
+                    continue
+                # Over budget: switch to a uniform sample sized from the average row width.
+                frame = pd.concat(kept)
+                kept.clear()
+                sample_size = max(1, int(len(frame) * budget / kept_bytes))
+                logger.warning("Result exceeds %.0f MB after %d rows; keeping a %d-row sample",
+                               memory_budget_mb, total_rows, sample_size)
+                chunk = frame
+                sample = frame.iloc[0:0].assign(**{_SAMPLE_KEY: pd.Series(dtype="float64")})
+            # Bottom-k by random key is a uniform sample without replacement, merged chunk by chunk.
+            keyed = chunk.assign(**{_SAMPLE_KEY: rng.random(len(chunk))})
+            sample = pd.concat([sample, keyed]).nsmallest(sample_size, _SAMPLE_KEY)
+
+        current.set_attributes({"db.rows": total_rows, "db.sampled": sample is not None})
+    DB_ROWS.observe(total_rows)
+
+    if sample is not None:
+        frame = sample.sort_index().drop(columns=_SAMPLE_KEY).reset_index(drop=True)
+        return StreamResult(frame, total_rows, True, stats)
+    frame = pd.concat(kept, ignore_index=True) if kept else pd.DataFrame()
+    return StreamResult(frame, total_rows, False, stats)
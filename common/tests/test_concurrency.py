@@ -0,0 +1,56 @@
+import asyncio
+import contextvars
+import threading
+import time
+
+import pytest
+
+from common import concurrency
+from common.concurrency import run_blocking, shutdown_executor
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    shutdown_executor()
+    monkeypatch.setattr(concurrency, "CPU_WORKERS", 2)
+    yield 2
+    shutdown_executor()
+
+
+def test_runs_on_a_worker_thread_with_arguments(workers):
+    def call(a, b=0):
+        return threading.current_thread().name, a + b
+
+    thread, total = asyncio.run(run_blocking(call, 1, b=2))
+    assert thread.startswith("cpu-worker")
+    assert total == 3
+
+
+def test_context_variables_reach_the_worker(workers):
+    request_id = contextvars.ContextVar("request_id", default=None)
+
+    async def scenario():
+        request_id.set("abc")
+        return await run_blocking(request_id.get)
+
+    assert asyncio.run(scenario()) == "abc"
+
+
+def test_at_most_cpu_workers_run_at_once(workers):
+    lock = threading.Lock()
+    running = [0]
+    peak = [0]
+
+    def work():
+        with lock:
+            running[0] += 1
+            peak[0] = max(peak[0], running[0])
+        time.sleep(0.05)
+        with lock:
+            running[0] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(run_blocking(work) for _ in range(6)))
+
+    asyncio.run(scenario())
+    assert peak[0] == workers
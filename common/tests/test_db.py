@@ -0,0 +1,66 @@
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine
+
+from common.db import apply_deadlines, get_engine
+from common.resilience import request_deadline, set_deadline
+
+
+def test_engine_is_shared_per_uri(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'one.db'}"
+    engine = get_engine(uri)
+    assert get_engine(uri) is engine
+    assert get_engine(f"sqlite:///{tmp_path / 'two.db'}") is not engine
+
+
+def test_missing_uri_is_rejected():
+    with pytest.raises(ValueError):
+        get_engine("")
+
+
+class FakeCursor:
+    def __init__(self, statements):
+        self.statements = statements
+
+    def execute(self, sql, params):
+        self.statements.append(params[0])
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+
+    def cursor(self):
+        return FakeCursor(self.statements)
+
+
+class FakeRecord:
+    def __init__(self):
+        self.info = {}
+
+
+def test_checkout_caps_statements_with_the_request_deadline(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'deadline.db'}")
+    apply_deadlines(engine)
+    dbapi_connection, record = FakeConnection(), FakeRecord()
+
+    engine.pool.dispatch.checkout(dbapi_connection, record, None)
+    assert dbapi_connection.statements == []
+
+    token = set_deadline(2.0)
+    try:
+        engine.pool.dispatch.checkout(dbapi_connection, record, None)
+    finally:
+        request_deadline.reset(token)
+    assert 1000 < dbapi_connection.statements[-1] <= 2000
+
+    # The next caller without a deadline must not inherit the previous cap.
+    engine.pool.dispatch.checkout(dbapi_connection, record, None)
+    assert dbapi_connection.statements[-1] == 0
+    engine.pool.dispatch.checkout(dbapi_connection, record, None)
+    assert len(dbapi_connection.statements) == 2
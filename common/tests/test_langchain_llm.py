@@ -0,0 +1,69 @@
+import json
+
+import httpx
+import pytest
+
+pytest.importorskip("langchain_openai")
+
+from common.langchain_llm import build_chat_model
+from common.llm import LLMGateway
+
+
+def completion(content):
+    return {
+        "id": "chatcmpl-1", "object": "chat.completion", "created": 0, "model": "gpt-test",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 12, "completion_tokens": 3, "total_tokens": 15},
+    }
+
+
+@pytest.fixture
+def gateway(monkeypatch):
+    monkeypatch.setenv("OPENAI_API_KEY", "test-key")
+    gateway = LLMGateway()
+    yield gateway
+    gateway.sync_http_client.close()
+
+
+def serve(gateway, responses):
+    """Route the gateway's sync client to a fake OpenAI that plays ``responses`` in order."""
+    requests = []
+
+    def handler(request):
+        requests.append(json.loads(request.content))
+        return responses[len(requests) - 1]
+
+    gateway.sync_http_client.close()
+    gateway.sync_http_client = httpx.Client(transport=httpx.MockTransport(handler),
+                                            event_hooks={"response": [gateway._observe_sync_response]})
+    return requests
+
+
+def test_invoke_goes_through_gateway(gateway, monkeypatch):
+    requests = serve(gateway, [httpx.Response(200, json=completion("hello"))])
+    settled = []
+    settle = gateway.limiter.settle
+    monkeypatch.setattr(gateway.limiter, "settle", lambda reserved, used: settled.append(used) or settle(reserved, used))
+    model = build_chat_model(gateway, "gpt-test", "summary")
+
+    assert model.invoke("hi").content == "hello"
+    assert len(requests) == 1
+    [stats] = gateway.metrics.snapshot()
+    assert (stats["stage"], stats["calls"], stats["prompt_tokens"], stats["completion_tokens"]) == ("summary", 1, 12, 3)
+    # The reservation was settled against the reported usage.
+    assert settled == [15]
+
+
+def test_invoke_retries_rate_limit(gateway):
+    requests = serve(gateway, [
+        httpx.Response(429, headers={"retry-after": "0"}, json={"error": {"message": "slow down"}}),
+        httpx.Response(200, json=completion("hello")),
+    ])
+    model = build_chat_model(gateway, "gpt-test", "summary")
+
+    assert model.invoke("hi").content == "hello"
+    assert len(requests) == 2
+    [stats] = gateway.metrics.snapshot()
+    assert (stats["calls"], stats["rate_limited"], stats["errors"]) == (2, 1, 0)
+    # The 429 went through the limiter's response hook.
+    assert gateway.limiter.scale < 1.0
@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException
+
+from common import readiness
+from common.readiness import Readiness
+
+
+def test_failed_warm_up_is_retried_until_ready(monkeypatch):
+    monkeypatch.setattr(readiness, "WARMUP_RETRY_SECONDS", 0.01)
+    attempts = []
+
+    def loader():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise RuntimeError("database not up yet")
+        return "agent"
+
+    async def scenario():
+        ready = Readiness("test")
+        ready.register("agent", loader)
+        assert not ready.ready
+        ready.start()
+        value = await ready.get("agent", timeout=1)
+        await ready.stop()
+        return ready, value
+
+    ready, value = asyncio.run(scenario())
+    assert value == "agent"
+    assert ready.ready
+    status = ready.status()["components"]["agent"]
+    assert status["state"] == "ready"
+    assert status["attempts"] == 3
+    assert status["error"] is None
+
+
+def test_component_still_warming_up_answers_503(monkeypatch):
+    monkeypatch.setattr(readiness, "WARMUP_RETRY_SECONDS", 0.01)
+
+    def loader():
+        raise RuntimeError("schema unavailable")
+
+    async def scenario():
+        ready = Readiness("test")
+        ready.register("schema", loader)
+        ready.start()
+        try:
+            with pytest.raises(HTTPException) as raised:
+                await ready.get("schema", timeout=0.05)
+            return ready, raised.value
+        finally:
+            await ready.stop()
+
+    ready, error = asyncio.run(scenario())
+    assert error.status_code == 503
+    assert "Retry-After" in error.headers
+    status = ready.status()["components"]["schema"]
+    assert status["state"] == "failed"
+    assert status["error"] == "schema unavailable"
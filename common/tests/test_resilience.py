@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+from common import resilience
+from common.resilience import CircuitBreaker, hedged
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert not breaker.allow()
+
+
+def test_half_open_lets_one_probe_through(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_failed_probe_opens_the_circuit_again(clock):
+    breaker = CircuitBreaker("test", failure_threshold=5, reset_timeout=30)
+    for _ in range(5):
+        breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    clock[0] += 29
+    assert not breaker.allow()
+    clock[0] += 1
+    assert breaker.allow()
+
+
+def test_released_probe_lets_the_next_caller_probe(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+    breaker.record_failure()
+    clock[0] += 30
+    assert breaker.allow()
+    breaker.release_probe()
+    assert breaker.state == "half_open"
+    assert breaker.allow()
+
+
+def attempt(result, delay=0.0, log=None):
+    async def run():
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            if log is not None:
+                log.append(f"cancelled {result}")
+            raise
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return run
+
+
+def test_hedge_wins_over_a_slow_attempt():
+    log = []
+    attempts = [attempt("slow", 1.0, log), attempt("fast", 0.0, log)]
+    assert asyncio.run(hedged(attempts, delay=0.05)) == "fast"
+    assert log == ["cancelled slow"]
+
+
+def test_no_hedge_when_the_first_attempt_is_quick():
+    log = []
+    attempts = [attempt("first", 0.0, log), attempt("second", 0.0, log)]
+
+    async def scenario():
+        return await hedged(attempts, delay=0.5)
+
+    assert asyncio.run(scenario()) == "first"
+    assert log == []
+
+
+def test_failed_attempt_starts_the_next_at_once():
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        result = await hedged([attempt(ValueError("down")), attempt("backup")], delay=10)
+        return result, loop.time() - started
+
+    result, elapsed = asyncio.run(scenario())
+    assert result == "backup"
+    assert elapsed < 1
+
+
+def test_last_error_is_raised_when_every_attempt_fails():
+    attempts = [attempt(ValueError("first")), attempt(KeyError("last"))]
+    with pytest.raises(KeyError):
+        asyncio.run(hedged(attempts, delay=0.01))
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+
+from common.data_version import UNKNOWN_VERSION
+from common.result_cache import ResultCache
+from common.streaming import StreamResult
+
+FRAME = pd.DataFrame({"region": ["EMEA", "APAC"], "sales": [10.5, 7.0]})
+
+
+class FixedVersion:
+    def __init__(self, version):
+        self.version = version
+
+    def get(self):
+        return self.version
+
+
+def test_round_trip_is_keyed_by_normalized_sql_and_version(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("SELECT region, sales FROM t", "v1", FRAME)
+    pd.testing.assert_frame_equal(cache.get("SELECT  region,\n sales FROM t", "v1"), FRAME)
+    assert cache.get("SELECT region, sales FROM t", "v2") is None
+    assert cache.get("select region, sales from t", "v1") is None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_data_change_removes_older_results(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("SELECT 1", "v1", FRAME)
+    cache.put("SELECT 2", "v2", FRAME)
+    cache.on_data_version_change("v1", "v2")
+    assert cache.get("SELECT 1", "v1") is None
+    assert cache.get("SELECT 2", "v2") is not None
+
+
+def test_least_recently_read_file_is_evicted_first(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    cache.put("SELECT 1", "v1", FRAME)
+    cache.put("SELECT 2", "v1", FRAME)
+    os.utime(cache.path("SELECT 1", "v1"), (1, 1))
+    cache.max_bytes = os.path.getsize(cache.path("SELECT 2", "v1"))
+    assert cache.evict() == 1
+    assert cache.stats()["files"] == 1
+    assert cache.get("SELECT 2", "v1") is not None
+
+
+def test_read_sql_executes_once_per_data_version(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    executed = []
+
+    def execute(sql):
+        executed.append(sql)
+        return StreamResult.from_frame(FRAME)
+
+    first, cached = cache.read_sql("SELECT 1", FixedVersion("v1"), execute)
+    assert not cached
+    second, cached = cache.read_sql("SELECT 1", FixedVersion("v1"), execute)
+    assert cached
+    pd.testing.assert_frame_equal(second.frame, FRAME)
+    assert second.stats["sales"].count == 2
+    cache.read_sql("SELECT 1", FixedVersion(UNKNOWN_VERSION), execute)
+    assert len(executed) == 2
+
+
+def test_sampled_results_are_not_cached(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    sampled = StreamResult(FRAME, 1_000_000, True, {})
+    cache.read_sql("SELECT 1", FixedVersion("v1"), lambda sql: sampled)
+    assert cache.get("SELECT 1", "v1") is None
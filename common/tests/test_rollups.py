@@ -0,0 +1,125 @@
+import time
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("prometheus_client")
+pytest.importorskip("opentelemetry")
+
+from common.rollups import PARAM_COLUMN, Rollup, Rollups, _parse_tail, parse, tokenize
+
+
+def tail(sql):
+    return _parse_tail(tokenize(sql))
+
+
+def test_tail_of_output_columns_is_parsed():
+    assert tail('ORDER BY total DESC NULLS LAST, "Category" LIMIT 5 OFFSET 10') == [
+        ("column", "total"), ("column", "Category"),
+    ]
+    assert tail("ORDER BY 2 DESC, 1") == [("ordinal", 2), ("ordinal", 1)]
+    assert tail("LIMIT ALL OFFSET 3 ROWS") == []
+
+
+def test_tail_with_expressions_is_not_parsed():
+    assert tail("ORDER BY sum(amount) DESC") is None
+    assert tail("ORDER BY total LIMIT 5 + 1") is None
+    assert tail("FETCH FIRST 5 ROWS ONLY") is None
+
+
+def test_non_aggregating_and_unsafe_queries_are_skipped():
+    assert parse("SELECT * FROM orders") is None
+    assert parse("SELECT count(*) FROM orders WHERE order_date > now() - interval '1 day'") is None
+    assert parse("SELECT count(*) FROM orders; DROP TABLE orders") is None
+
+
+def test_queries_differing_in_filter_values_share_a_shape():
+    first = parse("SELECT category, sum(amount) AS total FROM orders o "
+                  "WHERE o.region = 'EU' AND year = 2023 GROUP BY category ORDER BY total DESC LIMIT 5")
+    second = parse("select category, sum(amount) as total from orders o "
+                   "where o.region = 'US' and year = 2024 group by category order by total desc limit 10;")
+    assert first.shape_key == second.shape_key
+    assert first.params == ["'EU'", "2023"] and second.params == ["'US'", "2024"]
+    assert first.order_by == [("column", "total")]
+    assert first.tail_sql == "ORDER BY total DESC LIMIT 5"
+    assert first.rollup_sql == (
+        f"SELECT category, sum(amount) AS total, o.region AS {PARAM_COLUMN.format(1)}, "
+        f"year AS {PARAM_COLUMN.format(2)} FROM orders o GROUP BY category, o.region, year"
+    )
+
+
+def test_other_conditions_stay_in_the_rollup():
+    parsed = parse("SELECT name, count(*) FROM orders WHERE amount > 100 AND day = '2023-01-01'::date "
+                   "GROUP BY name HAVING count(*) > 2")
+    assert parsed.params == ["'2023-01-01'::date"]
+    assert "WHERE amount > 100 GROUP BY name, day HAVING count(*) > 2" in parsed.rollup_sql
+    assert parse("SELECT name, count(*) FROM orders WHERE amount > 200 AND day = '2024-01-01'::date "
+                 "GROUP BY name HAVING count(*) > 2").shape_key != parsed.shape_key
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT sum(amount) FROM orders WHERE region = 'EU'",
+    "SELECT region, sum(amount) FROM orders WHERE region = 'EU' OR year = 2023 GROUP BY region",
+    "SELECT region, sum(amount) FROM orders WHERE year BETWEEN 2020 AND 2023 AND region = 'EU' GROUP BY region",
+    "SELECT region, rank() OVER (ORDER BY sum(amount)) FROM orders WHERE year = 2023 GROUP BY region",
+])
+def test_filters_that_cannot_be_lifted_keep_their_values(sql):
+    parsed = parse(sql)
+    assert parsed.params == []
+    assert parsed.rollup_sql == parsed.core_sql
+
+
+def test_rollup_read_applies_filter_values_and_tail():
+    parsed = parse("SELECT category, sum(amount) AS total FROM orders WHERE region = 'EU' "
+                   "GROUP BY category ORDER BY total DESC LIMIT 5")
+    rollup = Rollup("rollup_abc", parsed.shape_key, ["category", "total"], "ready", "v1")
+    assert rollup.select_sql(parsed).endswith(
+        f'"rollup_abc" WHERE {PARAM_COLUMN.format(1)} = \'EU\' ORDER BY total DESC LIMIT 5'
+    )
+    unordered = parse("SELECT category, sum(amount) AS total FROM orders WHERE region = 'US' GROUP BY category")
+    assert rollup.select_sql(unordered).endswith(f"WHERE {PARAM_COLUMN.format(1)} = 'US' ORDER BY __rollup_row")
+    missing = parse("SELECT category, sum(amount) AS total FROM orders WHERE region = 'US' "
+                    "GROUP BY category ORDER BY 3")
+    assert rollup.select_sql(missing) is None
+
+
+SHAPE_SQL = "SELECT category, sum(amount) AS total FROM orders WHERE region = 'EU' GROUP BY category"
+
+
+class FixedVersion:
+    def __init__(self, version):
+        self.version = version
+
+    def get(self):
+        return self.version
+
+
+@pytest.fixture
+def stale_rollups(monkeypatch):
+    """Rollups with one rollup of SHAPE_SQL's shape at data version v1, while the data is at v2."""
+    rollups = Rollups("postgresql://unused", FixedVersion("v2"))
+    parsed = parse(SHAPE_SQL)
+    rollups._ready = True
+    rollups._registry = {parsed.shape_key: Rollup("rollup_abc", parsed.shape_key, ["category", "total"], "ready", "v1")}
+    rollups._registry_at = time.monotonic()
+    submitted = []
+    monkeypatch.setattr(rollups, "_submit", lambda key, work: submitted.append(key))
+    yield rollups, parsed, submitted
+    rollups._worker.shutdown()
+
+
+def test_untracked_statements_count_neither_hits_nor_refreshes(stale_rollups):
+    rollups, _, submitted = stale_rollups
+    for _ in range(3):
+        assert rollups.rewrite(SHAPE_SQL, track=False) == SHAPE_SQL
+    assert rollups._hits == {} and submitted == []
+    assert rollups.counts["stale"] == 3
+
+
+def test_tracked_statement_refreshes_a_stale_rollup_when_seen_again(stale_rollups):
+    rollups, parsed, submitted = stale_rollups
+    rollups.rewrite(SHAPE_SQL)
+    assert submitted == []
+    rollups.rewrite(SHAPE_SQL.replace("'EU'", "'US'"))
+    assert submitted == [parsed.shape_key]
+    assert rollups._hits[parsed.shape_key][1] == 2
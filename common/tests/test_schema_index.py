@@ -0,0 +1,61 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from common import schema_index
+from common.schema_index import SchemaIndex, TableInfo, tokenize
+
+
+def table(name, columns=("id",), foreign_keys=(), samples=None):
+    return TableInfo(name, [(c, "integer") for c in columns], ["id"], list(foreign_keys), samples or {})
+
+
+@pytest.fixture
+def index():
+    tables = [
+        table("customers", ("id", "region"), samples={"region": ["EMEA", "APAC"]}),
+        table("orders", ("id", "customer_id", "amount"), [(["customer_id"], "customers", ["id"])]),
+        table("order_items", ("id", "order_id", "product_id"),
+              [(["order_id"], "orders", ["id"]), (["product_id"], "products", ["id"])]),
+        table("products", ("id", "category")),
+        table("employees", ("id", "salary")),
+        table("audit_log", ("id", "event")),
+    ]
+    return SchemaIndex(tables)
+
+
+def test_tokenize_stems_plurals_and_splits_names():
+    assert tokenize("Orders order_details") == {"order", "detail"}
+
+
+def test_small_schemas_are_never_pruned(index):
+    assert index.select("salary per employee") == index.table_names
+
+
+def test_select_adds_foreign_key_neighbours(index, monkeypatch):
+    monkeypatch.setattr(schema_index, "SCHEMA_PRUNE_MIN_TABLES", 0)
+    chosen = index.select("total amount of orders by region", max_tables=4)
+    assert "orders" in chosen and "customers" in chosen
+    assert "employees" not in chosen and "audit_log" not in chosen
+    assert len(chosen) <= 4
+
+
+def test_unmatched_intent_keeps_every_table(index, monkeypatch):
+    monkeypatch.setattr(schema_index, "SCHEMA_PRUNE_MIN_TABLES", 0)
+    assert index.select("xyzzy", max_tables=2) == index.table_names
+
+
+def test_build_renders_keys_and_sample_values(tmp_path):
+    path = tmp_path / "shop.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE customers (id INTEGER PRIMARY KEY, region TEXT)")
+        conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, "
+                     "customer_id INTEGER REFERENCES customers(id), amount REAL)")
+        conn.executemany("INSERT INTO customers (region) VALUES (?)", [("EMEA",), ("APAC",), ("EMEA",)])
+
+    text = SchemaIndex.build(f"sqlite:///{path}").render()
+    assert "- customers(id integer PK, region text)" in text
+    assert "e.g. region: 'EMEA', 'APAC'" in text
+    assert "customer_id integer FK->customers.id" in text
@@ -0,0 +1,90 @@
+import asyncio
+
+import pytest
+
+from common.singleflight import SingleFlight, make_key, normalize_text
+
+
+def test_normalized_requests_share_a_key():
+    assert normalize_text("  Sales  by\nRegion ") == "sales by region"
+    assert normalize_text("SELECT  'A'", lowercase=False) == "SELECT 'A'"
+    assert make_key("a", "bc") != make_key("ab", "c")
+
+
+def test_concurrent_callers_share_one_call():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def scenario():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(*(flight.do("key", work) for _ in range(5)))
+        return flight, results
+
+    flight, results = asyncio.run(scenario())
+    assert results == [1] * 5
+    assert (flight.leaders, flight.followers, flight.in_flight) == (1, 4, 0)
+
+
+def test_followers_receive_the_leaders_exception_and_nothing_is_cached():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    async def scenario():
+        flight = SingleFlight("test")
+        results = await asyncio.gather(flight.do("key", work), flight.do("key", work), return_exceptions=True)
+        with pytest.raises(RuntimeError):
+            await flight.do("key", work)
+        return results
+
+    results = asyncio.run(scenario())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert len(calls) == 2
+
+
+def test_cancelled_leader_does_not_cancel_the_shared_call():
+    async def work():
+        await asyncio.sleep(0.05)
+        return "done"
+
+    async def scenario():
+        flight = SingleFlight("test")
+        leader = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        follower = asyncio.ensure_future(flight.do("key", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        return await follower
+
+    assert asyncio.run(scenario()) == "done"
+
+
+def test_call_is_cancelled_once_every_caller_left():
+    started = []
+
+    async def work():
+        started.append(1)
+        await asyncio.sleep(1)
+
+    async def scenario():
+        flight = SingleFlight("test", cancel_abandoned=True)
+        callers = [asyncio.ensure_future(flight.do("key", work)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        assert flight.running("key")
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        return flight
+
+    flight = asyncio.run(scenario())
+    assert started == [1]
+    assert flight.abandoned == 1
+    assert not flight.running("key")
@@ -0,0 +1,76 @@
+import math
+import sqlite3
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pd = pytest.importorskip("pandas")
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine
+
+from common.streaming import ColumnStats, StreamResult, stream_query
+
+
+def test_merged_chunk_stats_match_pandas_describe():
+    rng = np.random.default_rng(7)
+    values = pd.Series(np.concatenate([rng.normal(1e6, 3, 500), rng.normal(-20, 50, 37), [np.nan] * 5]))
+    stats = ColumnStats("numeric")
+    for start in range(0, len(values), 64):
+        stats.update(values.iloc[start:start + 64])
+
+    expected = values.describe()
+    assert stats.count == expected["count"]
+    assert stats.mean == pytest.approx(expected["mean"], rel=1e-12)
+    assert stats.std == pytest.approx(expected["std"], rel=1e-9)
+    assert (stats.min, stats.max) == (expected["min"], expected["max"])
+
+
+def test_single_value_has_no_std():
+    stats = ColumnStats("numeric")
+    stats.update(pd.Series([4.0]))
+    assert stats.count == 1 and math.isnan(stats.std)
+
+
+def test_from_frame_tracks_numeric_and_datetime_columns_only():
+    frame = pd.DataFrame({
+        "amount": [1, 2, 3],
+        "day": pd.to_datetime(["2024-01-03", "2024-01-01", "2024-01-02"]),
+        "region": ["a", "b", "c"],
+        "active": [True, False, True],
+    })
+    result = StreamResult.from_frame(frame)
+    assert set(result.stats) == {"amount", "day"}
+    assert result.stats["day"].min == pd.Timestamp("2024-01-01")
+    assert result.stats["day"].count == 3
+    assert (result.total_rows, result.sampled) == (3, False)
+
+
+@pytest.fixture
+def engine(tmp_path):
+    path = tmp_path / "rows.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE t (n INTEGER, x REAL)")
+        conn.executemany("INSERT INTO t VALUES (?, ?)", [(n, n * 0.5) for n in range(5000)])
+    return create_engine(f"sqlite:///{path}")
+
+
+def test_small_result_is_kept_whole(engine):
+    result = stream_query("SELECT n, x FROM t ORDER BY n", engine, chunk_rows=1000)
+    assert not result.sampled
+    assert result.total_rows == len(result.frame) == 5000
+    assert result.frame["n"].tolist() == list(range(5000))
+
+
+def test_large_result_keeps_an_ordered_sample_within_budget(engine):
+    budget_mb = 0.01
+    result = stream_query("SELECT n, x FROM t ORDER BY n", engine, chunk_rows=500, memory_budget_mb=budget_mb)
+    assert result.sampled
+    assert result.total_rows == 5000
+    assert 0 < len(result.frame) < 5000
+    assert result.frame.memory_usage(deep=True).sum() <= budget_mb * 1024 * 1024
+    assert result.frame["n"].is_monotonic_increasing and result.frame["n"].is_unique
+    # Statistics still cover every row, not just the sample.
+    assert result.stats["n"].count == 5000
+    assert result.stats["n"].mean == pytest.approx(2499.5)
+    assert (result.stats["x"].min, result.stats["x"].max) == (0.0, 2499.5)
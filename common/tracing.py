@@ -0,0 +1,163 @@
+"""
+OpenTelemetry tracing shared by every service.
+
+``add_tracing(app, service)`` configures the tracer provider and opens a server span
+per request, continuing the caller's trace from its ``traceparent`` header; the
+gateway forwards that header on every aiohttp call with ``inject_headers``. Work inside
+a request is wrapped in ``span(...)``: DB statements (via SQLAlchemy engine events),
+LLM calls, chart renders and object-store I/O. Spans started on the executor through
+run_blocking keep their parent because the context is copied with the task.
+
+TRACING_EXPORTER selects where spans go:
+- ``none`` (default): spans are created but not exported
+- ``json``: one JSON object per line in TRACING_JSON_DIR/<service>.jsonl
+- ``otlp``: an OTLP/HTTP collector at OTEL_EXPORTER_OTLP_ENDPOINT
+- ``console``: stdout
+"""
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Sequence
+
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import ReadableSpan, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SpanExporter, SpanExportResult
+from opentelemetry.trace import Status, StatusCode
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").strip().lower()
+TRACING_JSON_DIR = os.getenv("TRACING_JSON_DIR", "/var/log/khwarizmi/traces")
+# SQL text longer than this is cut in span attributes.
+TRACING_MAX_STATEMENT = int(os.getenv("TRACING_MAX_STATEMENT", "2000"))
+
+tracer = trace.get_tracer("khwarizmi")
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+class JsonFileSpanExporter(SpanExporter):
+    """Appends finished spans to a JSON-lines file (safe to share between worker processes)."""
+
+    def __init__(self, path: str):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans: Sequence[ReadableSpan]) -> SpanExportResult:
+        lines = "".join(json.dumps(json.loads(span.to_json()), separators=(",", ":")) + "\n" for span in spans)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError as e:
+            logger.warning("Could not write spans to %s: %s", self.path, e)
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+
+def _exporter(service: str) -> Optional[SpanExporter]:
+    if TRACING_EXPORTER == "json":
+        return JsonFileSpanExporter(os.path.join(TRACING_JSON_DIR, f"{service}.jsonl"))
+    if TRACING_EXPORTER == "otlp":
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+
+        return OTLPSpanExporter()
+    if TRACING_EXPORTER == "console":
+        return ConsoleSpanExporter()
+    return None
+
+
+def setup_tracing(service: str) -> None:
+    """Install the process-wide tracer provider once."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        provider = TracerProvider(resource=Resource.create({"service.name": service}))
+        exporter = _exporter(service)
+        if exporter is not None:
+            provider.add_span_processor(BatchSpanProcessor(exporter))
+        trace.set_tracer_provider(provider)
+        _configured = True
+        logger.info("Tracing for %s (exporter=%s)", service, TRACING_EXPORTER)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[trace.Span]:
+    """Child span of the current context; exceptions are recorded and re-raised."""
+    with tracer.start_as_current_span(name, attributes=_clean(attributes)) as current:
+        yield current
+
+
+def _clean(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in attributes.items() if v is not None}
+
+
+def inject_headers(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Add traceparent/tracestate for the current span to outgoing request headers."""
+    headers = dict(headers or {})
+    propagate.inject(headers)
+    return headers
+
+
+def add_tracing(app, service: str) -> None:
+    """Configure tracing and open a server span per request, continuing the caller's trace."""
+    setup_tracing(service)
+
+    @app.middleware("http")
+    async def tracing_middleware(request, call_next):
+        context = propagate.extract(dict(request.headers))
+        with tracer.start_as_current_span(
+            f"{request.method} {request.url.path}",
+            context=context,
+            kind=trace.SpanKind.SERVER,
+            attributes={"http.method": request.method, "http.target": request.url.path, "service.name": service},
+        ) as current:
+            response = await call_next(request)
+            current.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                current.set_status(Status(StatusCode.ERROR))
+            return response
+
+
+def instrument_engine(engine) -> None:
+    """Span per SQL statement executed through ``engine`` (agent tools, pandas, health checks)."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        current = tracer.start_span("db.query", attributes={
+            "db.system": "postgresql",
+            "db.statement": statement[:TRACING_MAX_STATEMENT],
+        })
+        conn.info.setdefault("trace_spans", []).append(current)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        spans = conn.info.get("trace_spans")
+        if not spans:
+            return
+        current = spans.pop()
+        if cursor.rowcount is not None and cursor.rowcount >= 0:
+            current.set_attribute("db.rows", cursor.rowcount)
+        current.end()
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        spans = conn.info.get("trace_spans") if conn is not None else None
+        if not spans:
+            return
+        current = spans.pop()
+        current.record_exception(exception_context.original_exception)
+        current.set_status(Status(StatusCode.ERROR))
+        current.end()
@@ -0,0 +1,2 @@
+# benchmarks/load_test.py is a load generator run by hand, not a test module.
+collect_ignore = ["benchmarks"]
@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import text
+
+from common.db import get_engine
+from common.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger("intent-to-query.tool-cache")
+
+# Seconds a schema fingerprint is trusted before the catalog is asked again.
+SCHEMA_FINGERPRINT_TTL = float(os.getenv("SCHEMA_FINGERPRINT_TTL", "60"))
+# Cached tool output is recomputed after this long even if the schema is unchanged,
+# so sample rows in table descriptions do not drift too far from the data.
+AGENT_TOOL_CACHE_TTL = float(os.getenv("AGENT_TOOL_CACHE_TTL", "3600"))
+
+# Hash of every column (with type and nullability) and constraint in the current schema;
+# any DDL that changes what sql_db_schema would print changes the fingerprint.
+SCHEMA_FINGERPRINT_SQL = text("""
+    SELECT md5(
+        COALESCE((
+            SELECT string_agg(table_name || '.' || column_name || ':' || data_type || ':' || is_nullable,
+                              ',' ORDER BY table_name, ordinal_position)
+            FROM information_schema.columns WHERE table_schema = current_schema()
+        ), '')
+        || '|' ||
+        COALESCE((
+            SELECT string_agg(table_name || '.' || constraint_name || ':' || constraint_type,
+                              ',' ORDER BY table_name, constraint_name)
+            FROM information_schema.table_constraints WHERE table_schema = current_schema()
+        ), '')
+    )
+""")
+
+
+class CachedSQLDatabase(SQLDatabase):
+    """
+    SQLDatabase whose catalog answers are memoized per schema fingerprint.
+
+    The agent's sql_db_list_tables and sql_db_schema tools return the same text for
+    every question until the schema changes, yet each call reflects tables and selects
+    sample rows. Here each table's description is computed once and reused by every
+    agent (one instance is shared across models); a changed fingerprint drops the cache
+    and the reflected metadata. Query results (sql_db_query) are never cached.
+    """
+
+    def __init__(self, *args, ttl: float = AGENT_TOOL_CACHE_TTL, **kwargs):
+        # SQLDatabase.__init__ already lists the usable tables, through the cache below.
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple, Tuple[float, object]] = {}
+        self._fingerprint: Optional[str] = None
+        self._fingerprint_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        super().__init__(*args, **kwargs)
+
+    def schema_fingerprint(self) -> str:
+        """Current schema fingerprint, re-read at most every SCHEMA_FINGERPRINT_TTL seconds (blocking)."""
+        with self._lock:
+            if self._fingerprint is not None and time.monotonic() - self._fingerprint_at < SCHEMA_FINGERPRINT_TTL:
+                return self._fingerprint
+        with self._engine.connect() as conn:
+            fingerprint = conn.execute(SCHEMA_FINGERPRINT_SQL).scalar() or ""
+        with self._lock:
+            if self._fingerprint is not None and fingerprint != self._fingerprint:
+                logger.info("Schema changed (%s -> %s); dropping cached tool output",
+                            self._fingerprint[:8], fingerprint[:8])
+                self._entries.clear()
+                # Reflected tables are stale too; get_table_info reflects missing tables again.
+                self._metadata.clear()
+            self._fingerprint = fingerprint
+            self._fingerprint_at = time.monotonic()
+        return fingerprint
+
+    def _cached(self, key: Tuple, compute: Callable[[], object]) -> object:
+        key = (self.schema_fingerprint(), *key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self.hits += 1
+                CACHE_REQUESTS.labels("agent_tool", "hit").inc()
+                return entry[1]
+        self.misses += 1
+        CACHE_REQUESTS.labels("agent_tool", "miss").inc()
+        value = compute()
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+        return value
+
+    def get_usable_table_names(self) -> Iterable[str]:
+        return self._cached(("tables",), lambda: sorted(super(CachedSQLDatabase, self).get_usable_table_names()))
+
+    def get_table_info(self, table_names: Optional[List[str]] = None, get_col_comments: bool = False) -> str:
+        """Per-table descriptions (DDL plus sample rows), each computed once and joined in request order."""
+        usable = set(self.get_usable_table_names())
+        names = list(dict.fromkeys(table_names)) if table_names is not None else sorted(usable)
+        missing = set(names) - usable
+        if missing:
+            raise ValueError(f"table_names {missing} not found in database")
+        base = super(CachedSQLDatabase, self)
+        return "\n\n".join(
+            self._cached(("table_info", name, get_col_comments),
+                         lambda name=name: base.get_table_info([name], get_col_comments))
+            for name in names
+        )
+
+    def warm(self) -> int:
+        """Describe every usable table ahead of the first question; returns the table count."""
+        names = list(self.get_usable_table_names())
+        self.get_table_info(names)
+        return len(names)
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = len(self._entries)
+        return {"hits": self.hits, "misses": self.misses, "entries": entries,
+                "fingerprint": (self._fingerprint or "")[:12]}
+
+
+_databases: Dict[Tuple[str, Optional[Tuple[str, ...]]], CachedSQLDatabase] = {}
+_databases_lock = threading.Lock()
+
+
+def get_sql_database(uri: str, include_tables: Optional[List[str]] = None) -> CachedSQLDatabase:
+    """Process-wide CachedSQLDatabase per URI and table scope, shared by the agents for every model."""
+    key = (uri, tuple(include_tables) if include_tables is not None else None)
+    with _databases_lock:
+        db = _databases.get(key)
+        if db is None:
+            db = CachedSQLDatabase(engine=get_engine(uri), include_tables=include_tables)
+            _databases[key] = db
+    return db
+
+
+def tool_cache_stats() -> List[dict]:
+    with _databases_lock:
+        databases = list(_databases.values())
+    return [db.stats() for db in databases]
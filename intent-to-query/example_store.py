@@ -0,0 +1,115 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import List, NamedTuple
+
+import numpy as np
+
+logger = logging.getLogger("intent-to-query.examples")
+
+EXAMPLE_STORE_PATH = os.getenv("EXAMPLE_STORE_PATH", "/var/cache/khwarizmi/sql_examples.sqlite3")
+EXAMPLE_TOP_K = int(os.getenv("EXAMPLE_TOP_K", "3"))
+# Examples less similar than this are not shown to the model at all.
+EXAMPLE_MIN_SIMILARITY = float(os.getenv("EXAMPLE_MIN_SIMILARITY", "0.5"))
+# When the best example is at least this similar, SQL is written in one call instead of by the agent.
+EXAMPLE_FAST_PATH_SIMILARITY = float(os.getenv("EXAMPLE_FAST_PATH_SIMILARITY", "0.8"))
+
+
+class Example(NamedTuple):
+    question: str
+    sql: str
+    similarity: float
+
+
+class ExampleStore:
+    """
+    Verified (question, SQL) pairs with a cosine-similarity index over question embeddings.
+
+    Rows live in SQLite so they survive restarts and are shared by every worker on the host;
+    each process keeps the embeddings in memory and picks up rows added by other workers on
+    the next search. All methods are blocking; call them through run_blocking.
+    """
+
+    def __init__(self, path: str = EXAMPLE_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._vectors = np.empty((0, 0), dtype=np.float32)
+        self._last_id = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS examples (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                question_key TEXT UNIQUE NOT NULL,
+                question TEXT NOT NULL,
+                sql TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                verified_at REAL NOT NULL
+            )
+        """)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, question_key: str, question: str, sql: str, embedding: List[float]) -> None:
+        """Store a verified pair; a question seen before keeps its row and takes the newer SQL."""
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO examples (question_key, question, sql, embedding, created_at, verified_at) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(question_key) DO UPDATE SET sql = excluded.sql, verified_at = excluded.verified_at",
+            (question_key, question, sql, np.asarray(embedding, dtype=np.float32).tobytes(), now, now),
+        )
+
+    def sync(self) -> int:
+        """Load rows added since the last sync (by any worker) into the in-memory index."""
+        with self._lock:
+            rows = self._connect().execute(
+                "SELECT id, embedding FROM examples WHERE id > ? ORDER BY id", (self._last_id,)
+            ).fetchall()
+            if not rows:
+                return 0
+            vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            ids = np.array([row_id for row_id, _ in rows], dtype=np.int64)
+            self._vectors = vectors if not len(self._ids) else np.vstack([self._vectors, vectors])
+            self._ids = np.concatenate([self._ids, ids])
+            self._last_id = int(ids[-1])
+            return len(rows)
+
+    def search(self, embedding: List[float], k: int = EXAMPLE_TOP_K,
+               min_similarity: float = EXAMPLE_MIN_SIMILARITY) -> List[Example]:
+        """Top-k stored examples by cosine similarity to the question embedding, best first."""
+        self.sync()
+        with self._lock:
+            if not len(self._ids):
+                return []
+            query = np.asarray(embedding, dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            scores = self._vectors @ query
+            top = np.argsort(-scores)[:k]
+            matches = [(int(self._ids[i]), float(scores[i])) for i in top if scores[i] >= min_similarity]
+        if not matches:
+            return []
+        placeholders = ",".join("?" * len(matches))
+        rows = dict(
+            (row[0], row[1:]) for row in self._connect().execute(
+                f"SELECT id, question, sql FROM examples WHERE id IN ({placeholders})",
+                [row_id for row_id, _ in matches],
+            )
+        )
+        return [Example(*rows[row_id], similarity) for row_id, similarity in matches if row_id in rows]
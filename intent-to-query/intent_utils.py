@@ -1,17 +1,18 @@
 import os
+import re
 import logging
 import sqlparse
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
 from sqlalchemy.exc import SQLAlchemyError
 from rich.console import Console
 from rich.syntax import Syntax
 
 from langchain.callbacks.base import BaseCallbackHandler
-from langchain.callbacks.manager import CallbackManager
-from langchain_community.utilities import SQLDatabase
 from langchain_community.agent_toolkits import create_sql_agent
-from langchain_openai import ChatOpenAI
+
+from common.llm import get_llm_gateway
+from common.tracing import span
+from cached_database import get_sql_database
 
 # Load environment variables
 load_dotenv()
@@ -36,40 +37,31 @@ class SQLQueryLogger(BaseCallbackHandler):
 def setup_postgres_agent(postgres_uri: str, include_tables=None, model="gpt-4o-mini") -> tuple:
     """
     Initializes the SQL agent using the provided PostgreSQL URI.
-    Returns the agent executor and query logger.
+    Returns the agent executor; query logging is attached per call in get_result.
+    The SQLDatabase (and its cached catalog tool output) is shared by the agents for every model.
     """
     try:
         if not postgres_uri:
             raise ValueError("POSTGRES_URI is not set in environment variables.")
 
-        logger.info("Creating SQLAlchemy engine...")
-        engine = create_engine(postgres_uri)
-
         logger.info("Connecting to SQLDatabase...")
-        db = SQLDatabase(engine=engine, include_tables=include_tables)
+        db = get_sql_database(postgres_uri, include_tables=include_tables)
 
         logger.info("Initializing OpenAI LLM...")
-        llm = ChatOpenAI(
-            model=model,
-            temperature=0,
-        )
-
-        query_logger = SQLQueryLogger()
-        callback_manager = CallbackManager([query_logger])
+        llm = get_llm_gateway().chat_model(model, stage="sql", temperature=0)
 
         logger.info("Creating LangChain SQL agent...")
         agent_executor = create_sql_agent(
             llm,
             db=db,
             verbose=True,
-            callback_manager=callback_manager,
             max_iterations=50,
             max_execution_time=120,
             early_stopping_method="generate"
         )
 
         logger.info("SQL agent successfully initialized.")
-        return agent_executor, query_logger
+        return agent_executor
 
     except SQLAlchemyError as e:
         logger.exception("Database connection failed.")
@@ -79,15 +71,18 @@ def setup_postgres_agent(postgres_uri: str, include_tables=None, model="gpt-4o-m
         raise RuntimeError("Failed to initialize SQL agent.") from e
 
 
-def get_result(query: str, agent_executor: object, query_logger: SQLQueryLogger) -> tuple:
+async def get_result(query: str, agent_executor: object) -> tuple:
     """
     Executes the query using the agent and returns the result and SQL query used.
+    Each call gets its own SQLQueryLogger so concurrent requests do not share steps.
     """
     try:
-        query_logger.intermediate_steps.clear()
+        query_logger = SQLQueryLogger()
         logger.info("Invoking SQL agent with query: %s", query)
 
-        result = agent_executor.invoke({"input": query})
+        with span("agent.run") as current:
+            result = await agent_executor.ainvoke({"input": query}, config={"callbacks": [query_logger]})
+            current.set_attribute("agent.steps", sum(1 for event_type, _ in query_logger.intermediate_steps if event_type == "action"))
 
         captured_query = None
         for event_type, event in query_logger.intermediate_steps:
@@ -102,6 +97,39 @@ def get_result(query: str, agent_executor: object, query_logger: SQLQueryLogger)
         raise RuntimeError("Failed to execute query using agent.") from e
 
 
+# Static prefix for the single-call path; schema and examples follow, the question goes last.
+FEW_SHOT_INSTRUCTIONS = """You are an expert PostgreSQL analyst. Write one read-only SQL query that answers the user's question.
+- Use only the tables and columns in the schema below.
+- Follow the join paths and conventions of the verified examples where they apply.
+- Return only the SQL query, with no explanation and no markdown."""
+
+
+def format_examples(examples) -> str:
+    """Render retrieved examples as question/SQL pairs for a prompt."""
+    return "\n\n".join(f"Question: {example.question}\nSQL: {example.sql}" for example in examples)
+
+
+def extract_sql(text: str) -> str:
+    """Strip markdown fences and trailing semicolons from a model reply."""
+    match = re.search(r"```(?:sql)?\s*(.*?)```", text, flags=re.DOTALL | re.IGNORECASE)
+    sql = match.group(1) if match else text
+    return sql.strip().rstrip(";").strip()
+
+
+async def generate_sql_from_examples(question: str, schema: str, examples, model: str) -> str:
+    """Write SQL with a single LLM call, guided by the nearest verified examples."""
+    response = await get_llm_gateway().chat(
+        model=model,
+        stage="sql",
+        messages=[
+            {"role": "system", "content": f"{FEW_SHOT_INSTRUCTIONS}\n\nSchema:\n{schema}"},
+            {"role": "user", "content": f"Verified examples:\n{format_examples(examples)}\n\nQuestion: {question}"},
+        ],
+        temperature=0,
+    )
+    return extract_sql(response.choices[0].message.content or "")
+
+
 def pprint_sql(q):
     """
     Pretty-prints the SQL query using Rich.
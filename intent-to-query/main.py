@@ -1,13 +1,23 @@
 import os
 import logging
-from fastapi import FastAPI, HTTPException
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel
-from typing import Optional
+from typing import Dict, List, Optional
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, inspect
+from sqlalchemy import inspect, text
 from sqlalchemy.exc import SQLAlchemyError
 
-from intent_utils import setup_postgres_agent, get_result
+from common.concurrency import run_blocking
+from common.db import get_engine
+from common.llm import add_llm_stats_route, add_priority_middleware, get_llm_gateway, model_router
+from common.metrics import add_metrics
+from common.readiness import Readiness, add_health_routes
+from common.resilience import add_deadline_middleware, cancel_on_disconnect
+from common.schema_index import SchemaIndexProvider
+from common.singleflight import SingleFlight, make_key, normalize_text
+from common.tracing import add_tracing
+from example_store import EXAMPLE_FAST_PATH_SIMILARITY, Example, ExampleStore
 
 # === Load environment variables ===
 load_dotenv()
@@ -16,16 +26,34 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
 logger = logging.getLogger(__name__)
 
-# === FastAPI App ===
-app = FastAPI(title="Postgres AI SQL Agent")
-
 # === Config ===
 POSTGRES_URI = os.getenv("POSTGRES_URI")
 
+readiness = Readiness("intent-to-query")
+# A question no caller is waiting for any more (e.g. a discarded speculative call) stops
+# its agent run instead of finishing it.
+ask_flight = SingleFlight("ask", cancel_abandoned=True)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    readiness.start()
+    yield
+    await readiness.stop()
+    await get_llm_gateway().aclose()
+
+# === FastAPI App ===
+app = FastAPI(title="Postgres AI SQL Agent", lifespan=lifespan)
+add_health_routes(app, readiness)
+add_priority_middleware(app)
+add_tracing(app, "intent-to-query")
+add_metrics(app)
+add_deadline_middleware(app)
+add_llm_stats_route(app)
+
 def get_table_names(uri: str) -> list[str]:
     """Connect to PostgreSQL and return list of table names."""
     try:
-        engine = create_engine(uri)
+        engine = get_engine(uri)
         inspector = inspect(engine)
         tables = inspector.get_table_names()
         logger.info("Discovered tables: %s", tables)
@@ -34,30 +62,170 @@ def get_table_names(uri: str) -> list[str]:
         logger.exception("Failed to inspect PostgreSQL schema.")
         raise RuntimeError("Unable to connect to database or fetch tables.") from e
 
-# === Initialize Agent ===
-try:
-    TABLE_SCOPE = get_table_names(POSTGRES_URI)
-    agent_executor, query_logger = setup_postgres_agent(POSTGRES_URI, include_tables=TABLE_SCOPE)
-except Exception as e:
-    logger.critical("Agent initialization failed: %s", e)
-    raise RuntimeError("Agent could not be initialized.") from e
+# === Initialize Agent (in the background after startup) ===
+DEFAULT_SQL_MODEL = model_router.route("sql")
+AGENT_TOOL_CACHE_WARM = os.getenv("AGENT_TOOL_CACHE_WARM", "true").strip().lower() in ("1", "true", "yes")
+
+def build_agent(model: str = DEFAULT_SQL_MODEL):
+    """Introspect the schema and build the SQL agent; LangChain is only imported here."""
+    from intent_utils import setup_postgres_agent
+
+    table_scope = get_table_names(POSTGRES_URI)
+    agent = setup_postgres_agent(POSTGRES_URI, include_tables=table_scope, model=model)
+    if AGENT_TOOL_CACHE_WARM:
+        # Describe every table now so the agent's first schema lookups are cache hits.
+        from cached_database import get_sql_database
+
+        described = get_sql_database(POSTGRES_URI, include_tables=table_scope).warm()
+        logger.info("Cached descriptions of %d tables for the agent", described)
+    return agent
+
+readiness.register("agent", build_agent)
+
+# Agents for models other than the default are built on first use and kept.
+agents: Dict[str, object] = {}
+agent_build_flight = SingleFlight("agent-build")
+
+async def get_agent(model: str):
+    default_agent = await readiness.get("agent")
+    if model == DEFAULT_SQL_MODEL:
+        return default_agent
+    if model not in agents:
+        agents[model] = await agent_build_flight.do(model, lambda: run_blocking(build_agent, model))
+    return agents[model]
+
+def load_example_store() -> ExampleStore:
+    store = ExampleStore()
+    logger.info("Loaded %d verified SQL examples", store.sync())
+    return store
+
+# Column types, keys and sample values per table, pruned per question on wide schemas.
+schema_provider = SchemaIndexProvider(POSTGRES_URI)
+readiness.register("schema", schema_provider.load)
+readiness.register("examples", load_example_store)
+
+def explain_sql(sql: str) -> bool:
+    """True if the SQL is a single read-only statement PostgreSQL can plan (blocking)."""
+    statement = sql.strip().rstrip(";")
+    if ";" in statement or not statement.lower().startswith(("select", "with")):
+        return False
+    try:
+        with get_engine(POSTGRES_URI).connect() as conn:
+            conn.execute(text(f"EXPLAIN {statement}"))
+        return True
+    except SQLAlchemyError as e:
+        logger.info("Generated SQL failed EXPLAIN: %s", e)
+        return False
+
+async def find_examples(question: str) -> List[Example]:
+    """Nearest verified examples for a question; empty (never an error) if retrieval fails."""
+    store = await readiness.get("examples")
+    if not len(store) and not await run_blocking(store.sync):
+        return []
+    try:
+        [embedding] = await get_llm_gateway().embed([question], stage="examples")
+    except Exception as e:
+        logger.warning("Example retrieval skipped: %s", e)
+        return []
+    return await run_blocking(store.search, embedding)
 
 # === Request & Response Models ===
 class QueryRequest(BaseModel):
     question: str
+    model: Optional[str] = None  # routed to the stage default when omitted
 
 class QueryResponse(BaseModel):
     answer: str
     sql_query: Optional[str]
+    model: str
+    examples_used: int = 0
+    fast_path: bool = False  # SQL came from one few-shot call rather than the agent loop
+
+class ExampleRequest(BaseModel):
+    question: str
+    sql_query: str
+
+async def run_query(question: str, model: str) -> QueryResponse:
+    """
+    Answer with the routed model. Close verified examples allow a single-call fast path
+    (checked with EXPLAIN); otherwise the agent runs with the pruned schema and the examples
+    as hints. An agent answer without SQL is retried on the stronger model.
+    """
+    from intent_utils import format_examples, generate_sql_from_examples, get_result
+
+    await readiness.get("schema")
+    schema_index = await schema_provider.get()
+    tables = await schema_index.prune(question, get_llm_gateway())
+    schema = schema_index.render(tables)
+
+    examples = await find_examples(question)
+    if examples and examples[0].similarity >= EXAMPLE_FAST_PATH_SIMILARITY:
+        try:
+            sql_query = await generate_sql_from_examples(question, schema, examples, model)
+            if sql_query and await run_blocking(explain_sql, sql_query):
+                logger.info("Fast path: SQL from %d examples (best similarity %.2f)",
+                            len(examples), examples[0].similarity)
+                return QueryResponse(
+                    answer=f"SQL written from {len(examples)} verified similar questions.",
+                    sql_query=sql_query, model=model, examples_used=len(examples), fast_path=True,
+                )
+        except Exception as e:
+            logger.warning("Fast path failed, falling back to the agent: %s", e)
+
+    # The schema hint spares the agent most of its list-tables/describe-table round trips.
+    agent_input = f"{question}\n\nRelevant schema:\n{schema}"
+    if examples:
+        agent_input += f"\n\nVerified SQL for similar questions:\n{format_examples(examples)}"
+    answer, sql_query = await get_result(agent_input, await get_agent(model))
+    stronger = model_router.escalate(model)
+    if not sql_query and stronger:
+        logger.warning("Agent on %s produced no SQL; escalating to %s", model, stronger)
+        model = stronger
+        answer, sql_query = await get_result(agent_input, await get_agent(model))
+    return QueryResponse(answer=answer, sql_query=sql_query, model=model, examples_used=len(examples))
 
 # === Endpoint ===
 @app.post("/ask", response_model=QueryResponse)
-def ask_question(request: QueryRequest):
+async def ask_question(request: QueryRequest, http_request: Request):
+    await readiness.get("agent")
+    model = model_router.route("sql", request.model)
+
     try:
-        logger.info("Received query: %s", request.question)
-        answer, sql_query = get_result(request.question, agent_executor, query_logger)
-        logger.info("Generated SQL: %s", sql_query)
-        return QueryResponse(answer=answer, sql_query=sql_query)
+        logger.info("Received query: %s (model=%s)", request.question, model)
+        key = make_key(normalize_text(request.question), model)
+        response = await cancel_on_disconnect(
+            http_request, ask_flight.do(key, lambda: run_query(request.question, model))
+        )
+        logger.info("Generated SQL: %s", response.sql_query)
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         logger.exception("Failed to process query: %s", request.question)
         raise HTTPException(status_code=500, detail="Failed to generate answer or SQL.")
+
+@app.post("/examples")
+async def add_example(request: ExampleRequest):
+    """Store a (question, SQL) pair from a successful pipeline run as a few-shot example."""
+    store = await readiness.get("examples")
+    if not await run_blocking(explain_sql, request.sql_query):
+        raise HTTPException(status_code=400, detail="SQL is not a valid read-only query.")
+    [embedding] = await get_llm_gateway().embed([request.question], stage="examples")
+    await run_blocking(store.add, normalize_text(request.question), request.question.strip(),
+                       request.sql_query.strip().rstrip(";"), embedding)
+    logger.info("Stored SQL example for: %s", request.question)
+    return {"stored": True}
+
+@app.get("/agent/stats")
+async def agent_stats():
+    """Hit rate of the cached list-tables / table-info tool output."""
+    from cached_database import tool_cache_stats
+
+    await readiness.get("agent")
+    return {"tool_cache": tool_cache_stats()}
+
+@app.get("/examples/stats")
+async def example_stats():
+    store = await readiness.get("examples")
+    await run_blocking(store.sync)
+    return {"examples": len(store)}
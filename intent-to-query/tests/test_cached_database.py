@@ -0,0 +1,54 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("langchain_community")
+
+from sqlalchemy import create_engine, text
+
+import cached_database
+from cached_database import CachedSQLDatabase
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    path = tmp_path / "shop.db"
+    with sqlite3.connect(path) as conn:
+        conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY, amount REAL)")
+        conn.execute("INSERT INTO orders (amount) VALUES (9.5)")
+    # SQLite stand-in for the information_schema fingerprint.
+    monkeypatch.setattr(cached_database, "SCHEMA_FINGERPRINT_SQL",
+                        text("SELECT group_concat(sql, ';') FROM sqlite_master"))
+    monkeypatch.setattr(cached_database, "SCHEMA_FINGERPRINT_TTL", 0)
+    return path
+
+
+def test_table_info_is_computed_once_per_schema(path):
+    db = CachedSQLDatabase(engine=create_engine(f"sqlite:///{path}"))
+    first = db.get_table_info(["orders"])
+    assert "CREATE TABLE orders" in first
+    assert db.get_table_info(["orders"]) == first
+    assert db.get_usable_table_names() == ["orders"]
+    assert db.misses == 2  # the table list and the orders description
+
+
+def test_schema_change_drops_cached_descriptions(path):
+    db = CachedSQLDatabase(engine=create_engine(f"sqlite:///{path}"))
+    assert db.warm() == 1
+    assert "currency" not in db.get_table_info(["orders"])
+    with sqlite3.connect(path) as conn:
+        conn.execute("ALTER TABLE orders ADD COLUMN currency TEXT")
+    assert "currency" in db.get_table_info(["orders"])
+
+
+def test_unknown_table_is_rejected(path):
+    db = CachedSQLDatabase(engine=create_engine(f"sqlite:///{path}"))
+    with pytest.raises(ValueError):
+        db.get_table_info(["customers"])
+
+
+def test_expired_entries_are_recomputed(path):
+    db = CachedSQLDatabase(engine=create_engine(f"sqlite:///{path}"), ttl=0)
+    db.get_table_info(["orders"])
+    db.get_table_info(["orders"])
+    assert db.hits == 0
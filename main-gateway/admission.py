@@ -0,0 +1,204 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from common.llm import PRIORITIES
+from common.metrics import ADMISSION_IN_USE, ADMISSION_QUEUED, ADMISSION_REJECTED
+
+logger = logging.getLogger("main-gateway.admission")
+
+# Pipeline runs executing at once in this worker; cache hits and single-flight followers do not count.
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "16"))
+# Interactive requests allowed to wait for a slot; beyond this they get 429 at once.
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "32"))
+# Seconds an interactive request waits for a slot before it gets 503.
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+# Slots batch work can never take, so an interactive request always finds room quickly.
+ADMISSION_INTERACTIVE_RESERVE = int(os.getenv("ADMISSION_INTERACTIVE_RESERVE", "2"))
+
+
+class Overloaded(HTTPException):
+    """Request shed by admission control; carries a Retry-After estimate."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+class AdmissionTerms:
+    """
+    Priority and shedding mode of one admission request.
+
+    A single-flight run is admitted once for every caller sharing it, so a caller joining
+    the run calls ``join`` with its own terms: the run takes the most urgent priority of
+    its callers, and a caller that may not be shed keeps it from being shed, whoever
+    started it.
+    """
+
+    def __init__(self, limiter: "PriorityLimiter", priority: str, shed: bool):
+        self.limiter = limiter
+        self.priority = priority if priority in PRIORITIES else max(PRIORITIES, key=PRIORITIES.get)
+        self.level = PRIORITIES[self.priority]
+        self.shed = shed
+        self.waiting = False
+
+    def join(self, priority: str, shed: bool) -> None:
+        level = PRIORITIES.get(priority, self.level)
+        if level < self.level:
+            self.priority, self.level = priority, level
+            if self.waiting:
+                self.limiter._requeue(self)
+        if self.shed and not shed:
+            self.shed = False
+            if self.waiting:
+                self.limiter._sheddable_waiting -= 1
+
+    def slot(self):
+        return self.limiter._hold(self)
+
+
+class PriorityLimiter:
+    """
+    Concurrency limit whose waiters are served by (priority, arrival).
+
+    Callers that may be shed (``shed=True``, synchronous interactive requests) are
+    rejected with 429 when the wait queue is full and 503 when their wait exceeds
+    ``queue_timeout``; a quick "retry later" beats a request that times out anyway.
+    Other callers (batch runs, jobs, background refreshes) wait as long as needed.
+    Batch callers cannot take the last ``reserve`` slots. Limits are per worker process.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: Optional[int] = None,
+                 queue_timeout: Optional[float] = None, reserve: int = 0):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.reserve = min(reserve, max(0, limit - 1))
+        self.in_use = 0
+        self._waiters: List[Tuple[int, int, asyncio.Future]] = []
+        self._entries: Dict[AdmissionTerms, Tuple[int, int, asyncio.Future]] = {}
+        self._sequence = itertools.count()
+        self._sheddable_waiting = 0  # only these count against max_queue
+        # Exponentially weighted mean time a slot is held, for Retry-After.
+        self.mean_hold = 1.0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "timeout": 0}
+
+    def _fits(self, level: int) -> bool:
+        free = self.limit - self.in_use
+        return free > (self.reserve if level > 0 else 0)
+
+    def retry_after(self) -> int:
+        """Seconds until a slot is likely free for a new arrival."""
+        return max(1, math.ceil(self.mean_hold * (len(self._waiters) + 1) / max(1, self.limit)))
+
+    def _reject(self, reason: str, status_code: int, detail: str) -> Overloaded:
+        self.rejected[reason] += 1
+        ADMISSION_REJECTED.labels(self.name, reason).inc()
+        logger.warning(f"{self.name}: shedding request ({reason}), {self.in_use} running, {len(self._waiters)} waiting")
+        return Overloaded(status_code, detail, self.retry_after())
+
+    def terms(self, priority: str, shed: bool = False) -> AdmissionTerms:
+        return AdmissionTerms(self, priority, shed)
+
+    async def acquire(self, priority: str, shed: bool = False) -> None:
+        await self._acquire(self.terms(priority, shed))
+
+    async def _acquire(self, terms: AdmissionTerms) -> None:
+        # Only a caller more urgent than everyone waiting may skip the queue.
+        if self._fits(terms.level) and (not self._waiters or terms.level < self._waiters[0][0]):
+            self._take()
+            return
+        if terms.shed and self.max_queue is not None and self._sheddable_waiting >= self.max_queue:
+            raise self._reject("queue_full", 429, "Server busy, retry later")
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        entry = (terms.level, next(self._sequence), future)
+        heapq.heappush(self._waiters, entry)
+        self._entries[terms] = entry
+        ADMISSION_QUEUED.labels(self.name).inc()
+        terms.waiting = True
+        self._sheddable_waiting += terms.shed
+        deadline = loop.time() + self.queue_timeout if self.queue_timeout is not None else None
+        try:
+            while not future.done():
+                # Terms can change while waiting: a run that stops being sheddable waits on.
+                if terms.shed and deadline is not None and loop.time() >= deadline:
+                    self._abandon(terms, future)
+                    raise self._reject("timeout", 503, "Server overloaded, retry later")
+                timeout = deadline - loop.time() if terms.shed and deadline is not None else None
+                await asyncio.wait({future}, timeout=timeout)
+        except asyncio.CancelledError:
+            self._abandon(terms, future)
+            raise
+        finally:
+            ADMISSION_QUEUED.labels(self.name).dec()
+            self._sheddable_waiting -= terms.shed
+            terms.waiting = False
+            self._entries.pop(terms, None)
+
+    def _abandon(self, terms: AdmissionTerms, future: asyncio.Future) -> None:
+        if future.done() and not future.cancelled():
+            # Granted as we gave up: hand the slot on.
+            self.release()
+            return
+        entry = self._entries.get(terms)
+        if entry in self._waiters:
+            self._waiters.remove(entry)
+            heapq.heapify(self._waiters)
+
+    def _requeue(self, terms: AdmissionTerms) -> None:
+        """Move a waiter to its new priority, keeping its place among equals by arrival."""
+        entry = self._entries.get(terms)
+        if entry not in self._waiters:
+            return
+        self._waiters.remove(entry)
+        _, sequence, future = entry
+        self._entries[terms] = (terms.level, sequence, future)
+        self._waiters.append(self._entries[terms])
+        heapq.heapify(self._waiters)
+        self._grant()
+
+    def _take(self) -> None:
+        self.in_use += 1
+        ADMISSION_IN_USE.labels(self.name).inc()
+
+    def release(self) -> None:
+        self.in_use -= 1
+        ADMISSION_IN_USE.labels(self.name).dec()
+        self._grant()
+
+    def _grant(self) -> None:
+        while self._waiters and self._fits(self._waiters[0][0]):
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():
+                continue
+            self._take()
+            future.set_result(None)
+
+    def slot(self, priority: str, shed: bool = False):
+        return self._hold(self.terms(priority, shed))
+
+    @asynccontextmanager
+    async def _hold(self, terms: AdmissionTerms):
+        await self._acquire(terms)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.mean_hold = 0.8 * self.mean_hold + 0.2 * (time.monotonic() - started)
+            self.release()
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "limit": self.limit, "in_use": self.in_use, "waiting": len(self._waiters),
+            "mean_hold_s": round(self.mean_hold, 2), "rejected": dict(self.rejected),
+        }
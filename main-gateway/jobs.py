@@ -0,0 +1,233 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from common.concurrency import run_blocking
+from common.metrics import JOB_QUEUE_DEPTH
+
+logger = logging.getLogger("main-gateway.jobs")
+
+JOB_STORE_PATH = os.getenv("JOB_STORE_PATH", "/var/cache/khwarizmi/jobs.sqlite3")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# A job left "running" for longer than this (e.g. its worker died) is queued again on startup.
+JOB_STALE_SECONDS = float(os.getenv("JOB_STALE_SECONDS", "900"))
+
+# Lower value runs first.
+PRIORITIES = {"interactive": 0, "batch": 1}
+
+TERMINAL_STATUSES = ("succeeded", "failed", "cancelled")
+
+
+class JobStore:
+    """
+    SQLite record of every job, shared by all gateway workers on the host.
+
+    All methods are blocking; call them through run_blocking.
+    """
+
+    def __init__(self, path: str = JOB_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                tenant TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            )
+        """)
+        self._connect().execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def create(self, tenant: str, priority: str, request: Dict[str, Any]) -> str:
+        job_id = uuid.uuid4().hex
+        self._connect().execute(
+            "INSERT INTO jobs (id, tenant, priority, status, request, created_at) VALUES (?, ?, ?, 'queued', ?, ?)",
+            (job_id, tenant, priority, json.dumps(request), time.time()),
+        )
+        return job_id
+
+    def claim(self, job_id: str) -> bool:
+        """Atomically move a queued job to running; False if another worker got it first."""
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'running', started_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id),
+        )
+        return cursor.rowcount == 1
+
+    def finish(self, job_id: str, status: str, result: Optional[Dict[str, Any]] = None,
+               error: Optional[str] = None) -> None:
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, json.dumps(result) if result is not None else None, error, time.time(), job_id),
+        )
+
+    def requeue(self, job_id: str) -> None:
+        self._connect().execute(
+            "UPDATE jobs SET status = 'queued', started_at = NULL WHERE id = ? AND status = 'running'", (job_id,)
+        )
+
+    def cancel(self, job_id: str) -> bool:
+        cursor = self._connect().execute(
+            "UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'",
+            (time.time(), job_id),
+        )
+        return cursor.rowcount == 1
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["request"] = json.loads(job["request"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    def recoverable(self) -> List[Dict[str, Any]]:
+        """Queued jobs plus running jobs whose worker has gone silent, oldest first."""
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET status = 'queued', started_at = NULL WHERE status = 'running' AND started_at < ?",
+            (time.time() - JOB_STALE_SECONDS,),
+        )
+        rows = conn.execute(
+            "SELECT id, tenant, priority FROM jobs WHERE status = 'queued' ORDER BY created_at"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+
+class FairQueue:
+    """
+    Priority queue with round-robin fairness between tenants.
+
+    The next job always comes from the most urgent priority that has work; within
+    that priority, tenants take turns so one tenant's burst cannot starve others.
+    """
+
+    def __init__(self):
+        self._lanes: Dict[int, "OrderedDict[str, Deque[str]]"] = {}
+        self._size = 0
+        self._available = asyncio.Condition()
+        self._names = {value: name for name, value in PRIORITIES.items()}
+
+    def __len__(self) -> int:
+        return self._size
+
+    def depth(self) -> Dict[str, int]:
+        names = {value: name for name, value in PRIORITIES.items()}
+        return {
+            names.get(level, str(level)): sum(len(q) for q in tenants.values())
+            for level, tenants in self._lanes.items()
+        }
+
+    async def put(self, job_id: str, tenant: str, priority: str) -> None:
+        level = PRIORITIES.get(priority, max(PRIORITIES.values()))
+        tenants = self._lanes.setdefault(level, OrderedDict())
+        tenants.setdefault(tenant, deque()).append(job_id)
+        self._size += 1
+        JOB_QUEUE_DEPTH.labels(self._names[level]).inc()
+        async with self._available:
+            self._available.notify()
+
+    async def get(self) -> str:
+        async with self._available:
+            await self._available.wait_for(lambda: self._size > 0)
+            for level in sorted(self._lanes):
+                tenants = self._lanes[level]
+                if not tenants:
+                    continue
+                tenant, queue = next(iter(tenants.items()))
+                job_id = queue.popleft()
+                # Rotate the tenant to the back of its lane; drop it once empty.
+                del tenants[tenant]
+                if queue:
+                    tenants[tenant] = queue
+                self._size -= 1
+                JOB_QUEUE_DEPTH.labels(self._names[level]).dec()
+                return job_id
+            raise RuntimeError("FairQueue size out of sync with its lanes")
+
+
+class JobManager:
+    """Runs queued pipeline jobs on a fixed pool of asyncio workers."""
+
+    def __init__(self, store: JobStore, runner: Callable[[Dict[str, Any], str], Awaitable[Dict[str, Any]]],
+                 workers: int = JOB_WORKERS):
+        self.store = store
+        self.runner = runner
+        self.workers = workers
+        self.queue = FairQueue()
+        self._tasks: List[asyncio.Task] = []
+        self._interrupted: List[str] = []
+        self.running = 0
+
+    async def start(self) -> None:
+        for job in await run_blocking(self.store.recoverable):
+            await self.queue.put(job["id"], job["tenant"], job["priority"])
+        if len(self.queue):
+            logger.info("Re-queued %d unfinished jobs", len(self.queue))
+        self._tasks = [asyncio.create_task(self._work(i)) for i in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        # Leave jobs cut short by the shutdown for the next process to pick up.
+        for job_id in self._interrupted:
+            await run_blocking(self.store.requeue, job_id)
+        if self._interrupted:
+            logger.info("Re-queued %d interrupted jobs", len(self._interrupted))
+        self._interrupted.clear()
+
+    async def submit(self, request: Dict[str, Any], tenant: str, priority: str) -> str:
+        job_id = await run_blocking(self.store.create, tenant, priority, request)
+        await self.queue.put(job_id, tenant, priority)
+        logger.info("Queued job %s for tenant %s (%s)", job_id, tenant, priority)
+        return job_id
+
+    async def _work(self, worker_id: int) -> None:
+        while True:
+            job_id = await self.queue.get()
+            if not await run_blocking(self.store.claim, job_id):
+                continue  # cancelled, or picked up by another process
+            self.running += 1
+            try:
+                job = await run_blocking(self.store.get, job_id)
+                result = await self.runner(job["request"], job["priority"])
+                await run_blocking(self.store.finish, job_id, "succeeded", result)
+                logger.info("Job %s succeeded on worker %d", job_id, worker_id)
+            except asyncio.CancelledError:
+                # Shutting down: stop() requeues it once every worker has exited.
+                self._interrupted.append(job_id)
+                raise
+            except Exception as e:
+                error = getattr(e, "detail", None) or str(e)
+                await run_blocking(self.store.finish, job_id, "failed", None, error)
+                logger.error("Job %s failed: %s", job_id, error)
+            finally:
+                self.running -= 1
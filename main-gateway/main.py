@@ -2,12 +2,34 @@ import logging
 import os
 import asyncio
 import aiohttp
+import itertools
+import json
+import time
+from contextlib import asynccontextmanager, nullcontext
+from contextvars import ContextVar
 from dotenv import load_dotenv
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+from common.concurrency import run_blocking
+from common.data_version import UNKNOWN_VERSION, DataVersion
+from common.llm import add_priority_middleware, request_priority
+from common.metrics import CACHE_REQUESTS, STAGE_SECONDS, STAGE_WAIT_SECONDS, add_metrics
+from common.readiness import Readiness, add_health_routes
+from common.singleflight import SingleFlight, make_key, normalize_text
+from common.resilience import (CircuitBreaker, CircuitOpen, DeadlineExceeded, LatencyWindow, add_deadline_middleware,
+                               check_deadline, deadline_headers, hedged, remaining, request_deadline, set_deadline)
+from common.tracing import add_tracing, inject_headers, span
+from admission import (ADMISSION_INTERACTIVE_RESERVE, ADMISSION_MAX_IN_FLIGHT, ADMISSION_MAX_QUEUE,
+                       ADMISSION_QUEUE_TIMEOUT, AdmissionTerms, PriorityLimiter)
+from report_cache import ReportCache
+from speculation import SPECULATIVE_SQL, SpeculationStats, intents_equivalent, similarity
+from jobs import JobManager, JobStore, PRIORITIES, TERMINAL_STATUSES
+from saved_reports import ReportScheduler, SavedReportStore
+
 # Load environment variables
 load_dotenv()
 
@@ -23,7 +45,61 @@ logging.basicConfig(
 logger = logging.getLogger("main-gateway")
 
 
-app = FastAPI(title="Report Generation Pipeline API")
+# One pooled HTTP session per worker, shared by every pipeline run.
+http_session: Optional[aiohttp.ClientSession] = None
+
+readiness = Readiness("main-gateway")
+
+# Identical intents arriving while a run is in flight share that run. A run whose callers
+# have all gone (e.g. a disconnected batch) is cancelled rather than left spending LLM budget.
+pipeline_flight = SingleFlight("pipeline", cancel_abandoned=True)
+# One refresh per saved report at a time, whether scheduled or requested.
+saved_report_flight = SingleFlight("saved-report")
+speculation_stats = SpeculationStats()
+
+POSTGRES_URI = os.getenv("POSTGRES_URI", "postgresql://postgres:postgres@db:5432/northwind")
+REPORT_CACHE_ENABLED = os.getenv("REPORT_CACHE_ENABLED", "true").strip().lower() in ("1", "true", "yes")
+# Successful runs feed their (reformulated intent, SQL) pair to intent-to-query's example store.
+SEED_SQL_EXAMPLES = os.getenv("SEED_SQL_EXAMPLES", "true").strip().lower() in ("1", "true", "yes")
+
+data_version = DataVersion(POSTGRES_URI)
+report_cache: Optional[ReportCache] = None
+job_manager: Optional[JobManager] = None
+saved_reports: Optional[SavedReportStore] = None
+report_scheduler: Optional[ReportScheduler] = None
+
+# Keeps references to background refreshes and example seeding so they are not garbage collected.
+background_tasks: set = set()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global http_session, report_cache, job_manager, saved_reports, report_scheduler
+    http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=100, keepalive_timeout=60))
+    if REPORT_CACHE_ENABLED:
+        report_cache = ReportCache()
+        data_version.subscribe(report_cache.on_data_version_change)
+        removed = await run_blocking(report_cache.evict_expired)
+        logger.info(f"Report cache ready at {report_cache.path} ({removed} expired entries removed)")
+    job_manager = JobManager(JobStore(), run_job)
+    await job_manager.start()
+    saved_reports = SavedReportStore()
+    report_scheduler = ReportScheduler(saved_reports, scheduled_refresh)
+    report_scheduler.start()
+    readiness.start()
+    yield
+    await readiness.stop()
+    await report_scheduler.stop()
+    await job_manager.stop()
+    await http_session.close()
+
+
+app = FastAPI(title="Report Generation Pipeline API", lifespan=lifespan)
+add_health_routes(app, readiness)
+add_priority_middleware(app)
+add_tracing(app, "main-gateway")
+add_metrics(app)
+add_deadline_middleware(app)
 
 app.add_middleware(
     CORSMiddleware,
@@ -43,104 +119,323 @@ class PipelineResponse(BaseModel):
     sql_query: str
     plots: List[str]
     html_report: str
+    stage_models: Dict[str, str] = {}  # model that served each stage, e.g. {"sql": "gpt-4o"}
+    chart_specs: List[Dict[str, Any]] = []  # specs of the rendered charts, replayed by saved report refreshes
+    data_summary: Optional[str] = None  # summary the report was written from
+
+class JobRequest(BaseModel):
+    intent: str
+    model: str = "gpt-4o-mini"
+    tenant: str = "default"
+    priority: str = "interactive"  # or "batch"
+
+class JobStatus(BaseModel):
+    id: str
+    status: str  # queued, running, succeeded, failed, cancelled
+    tenant: str
+    priority: str
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[Dict[str, Any]] = None
+
+class SavedReportRequest(BaseModel):
+    name: str
+    intent: str
+    model: str = "gpt-4o-mini"
+    refresh_interval: Optional[float] = None  # seconds between scheduled refreshes; None: refresh by hand only
+
+class CacheInvalidationRequest(BaseModel):
+    intent: Optional[str] = None  # None drops every cached report
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None  # defaults to the item's position in the batch
+    intent: str
+    model: str = "gpt-4o-mini"
+
+class BatchPipelineRequest(BaseModel):
+    items: List[BatchItem]
+    concurrency: Optional[int] = None  # pipelines running at once, capped by BATCH_MAX_CONCURRENCY
+    stage_limits: Optional[Dict[str, int]] = None  # e.g. {"sql": 2}; falls back to BATCH_STAGE_LIMITS
+
+PIPELINE_STAGES = ("reformulate", "sql", "plots", "report")
+
+def parse_stage_limits(value: str) -> Dict[str, int]:
+    """Parse "reformulate=8,sql=4" into {"reformulate": 8, "sql": 4}."""
+    limits = {}
+    for part in filter(None, (p.strip() for p in value.split(","))):
+        stage, _, limit = part.partition("=")
+        if stage.strip() not in PIPELINE_STAGES:
+            raise ValueError(f"Unknown pipeline stage '{stage}'")
+        limits[stage.strip()] = int(limit)
+    return limits
+
+BATCH_MAX_CONCURRENCY = int(os.getenv("BATCH_MAX_CONCURRENCY", "8"))
+BATCH_STAGE_LIMITS = parse_stage_limits(os.getenv("BATCH_STAGE_LIMITS", "reformulate=8,sql=4,plots=4,report=4"))
+
+# Admission control, per worker: whole pipeline runs, then calls into each downstream stage.
+# Both serve interactive callers before batch ones; only /pipeline/ requests are ever shed.
+pipeline_admission = PriorityLimiter(
+    "pipeline", ADMISSION_MAX_IN_FLIGHT, max_queue=ADMISSION_MAX_QUEUE,
+    queue_timeout=ADMISSION_QUEUE_TIMEOUT, reserve=ADMISSION_INTERACTIVE_RESERVE,
+)
+STAGE_LIMITS = parse_stage_limits(os.getenv("STAGE_LIMITS", "reformulate=16,sql=8,plots=8,report=8"))
+stage_admission = {stage: PriorityLimiter(f"stage:{stage}", max(1, limit)) for stage, limit in STAGE_LIMITS.items()}
+# Admission terms of each single-flight run waiting for (or holding) a pipeline slot, by (flight, key).
+flight_terms: Dict[Tuple[str, str], AdmissionTerms] = {}
+# Terms of the single-flight run executing in this context; callers joining it can promote it.
+run_terms: ContextVar[Optional[AdmissionTerms]] = ContextVar("run_terms", default=None)
+
+def pipeline_priority() -> str:
+    """Priority of the current pipeline run: the most urgent of the callers sharing it."""
+    terms = run_terms.get()
+    return terms.priority if terms is not None else request_priority.get()
+
+# Service locations; the defaults are the docker-compose container names.
+# A comma-separated list names several replicas of the same service.
+REFORMULATE_URL = os.getenv("REFORMULATE_URL", "http://reformulate-intent:8071")
+INTENT_TO_QUERY_URL = os.getenv("INTENT_TO_QUERY_URL", "http://intent-to-query:8070")
+API_TO_REPORT_URL = os.getenv("API_TO_REPORT_URL", "http://report-generation:8073")
+QUERY_TO_PLOTS_URL = os.getenv("QUERY_TO_PLOTS_URL", "http://query-to-plots:8072")
+
+# End-to-end budget for one pipeline run; each service gets the remainder and aborts when it passes.
+PIPELINE_DEADLINE = float(os.getenv("PIPELINE_DEADLINE", "300"))
+# Idempotent stages whose slow calls are duplicated on a second replica, e.g. "reformulate,sql".
+HEDGED_STAGES = {s.strip() for s in os.getenv("HEDGED_STAGES", "").split(",") if s.strip()}
+# A hedge starts once a call outlives the stage's recent p95 latency, but never sooner than this.
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "2"))
+
+class ServiceReplicas:
+    """Replicas of one downstream service, tried in rotation, each behind its own circuit breaker."""
+
+    def __init__(self, stage: str, urls: str):
+        self.stage = stage
+        self.urls = [url.strip().rstrip("/") for url in urls.split(",") if url.strip()]
+        self.breakers = {url: CircuitBreaker(f"{stage}@{url}") for url in self.urls}
+        self.latency = LatencyWindow()
+        self._next = itertools.count()
+
+    @property
+    def primary(self) -> str:
+        return self.urls[0]
+
+    def rotation(self) -> List[str]:
+        start = next(self._next) % len(self.urls)
+        return self.urls[start:] + self.urls[:start]
+
+    def stats(self) -> Dict[str, Any]:
+        return {url: breaker.stats() for url, breaker in self.breakers.items()}
+
+services = {
+    "reformulate": ServiceReplicas("reformulate", REFORMULATE_URL),
+    "sql": ServiceReplicas("sql", INTENT_TO_QUERY_URL),
+    "plots": ServiceReplicas("plots", QUERY_TO_PLOTS_URL),
+    "report": ServiceReplicas("report", API_TO_REPORT_URL),
+}
 
 class ReportPipelineOrchestrator:
-    def __init__(self):
-        self.reformulate_url = "http://reformulate-intent:8071"
-        self.intent_to_query_url = "http://intent-to-query:8070"
-        self.api_to_report_url = "http://report-generation:8073"
-        self.query_to_plots_url = "http://query-to-plots:8072"
+    def __init__(self, session: aiohttp.ClientSession, stage_limits: Optional[Dict[str, asyncio.Semaphore]] = None):
+        self.session = session
+        self.stage_limits = stage_limits or {}
+        # Filled in from each service's response; services may route or escalate the requested model.
+        self.stage_models: Dict[str, str] = {}
+        self.data_summary: Optional[str] = None
+        self.report_reused = False
+
+    def _headers(self) -> Dict[str, str]:
+        # Agents schedule LLM calls in the caller's lane (interactive or batch), continue our
+        # trace and stop working once the pipeline's deadline has passed.
+        return deadline_headers(inject_headers({"X-Priority": pipeline_priority()}))
+
+    @asynccontextmanager
+    async def _stage(self, name: str):
+        """Span for one stage plus its concurrency limit, shared by every run that got the same limits.
+
+        The span is opened first so time spent waiting for a slot shows up in the trace.
+        """
+        with span(f"pipeline.{name}", **{"pipeline.stage": name}), STAGE_SECONDS.labels(name).time():
+            queued = time.perf_counter()
+            admission = stage_admission.get(name)
+            async with self.stage_limits.get(name) or nullcontext(), \
+                    admission.slot(pipeline_priority()) if admission else nullcontext():
+                STAGE_WAIT_SECONDS.labels(name).observe(time.perf_counter() - queued)
+                yield
+
+    async def _post(self, stage: str, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        POST to the stage's service within the pipeline deadline. Replicas with an open
+        circuit are skipped; hedged stages duplicate a slow call on the next replica.
+        Failures raise HTTPException: 503 (no replica available), 504 (deadline), 502 (other).
+        """
+        replicas = services[stage]
+        try:
+            check_deadline(f"the {stage} stage")
+            rotation = replicas.rotation()
+            if stage in HEDGED_STAGES and len(rotation) > 1:
+                delay = max(HEDGE_MIN_DELAY, replicas.latency.quantile(0.95, default=HEDGE_MIN_DELAY))
+                return await hedged(
+                    [lambda url=url: self._post_once(replicas, url, path, payload) for url in rotation], delay
+                )
+            for url in rotation:
+                if replicas.breakers[url].allow():
+                    return await self._post_once(replicas, url, path, payload, checked=True)
+            raise CircuitOpen(f"{stage} service unavailable (circuit open)")
+        except HTTPException:
+            raise
+        except CircuitOpen as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except (DeadlineExceeded, asyncio.TimeoutError):
+            raise HTTPException(status_code=504, detail=f"{stage} stage exceeded the pipeline deadline")
+        except aiohttp.ClientError as e:
+            raise HTTPException(status_code=502, detail=f"{stage} service unreachable: {e}")
+
+    async def _post_once(self, replicas: ServiceReplicas, url: str, path: str, payload: Dict[str, Any],
+                         checked: bool = False) -> Dict[str, Any]:
+        breaker = replicas.breakers[url]
+        if not checked and not breaker.allow():
+            raise CircuitOpen(f"{replicas.stage} service unavailable (circuit open)")
+        started = time.perf_counter()
+        timeout = aiohttp.ClientTimeout(total=remaining())
+        try:
+            async with self.session.post(f"{url}{path}", json=payload, headers=self._headers(), timeout=timeout) as response:
+                if response.status < 400:
+                    result = await response.json()
+                    breaker.record_success()
+                    replicas.latency.add(time.perf_counter() - started)
+                    return result
+                detail = (await response.text())[:500]
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release_probe()
+            raise
+        if response.status == 504:
+            # The deadline we sent ran out; that says nothing about the service's health.
+            breaker.release_probe()
+            raise DeadlineExceeded(detail)
+        if response.status >= 500:
+            breaker.record_failure()
+            raise HTTPException(status_code=502, detail=f"{replicas.stage} service error {response.status}: {detail}")
+        breaker.record_success()
+        raise HTTPException(status_code=response.status, detail=f"{replicas.stage} service rejected the request: {detail}")
 
     async def reformulate_intent(self, original_intent: str, model: str) -> str:
         logger.info("Reformulating intent...")
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "intent": original_intent,
-                "model": model
-            }
-            try:
-                async with session.post(f"{self.reformulate_url}/reformulate", json=payload) as response:
-                    result = await response.json()
-                    reformulated = result.get("reformulated_intent", original_intent)
-                    logger.info(f"Reformulated: {reformulated}")
-                    return reformulated
-            except Exception as e:
-                logger.error(f"Error during intent reformulation: {e}")
-                return original_intent
+        payload = {
+            "intent": original_intent,
+            "model": model
+        }
+        try:
+            async with self._stage("reformulate"):
+                result = await self._post("reformulate", "/reformulate", payload)
+        except HTTPException as e:
+            if e.status_code == 504:
+                raise
+            # The original intent still works, just less precisely.
+            logger.error(f"Error during intent reformulation: {e.detail}")
+            return original_intent
+        reformulated = result.get("reformulated_intent", original_intent)
+        if result.get("model"):
+            self.stage_models["reformulate"] = result["model"]
+        logger.info(f"Reformulated: {reformulated}")
+        return reformulated
 
-    async def generate_sql_query(self, intent: str) -> Optional[str]:
+    async def generate_sql_query(self, intent: str, model: Optional[str] = None) -> Optional[str]:
         logger.info("Generating SQL query...")
-        async with aiohttp.ClientSession() as session:
-            payload = {"question": intent}
-            try:
-                async with session.post(f"{self.intent_to_query_url}/ask", json=payload) as response:
-                    result = await response.json()
-                    sql = result.get("sql_query")
-                    logger.info(f"SQL Query: {sql}")
-                    return sql
-            except Exception as e:
-                logger.error(f"Error generating SQL: {e}")
-                return None
+        payload = {"question": intent, "model": model}
+        async with self._stage("sql"):
+            result = await self._post("sql", "/ask", payload)
+        sql = result.get("sql_query")
+        if result.get("model"):
+            self.stage_models["sql"] = result["model"]
+        logger.info(f"SQL Query: {sql}")
+        return sql
+
+    async def record_example(self, question: str, sql_query: str) -> None:
+        """Send a question/SQL pair from a successful run to the few-shot example store."""
+        payload = {"question": question, "sql_query": sql_query}
+        try:
+            async with self.session.post(f"{services['sql'].primary}/examples", json=payload, headers=self._headers()) as response:
+                if response.status != 200:
+                    logger.warning(f"Example not stored ({response.status}): {await response.text()}")
+        except Exception as e:
+            logger.warning(f"Error storing SQL example: {e}")
 
-    async def generate_plots(self, sql_query: str, intent: str) -> Optional[Dict[str, Any]]:
+    async def generate_plots(self, sql_query: str, intent: str, model: Optional[str] = None,
+                             chart_specs: Optional[List[Dict[str, Any]]] = None) -> Dict[str, Any]:
         logger.info("Generating plots...")
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "sql_query": sql_query,
-                "intent": intent,
-                "model": "gpt-4o-mini"
-            }
-            try:
-                async with session.post(f"{self.query_to_plots_url}/visualize", json=payload) as response:
-                    result = await response.json()
-                    logger.info(f"Plot generation status: {result.get('status')}")
-                    return {
-                        "status": result.get("status"),
-                        "html_plots": result.get("html_plots", []),
-                        "image_urls": result.get("image_urls"),
-                        "error_message": result.get("error_message")
-                    }
-            except Exception as e:
-                logger.error(f"Error generating plots: {e}")
-                return {
-                    "status": "error",
-                    "html_plots": [],
-                    "image_urls": None,
-                    "error_message": str(e)
-                }
-
-    async def generate_report(self, original_intent: str, reformulated_intent: str, sql_query: str, plots: List[str], image_urls: List[str]) -> Optional[str]:
+        payload = {
+            "sql_query": sql_query,
+            "intent": intent,
+            "model": model,
+            "chart_specs": chart_specs
+        }
+        async with self._stage("plots"):
+            result = await self._post("plots", "/visualize", payload)
+        logger.info(f"Plot generation status: {result.get('status')}")
+        if result.get("model"):
+            self.stage_models["plots"] = result["model"]
+        return {
+            "status": result.get("status"),
+            "html_plots": result.get("html_plots", []),
+            "image_urls": result.get("image_urls"),
+            "chart_specs": result.get("chart_specs") or [],
+            "error_message": result.get("error_message")
+        }
+
+    async def generate_report(self, original_intent: str, reformulated_intent: str, sql_query: str, plots: List[str], image_urls: List[str], model: Optional[str] = None,
+                              previous_data_summary: Optional[str] = None) -> Optional[str]:
+        """The report HTML; empty when ``previous_data_summary`` still describes the data (see report_reused)."""
         logger.info("Generating final report...")
-        async with aiohttp.ClientSession() as session:
-            payload = {
-                "original_query": original_intent,
-                "reformulated_query": reformulated_intent,
-                "sql_query": sql_query,
-                "plots": plots,
-                "image_urls": image_urls,                
-            }
-            try:
-                async with session.post(f"{self.api_to_report_url}/generate-report", json=payload) as response:
-                    result = await response.json()
-                    logger.info("Report successfully generated.")
-                    return result.get("html_report")
-            except Exception as e:
-                logger.error(f"Error generating report: {e}")
-                return None
+        payload = {
+            "original_query": original_intent,
+            "reformulated_query": reformulated_intent,
+            "sql_query": sql_query,
+            "plots": plots,
+            "image_urls": image_urls,
+            "model": model,
+            "previous_data_summary": previous_data_summary,
+        }
+        async with self._stage("report"):
+            result = await self._post("report", "/generate-report", payload)
+        self.data_summary = result.get("data_summary")
+        self.report_reused = bool(result.get("reused"))
+        if self.report_reused:
+            logger.info("Data summary unchanged; previous report kept.")
+            return result.get("html_report")
+        logger.info("Report successfully generated.")
+        if result.get("model"):
+            self.stage_models["report"] = result["model"]
+        return result.get("html_report")
 
-@app.post("/pipeline/", response_model=PipelineResponse)
-async def run_pipeline(request: PipelineRequest):
-    logger.info(f"Pipeline triggered with intent: {request.intent}")
-    orchestrator = ReportPipelineOrchestrator()
+async def execute_pipeline(request: PipelineRequest,
+                           stage_limits: Optional[Dict[str, asyncio.Semaphore]] = None) -> PipelineResponse:
+    """Run the four pipeline stages for one request, within PIPELINE_DEADLINE."""
+    token = set_deadline(PIPELINE_DEADLINE)
+    try:
+        with span("pipeline", **{"pipeline.model": request.model, "pipeline.priority": pipeline_priority()}) as current:
+            response = await run_pipeline_stages(request, stage_limits)
+            current.set_attributes({f"pipeline.model.{stage}": model for stage, model in response.stage_models.items()})
+            return response
+    finally:
+        request_deadline.reset(token)
 
-    reformulated_intent = await orchestrator.reformulate_intent(request.intent, request.model)
-    
-    sql_query = await orchestrator.generate_sql_query(reformulated_intent)
+async def run_pipeline_stages(request: PipelineRequest,
+                              stage_limits: Optional[Dict[str, asyncio.Semaphore]]) -> PipelineResponse:
+    orchestrator = ReportPipelineOrchestrator(http_session, stage_limits)
+
+    if SPECULATIVE_SQL:
+        reformulated_intent, sql_query = await reformulate_with_speculative_sql(orchestrator, request)
+    else:
+        reformulated_intent = await orchestrator.reformulate_intent(request.intent, request.model)
+        sql_query = await orchestrator.generate_sql_query(reformulated_intent, request.model)
     if not sql_query:
         logger.error("Failed to generate SQL query")
         raise HTTPException(status_code=500, detail="Failed to generate SQL query")
 
-    plot_response = await orchestrator.generate_plots(sql_query, reformulated_intent)
+    plot_response = await orchestrator.generate_plots(sql_query, reformulated_intent, request.model)
     if not plot_response or plot_response["status"] == "error":
         logger.error(f"Plot generation failed: {plot_response.get('error_message')}")
         raise HTTPException(status_code=500, detail="Failed to generate plots")
@@ -151,17 +446,389 @@ async def run_pipeline(request: PipelineRequest):
         sql_query,
         plot_response["html_plots"],
         plot_response["image_urls"],
+        request.model,
     )
     if not html_report:
         logger.error("Failed to generate report")
         raise HTTPException(status_code=500, detail="Failed to generate report")
 
     logger.info("Pipeline completed successfully.")
+    if SEED_SQL_EXAMPLES:
+        track_background(asyncio.create_task(orchestrator.record_example(reformulated_intent, sql_query)))
     return PipelineResponse(
         success=True,
         original_intent=request.intent,
         reformulated_intent=reformulated_intent,
         sql_query=sql_query,
         plots=plot_response["html_plots"],
-        html_report=html_report
+        html_report=html_report,
+        stage_models=orchestrator.stage_models,
+        chart_specs=plot_response["chart_specs"],
+        data_summary=orchestrator.data_summary
+    )
+
+async def reformulate_with_speculative_sql(orchestrator: ReportPipelineOrchestrator,
+                                          request: PipelineRequest) -> Tuple[str, Optional[str]]:
+    """Reformulate while SQL for the original intent is generated; keep that SQL if the intent barely changed."""
+    speculative = asyncio.create_task(orchestrator.generate_sql_query(request.intent, request.model))
+    try:
+        reformulated_intent = await orchestrator.reformulate_intent(request.intent, request.model)
+    except BaseException:
+        speculative.cancel()
+        raise
+
+    if intents_equivalent(request.intent, reformulated_intent):
+        try:
+            sql_query = await speculative
+        except HTTPException as e:
+            if e.status_code == 504:
+                raise
+            logger.warning(f"Speculative SQL failed: {e.detail}")
+            sql_query = None
+        if sql_query:
+            speculation_stats.record("hit")
+            logger.info(f"Using speculative SQL (similarity {similarity(request.intent, reformulated_intent):.2f})")
+            return reformulated_intent, sql_query
+        speculation_stats.record("failed")
+    else:
+        speculative.cancel()
+        # Retrieve the outcome so a speculative call that already failed is not reported as unhandled.
+        speculative.add_done_callback(lambda task: task.cancelled() or task.exception())
+        speculation_stats.record("miss")
+        logger.info("Reformulation changed the intent; discarding speculative SQL")
+    return reformulated_intent, await orchestrator.generate_sql_query(reformulated_intent, request.model)
+
+async def execute_and_cache(request: PipelineRequest, key: str, data_version_id: str,
+                            stage_limits: Optional[Dict[str, asyncio.Semaphore]] = None) -> PipelineResponse:
+    result = await execute_pipeline(request, stage_limits)
+    await run_blocking(
+        report_cache.put, key, normalize_text(request.intent), normalize_text(request.model),
+        data_version_id, result.model_dump(),
+    )
+    return result
+
+def track_background(task: asyncio.Task) -> None:
+    """Keep a reference to a fire-and-forget task and log its failure."""
+    background_tasks.add(task)
+
+    def done(task: asyncio.Task):
+        background_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background task failed: {task.exception()}")
+
+    task.add_done_callback(done)
+
+def refresh_in_background(request: PipelineRequest, key: str, data_version_id: str) -> None:
+    # Shares the single-flight key, so many stale hits trigger only one refresh.
+    track_background(asyncio.create_task(in_flight(
+        pipeline_flight, key, lambda: execute_and_cache(request, key, data_version_id), priority="batch"
+    )))
+
+async def in_flight(flight: SingleFlight, key: str, run, priority: Optional[str] = None, shed: bool = False):
+    """
+    ``flight.do(key, run)``, with the run started once a pipeline slot is free. With ``shed``
+    a saturated gateway raises 429/503 instead, but only while every caller sharing the run
+    accepts that: a caller that may not be shed joining the run keeps it waiting. An
+    interactive caller joining a batch run promotes it, both in the admission queue and
+    for the stages it has yet to call.
+    """
+    priority = priority or request_priority.get()
+    slot_key = (flight.name, key)
+    terms = flight_terms.get(slot_key)
+    if terms is not None and flight.running(key):
+        terms.join(priority, shed)
+    else:
+        terms = flight_terms[slot_key] = pipeline_admission.terms(priority, shed)
+
+    async def admitted_run():
+        run_terms.set(terms)
+        try:
+            async with terms.slot():
+                return await run()
+        finally:
+            if flight_terms.get(slot_key) is terms:
+                del flight_terms[slot_key]
+
+    try:
+        return await flight.do(key, admitted_run)
+    finally:
+        # Joined a run that finished before its terms were looked up: drop the unused ones.
+        if flight_terms.get(slot_key) is terms and not flight.running(key):
+            del flight_terms[slot_key]
+
+async def run_cached_pipeline(request: PipelineRequest,
+                              stage_limits: Optional[Dict[str, asyncio.Semaphore]] = None,
+                              shed: bool = False) -> Tuple[PipelineResponse, str]:
+    """Serve from the report cache (refreshing stale entries in the background) or run the pipeline.
+
+    Only runs that execute the pipeline go through admission control; cache hits and
+    single-flight followers never wait for a slot.
+    """
+    intent, model = normalize_text(request.intent), normalize_text(request.model)
+    if report_cache is None:
+        key = make_key(intent, model)
+        return await in_flight(
+            pipeline_flight, key, lambda: execute_pipeline(request, stage_limits), shed=shed
+        ), "BYPASS"
+
+    data_version_id = await run_blocking(data_version.get)
+    key = make_key(intent, model, data_version_id)
+
+    entry = await run_blocking(report_cache.get, key)
+    if entry is not None:
+        cached = PipelineResponse(**{**entry.payload, "original_intent": request.intent})
+        if entry.fresh:
+            CACHE_REQUESTS.labels("report", "hit").inc()
+            return cached, "HIT"
+        logger.info(f"Serving stale report ({entry.age:.0f}s old) while refreshing")
+        CACHE_REQUESTS.labels("report", "stale").inc()
+        refresh_in_background(request, key, data_version_id)
+        return cached, "STALE"
+
+    CACHE_REQUESTS.labels("report", "miss").inc()
+    result = await in_flight(
+        pipeline_flight, key, lambda: execute_and_cache(request, key, data_version_id, stage_limits), shed=shed
     )
+    return result, "MISS"
+
+@app.post("/pipeline/", response_model=PipelineResponse)
+async def run_pipeline(request: PipelineRequest, response: Response):
+    logger.info(f"Pipeline triggered with intent: {request.intent}")
+    result, cache_status = await run_cached_pipeline(request, shed=True)
+    response.headers["X-Cache"] = cache_status
+    return result
+
+@app.post("/pipeline/batch")
+async def run_pipeline_batch(request: BatchPipelineRequest):
+    """Run many intents with bounded concurrency and stream one JSON line per item as it completes."""
+    concurrency = max(1, min(request.concurrency or BATCH_MAX_CONCURRENCY, BATCH_MAX_CONCURRENCY))
+    overrides = request.stage_limits or {}
+    unknown = sorted(set(overrides) - set(PIPELINE_STAGES))
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown pipeline stages: {', '.join(unknown)}")
+    limits = {**BATCH_STAGE_LIMITS, **overrides}
+    stage_limits = {stage: asyncio.Semaphore(max(1, limit)) for stage, limit in limits.items()}
+    slots = asyncio.Semaphore(concurrency)
+    logger.info(f"Batch of {len(request.items)} intents, concurrency={concurrency}, stage limits={limits}")
+
+    async def run_item(index: int, item: BatchItem) -> Dict[str, Any]:
+        item_id = item.id if item.id is not None else str(index)
+        request_priority.set("batch")
+        async with slots:
+            try:
+                result, cache_status = await run_cached_pipeline(
+                    PipelineRequest(intent=item.intent, model=item.model), stage_limits
+                )
+                return {"id": item_id, "success": True, "cache": cache_status, "result": result.model_dump()}
+            except HTTPException as e:
+                return {"id": item_id, "success": False, "error": e.detail}
+            except Exception as e:
+                logger.exception(f"Batch item {item_id} failed")
+                return {"id": item_id, "success": False, "error": str(e)}
+
+    async def stream():
+        tasks = [asyncio.create_task(run_item(i, item)) for i, item in enumerate(request.items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield json.dumps(await next_done) + "\n"
+        finally:
+            # The client went away: stop the runs nobody will read.
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+async def run_job(request: Dict[str, Any], priority: str) -> Dict[str, Any]:
+    """Job runner: the same cached, single-flight pipeline as /pipeline/."""
+    request_priority.set(priority)
+    result, cache_status = await run_cached_pipeline(PipelineRequest(**request))
+    return {**result.model_dump(), "cache": cache_status}
+
+async def load_job(job_id: str) -> Dict[str, Any]:
+    job = await run_blocking(job_manager.store.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: JobRequest):
+    """Queue a pipeline run and return its job id immediately."""
+    if request.priority not in PRIORITIES:
+        raise HTTPException(status_code=400, detail=f"priority must be one of {', '.join(PRIORITIES)}")
+    job_id = await job_manager.submit(
+        {"intent": request.intent, "model": request.model}, request.tenant, request.priority
+    )
+    return {"job_id": job_id, "status": "queued"}
+
+@app.get("/jobs/{job_id}", response_model=JobStatus)
+async def get_job(job_id: str):
+    job = await load_job(job_id)
+    job.pop("request", None)
+    return JobStatus(**job)
+
+@app.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    await load_job(job_id)
+    if not await run_blocking(job_manager.store.cancel, job_id):
+        raise HTTPException(status_code=409, detail="Only queued jobs can be cancelled")
+    return {"job_id": job_id, "status": "cancelled"}
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str):
+    """Server-sent events with the job status on every change, ending with the final result."""
+    await load_job(job_id)
+
+    async def stream():
+        last_status = None
+        while True:
+            job = await run_blocking(job_manager.store.get, job_id)
+            if job["status"] != last_status:
+                last_status = job["status"]
+                job.pop("request", None)
+                yield f"event: {last_status}\ndata: {json.dumps(job)}\n\n"
+            if last_status in TERMINAL_STATUSES:
+                return
+            await asyncio.sleep(1)
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
+@app.get("/jobs")
+async def job_queue_stats():
+    return {"queued": job_manager.queue.depth(), "running": job_manager.running, "workers": job_manager.workers}
+
+async def refresh_saved_report(report_id: str) -> str:
+    """
+    Refresh a saved report without the LLM stages that produced its definition.
+
+    Nothing runs when the data version is unchanged. Otherwise the stored SQL is re-executed
+    and the stored chart specs re-rendered; the narrative is rewritten only when the data
+    summary moved (api-to-report decides). Returns the outcome recorded in the store.
+    """
+    report = await run_blocking(saved_reports.get, report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Saved report not found")
+    data_version_id = await run_blocking(data_version.get)
+    if data_version_id != UNKNOWN_VERSION and data_version_id == report["data_version"]:
+        await run_blocking(saved_reports.record_refresh, report_id, "unchanged", data_version_id)
+        return "unchanged"
+    return await rerun_saved_report(report, data_version_id)
+
+async def rerun_saved_report(report: Dict[str, Any], data_version_id: str) -> str:
+    token = set_deadline(PIPELINE_DEADLINE)
+    try:
+        with span("saved_report.refresh", **{"saved_report.id": report["id"]}):
+            orchestrator = ReportPipelineOrchestrator(http_session)
+            plot_response = await orchestrator.generate_plots(
+                report["sql_query"], report["reformulated_intent"], report["model"], report["chart_specs"] or None
+            )
+            if plot_response["status"] == "error":
+                logger.error(f"Plot generation failed: {plot_response.get('error_message')}")
+                raise HTTPException(status_code=500, detail="Failed to generate plots")
+            html_report = await orchestrator.generate_report(
+                report["intent"],
+                report["reformulated_intent"],
+                report["sql_query"],
+                plot_response["html_plots"],
+                plot_response["image_urls"],
+                report["model"],
+                report["data_summary"],
+            )
+    finally:
+        request_deadline.reset(token)
+
+    if orchestrator.report_reused:
+        # Keep the summary the narrative was written from, so small changes cannot add up unnoticed.
+        outcome, html_report, data_summary = "reused", report["html_report"], report["data_summary"]
+    elif html_report:
+        outcome, data_summary = "regenerated", orchestrator.data_summary
+    else:
+        raise HTTPException(status_code=500, detail="Failed to generate report")
+    artifacts = {
+        # A replay returns only the charts that rendered; keep the full stored set.
+        "chart_specs": report["chart_specs"] or plot_response["chart_specs"],
+        "plots": plot_response["html_plots"],
+        "html_report": html_report,
+        "data_summary": data_summary,
+    }
+    await run_blocking(saved_reports.record_refresh, report["id"], outcome, data_version_id, artifacts)
+    logger.info(f"Saved report {report['id']} refreshed ({outcome})")
+    return outcome
+
+async def scheduled_refresh(report_id: str) -> str:
+    request_priority.set("batch")
+    return await in_flight(saved_report_flight, report_id, lambda: refresh_saved_report(report_id))
+
+async def load_saved_report(report_id: str) -> Dict[str, Any]:
+    report = await run_blocking(saved_reports.get, report_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Saved report not found")
+    return report
+
+@app.post("/reports", status_code=201)
+async def create_saved_report(request: SavedReportRequest):
+    """Run the pipeline once and save its SQL, chart specs and report for later refreshes."""
+    if request.refresh_interval is not None and request.refresh_interval <= 0:
+        raise HTTPException(status_code=400, detail="refresh_interval must be positive")
+    data_version_id = await run_blocking(data_version.get)
+    result, _ = await run_cached_pipeline(PipelineRequest(intent=request.intent, model=request.model), shed=True)
+    report_id = await run_blocking(
+        saved_reports.create, request.name, request.intent, request.model,
+        {**result.model_dump(), "data_version": data_version_id}, request.refresh_interval,
+    )
+    logger.info(f"Saved report {report_id} ({request.name})")
+    return {"report_id": report_id}
+
+@app.get("/reports")
+async def list_saved_reports():
+    return await run_blocking(saved_reports.list)
+
+@app.get("/reports/{report_id}")
+async def get_saved_report(report_id: str):
+    return await load_saved_report(report_id)
+
+@app.post("/reports/{report_id}/refresh")
+async def refresh_saved_report_now(report_id: str):
+    """Refresh a saved report now, outside its schedule."""
+    outcome = await in_flight(saved_report_flight, report_id, lambda: refresh_saved_report(report_id), shed=True)
+    return {"report_id": report_id, "outcome": outcome}
+
+@app.delete("/reports/{report_id}")
+async def delete_saved_report(report_id: str):
+    if not await run_blocking(saved_reports.delete, report_id):
+        raise HTTPException(status_code=404, detail="Saved report not found")
+    return {"report_id": report_id, "deleted": True}
+
+@app.post("/cache/invalidate")
+async def invalidate_cache(request: CacheInvalidationRequest):
+    if report_cache is None:
+        return {"removed": 0}
+    intent = normalize_text(request.intent) if request.intent is not None else None
+    removed = await run_blocking(report_cache.invalidate, intent)
+    logger.info(f"Invalidated {removed} cached reports")
+    return {"removed": removed}
+
+@app.get("/admission/stats")
+async def admission_stats():
+    return {
+        "pipeline": pipeline_admission.stats(),
+        "stages": {stage: limiter.stats() for stage, limiter in stage_admission.items()},
+    }
+
+@app.get("/resilience/stats")
+async def resilience_stats():
+    return {
+        "deadline_s": PIPELINE_DEADLINE,
+        "hedged_stages": sorted(HEDGED_STAGES),
+        "circuits": {stage: replicas.stats() for stage, replicas in services.items()},
+    }
+
+@app.get("/speculation/stats")
+async def get_speculation_stats():
+    return speculation_stats.snapshot()
+
+@app.get("/cache/stats")
+async def cache_stats():
+    if report_cache is None:
+        return {"enabled": False}
+    stats = await run_blocking(report_cache.stats)
+    return {"enabled": True, **stats}
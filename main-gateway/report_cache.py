@@ -0,0 +1,111 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger("main-gateway.report-cache")
+
+REPORT_CACHE_PATH = os.getenv("REPORT_CACHE_PATH", "/var/cache/khwarizmi/report_cache.sqlite3")
+# Entries younger than the TTL are served as-is.
+REPORT_CACHE_TTL = float(os.getenv("REPORT_CACHE_TTL", "3600"))
+# Entries older than the TTL but within this window are served while a refresh runs.
+REPORT_CACHE_STALE_TTL = float(os.getenv("REPORT_CACHE_STALE_TTL", "86400"))
+
+
+class CacheEntry:
+    def __init__(self, payload: Dict[str, Any], created_at: float, ttl: float):
+        self.payload = payload
+        self.created_at = created_at
+        self.age = time.time() - created_at
+        self.fresh = self.age < ttl
+
+
+class ReportCache:
+    """
+    On-disk cache of full pipeline responses keyed by (intent, model, data version).
+
+    Backed by SQLite so entries survive restarts and are shared by all gateway workers
+    on the same host. All methods are blocking; call them through run_blocking.
+    """
+
+    def __init__(self, path: str = REPORT_CACHE_PATH, ttl: float = REPORT_CACHE_TTL,
+                 stale_ttl: float = REPORT_CACHE_STALE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS reports (
+                    key TEXT PRIMARY KEY,
+                    intent TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    data_version TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS reports_data_version ON reports (data_version)")
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        """Return a fresh or stale entry, or None when missing or past the stale window."""
+        row = self._connect().execute(
+            "SELECT payload, created_at FROM reports WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        entry = CacheEntry(json.loads(row[0]), row[1], self.ttl)
+        if entry.age >= self.ttl + self.stale_ttl:
+            return None
+        return entry
+
+    def put(self, key: str, intent: str, model: str, data_version: str, payload: Dict[str, Any]) -> None:
+        self._connect().execute(
+            "INSERT OR REPLACE INTO reports (key, intent, model, data_version, payload, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (key, intent, model, data_version, json.dumps(payload), time.time()),
+        )
+
+    def invalidate(self, intent: Optional[str] = None) -> int:
+        """Drop every entry, or only those for one normalized intent. Returns the count removed."""
+        conn = self._connect()
+        if intent is None:
+            cursor = conn.execute("DELETE FROM reports")
+        else:
+            cursor = conn.execute("DELETE FROM reports WHERE intent = ?", (intent,))
+        return cursor.rowcount
+
+    def on_data_version_change(self, old_version: Optional[str], new_version: str) -> None:
+        """DataVersion listener: entries computed on older data can never be hit again."""
+        removed = self._connect().execute(
+            "DELETE FROM reports WHERE data_version != ?", (new_version,)
+        ).rowcount
+        logger.info("Data changed, dropped %d cached reports", removed)
+
+    def evict_expired(self) -> int:
+        cutoff = time.time() - (self.ttl + self.stale_ttl)
+        return self._connect().execute("DELETE FROM reports WHERE created_at < ?", (cutoff,)).rowcount
+
+    def stats(self) -> Dict[str, Any]:
+        count, oldest = self._connect().execute("SELECT COUNT(*), MIN(created_at) FROM reports").fetchone()
+        return {
+            "entries": count,
+            "oldest_age_s": round(time.time() - oldest, 1) if oldest else None,
+            "ttl_s": self.ttl,
+            "stale_ttl_s": self.stale_ttl,
+        }
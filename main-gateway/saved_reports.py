@@ -0,0 +1,207 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from common.concurrency import run_blocking
+
+logger = logging.getLogger("main-gateway.saved_reports")
+
+SAVED_REPORTS_PATH = os.getenv("SAVED_REPORTS_PATH", "/var/cache/khwarizmi/saved_reports.sqlite3")
+# How often each gateway worker looks for saved reports that are due for a refresh.
+SAVED_REPORT_POLL_SECONDS = float(os.getenv("SAVED_REPORT_POLL_SECONDS", "30"))
+
+# Stored as JSON text.
+JSON_COLUMNS = ("chart_specs", "stage_models", "plots")
+
+
+class SavedReportStore:
+    """
+    SQLite record of saved report definitions and their latest artifacts, shared by all gateway workers.
+
+    A definition keeps what the LLM stages produced once (reformulated intent, SQL, chart specs)
+    so a refresh only has to rerun the SQL and the charts. All methods are blocking; call them
+    through run_blocking.
+    """
+
+    def __init__(self, path: str = SAVED_REPORTS_PATH):
+        self.path = path
+        self._local = threading.local()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._connect().execute("""
+            CREATE TABLE IF NOT EXISTS saved_reports (
+                id TEXT PRIMARY KEY,
+                name TEXT NOT NULL,
+                intent TEXT NOT NULL,
+                model TEXT NOT NULL,
+                reformulated_intent TEXT NOT NULL,
+                sql_query TEXT NOT NULL,
+                chart_specs TEXT NOT NULL,
+                stage_models TEXT NOT NULL,
+                plots TEXT NOT NULL,
+                html_report TEXT NOT NULL,
+                data_summary TEXT,
+                data_version TEXT,
+                refresh_interval REAL,
+                next_refresh_at REAL,
+                created_at REAL NOT NULL,
+                refreshed_at REAL NOT NULL,
+                last_outcome TEXT,
+                last_error TEXT,
+                refreshes INTEGER NOT NULL DEFAULT 0,
+                narratives INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._connect().execute(
+            "CREATE INDEX IF NOT EXISTS saved_reports_due ON saved_reports (next_refresh_at)"
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _decode(row: sqlite3.Row) -> Dict[str, Any]:
+        report = dict(row)
+        for column in JSON_COLUMNS:
+            if column in report:
+                report[column] = json.loads(report[column])
+        return report
+
+    def create(self, name: str, intent: str, model: str, artifacts: Dict[str, Any],
+               refresh_interval: Optional[float] = None) -> str:
+        """Save a definition from a pipeline run; ``artifacts`` holds the PipelineResponse fields."""
+        report_id = uuid.uuid4().hex
+        now = time.time()
+        self._connect().execute(
+            "INSERT INTO saved_reports (id, name, intent, model, reformulated_intent, sql_query, chart_specs,"
+            " stage_models, plots, html_report, data_summary, data_version, refresh_interval, next_refresh_at,"
+            " created_at, refreshed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                report_id, name, intent, model, artifacts["reformulated_intent"], artifacts["sql_query"],
+                json.dumps(artifacts.get("chart_specs") or []), json.dumps(artifacts.get("stage_models") or {}),
+                json.dumps(artifacts["plots"]), artifacts["html_report"], artifacts.get("data_summary"),
+                artifacts.get("data_version"), refresh_interval,
+                now + refresh_interval if refresh_interval else None, now, now,
+            ),
+        )
+        return report_id
+
+    def get(self, report_id: str) -> Optional[Dict[str, Any]]:
+        row = self._connect().execute("SELECT * FROM saved_reports WHERE id = ?", (report_id,)).fetchone()
+        return self._decode(row) if row is not None else None
+
+    def list(self) -> List[Dict[str, Any]]:
+        """Every definition without its rendered artifacts, most recently created first."""
+        rows = self._connect().execute(
+            "SELECT id, name, intent, model, sql_query, refresh_interval, next_refresh_at, created_at,"
+            " refreshed_at, last_outcome, last_error, refreshes, narratives"
+            " FROM saved_reports ORDER BY created_at DESC"
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def delete(self, report_id: str) -> bool:
+        cursor = self._connect().execute("DELETE FROM saved_reports WHERE id = ?", (report_id,))
+        return cursor.rowcount == 1
+
+    def due(self, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        rows = self._connect().execute(
+            "SELECT id, next_refresh_at FROM saved_reports WHERE next_refresh_at <= ? ORDER BY next_refresh_at",
+            (now or time.time(),),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def claim(self, report_id: str, due_at: float) -> bool:
+        """Push a due report's next refresh one interval ahead; False if another worker got it first."""
+        cursor = self._connect().execute(
+            "UPDATE saved_reports SET next_refresh_at = ? + refresh_interval"
+            " WHERE id = ? AND next_refresh_at = ?",
+            (time.time(), report_id, due_at),
+        )
+        return cursor.rowcount == 1
+
+    def record_refresh(self, report_id: str, outcome: str, data_version: str,
+                       artifacts: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Store a refresh outcome: "unchanged" (same data version, nothing ran), "reused" (charts
+        redrawn, narrative kept) or "regenerated" (new narrative). ``artifacts`` holds the new
+        chart_specs, plots, html_report and data_summary.
+        """
+        conn = self._connect()
+        if artifacts is None:
+            conn.execute(
+                "UPDATE saved_reports SET refreshed_at = ?, last_outcome = ?, last_error = NULL,"
+                " refreshes = refreshes + 1 WHERE id = ?",
+                (time.time(), outcome, report_id),
+            )
+            return
+        conn.execute(
+            "UPDATE saved_reports SET chart_specs = ?, plots = ?, html_report = ?, data_summary = ?,"
+            " data_version = ?, refreshed_at = ?, last_outcome = ?, last_error = NULL,"
+            " refreshes = refreshes + 1, narratives = narratives + ? WHERE id = ?",
+            (
+                json.dumps(artifacts["chart_specs"]), json.dumps(artifacts["plots"]), artifacts["html_report"],
+                artifacts.get("data_summary"), data_version, time.time(), outcome, int(outcome == "regenerated"),
+                report_id,
+            ),
+        )
+
+    def record_failure(self, report_id: str, error: str) -> None:
+        self._connect().execute(
+            "UPDATE saved_reports SET last_outcome = 'failed', last_error = ? WHERE id = ?", (error, report_id)
+        )
+
+
+class ReportScheduler:
+    """Polls the store and refreshes due saved reports one at a time on this worker."""
+
+    def __init__(self, store: SavedReportStore, refresh: Callable[[str], Awaitable[Any]],
+                 interval: float = SAVED_REPORT_POLL_SECONDS):
+        self.store = store
+        self.refresh = refresh
+        self.interval = interval
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_due()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Saved report scheduler pass failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_due(self) -> None:
+        for report in await run_blocking(self.store.due):
+            if not await run_blocking(self.store.claim, report["id"], report["next_refresh_at"]):
+                continue  # refreshed by another worker
+            try:
+                await self.refresh(report["id"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                error = getattr(e, "detail", None) or str(e)
+                await run_blocking(self.store.record_failure, report["id"], error)
+                logger.error("Scheduled refresh of saved report %s failed: %s", report["id"], error)
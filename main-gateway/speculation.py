@@ -0,0 +1,67 @@
+import logging
+import os
+import re
+import threading
+from typing import Dict, Set
+
+from common.metrics import SPECULATIVE_SQL_RUNS
+
+logger = logging.getLogger("main-gateway.speculation")
+
+# Generate SQL for the original intent while the intent is being reformulated.
+SPECULATIVE_SQL = os.getenv("SPECULATIVE_SQL", "false").strip().lower() in ("1", "true", "yes")
+# Reformulations at least this similar (Jaccard over content words) keep the speculative SQL.
+SPECULATIVE_SQL_MIN_SIMILARITY = float(os.getenv("SPECULATIVE_SQL_MIN_SIMILARITY", "0.6"))
+
+WORD = re.compile(r"[a-z0-9]+")
+STOPWORDS = {
+    "a", "an", "the", "of", "for", "in", "on", "by", "to", "and", "or", "with", "from", "per",
+    "me", "show", "give", "list", "what", "which", "is", "are", "was", "were", "each", "all",
+    "please", "display", "find", "get", "return", "their", "its", "that", "this", "total",
+}
+
+
+def content_words(text: str) -> Set[str]:
+    """Lowercase stems of the words that carry meaning ("Show the orders" -> {order})."""
+    words = (w for w in WORD.findall(text.lower().replace("_", " ")) if w not in STOPWORDS)
+    return {w[:-1] if len(w) > 3 and w.endswith("s") else w for w in words}
+
+
+def similarity(original: str, reformulated: str) -> float:
+    a, b = content_words(original), content_words(reformulated)
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def intents_equivalent(original: str, reformulated: str) -> bool:
+    """Cheap check that SQL written for ``original`` also answers ``reformulated``.
+
+    Numbers ("top 5", "2024") must match exactly; a limit or year that changed means
+    a different query however similar the wording.
+    """
+    if original.strip().lower() == reformulated.strip().lower():
+        return True
+    a, b = content_words(original), content_words(reformulated)
+    if {w for w in a if w.isdigit()} != {w for w in b if w.isdigit()}:
+        return False
+    return similarity(original, reformulated) >= SPECULATIVE_SQL_MIN_SIMILARITY
+
+
+class SpeculationStats:
+    """How often speculative SQL was used (hit), discarded (miss) or failed."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts: Dict[str, int] = {"hit": 0, "miss": 0, "failed": 0}
+
+    def record(self, outcome: str) -> None:
+        with self._lock:
+            self.counts[outcome] += 1
+        SPECULATIVE_SQL_RUNS.labels(outcome).inc()
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            counts = dict(self.counts)
+        total = sum(counts.values())
+        return {"enabled": SPECULATIVE_SQL, **counts, "hit_rate": round(counts["hit"] / total, 3) if total else 0.0}
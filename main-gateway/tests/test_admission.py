@@ -0,0 +1,112 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+pytest.importorskip("prometheus_client")
+pytest.importorskip("openai")
+
+from admission import Overloaded, PriorityLimiter
+
+
+async def started(coro):
+    """Start ``coro`` as a task and let it run until it blocks."""
+    task = asyncio.ensure_future(coro)
+    await asyncio.sleep(0.01)
+    return task
+
+
+def test_batch_cannot_take_the_interactive_reserve():
+    async def scenario():
+        limiter = PriorityLimiter("test", 2, reserve=1)
+        await limiter.acquire("batch")
+        batch = await started(limiter.acquire("batch"))
+        assert not batch.done()
+        await asyncio.wait_for(limiter.acquire("interactive", shed=True), 1)
+        assert limiter.in_use == 2
+        limiter.release()
+        limiter.release()
+        await asyncio.wait_for(batch, 1)
+
+    asyncio.run(scenario())
+
+
+def test_interactive_waiters_go_first():
+    async def scenario():
+        limiter = PriorityLimiter("test", 1)
+        await limiter.acquire("interactive")
+        order = []
+
+        async def wait(name, priority):
+            await limiter.acquire(priority)
+            order.append(name)
+            limiter.release()
+
+        batch = await started(wait("batch", "batch"))
+        interactive = await started(wait("interactive", "interactive"))
+        limiter.release()
+        await asyncio.gather(batch, interactive)
+        assert order == ["interactive", "batch"]
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_sheds_with_retry_after():
+    async def scenario():
+        limiter = PriorityLimiter("test", 1, max_queue=0)
+        await limiter.acquire("interactive")
+        with pytest.raises(Overloaded) as raised:
+            await limiter.acquire("interactive", shed=True)
+        assert raised.value.status_code == 429
+        assert int(raised.value.headers["Retry-After"]) >= 1
+        assert limiter.rejected["queue_full"] == 1
+
+    asyncio.run(scenario())
+
+
+def test_queue_timeout_sheds_only_sheddable_callers():
+    async def scenario():
+        limiter = PriorityLimiter("test", 1, queue_timeout=0.05)
+        await limiter.acquire("interactive")
+        with pytest.raises(Overloaded) as raised:
+            await limiter.acquire("interactive", shed=True)
+        assert raised.value.status_code == 503
+        assert int(raised.value.headers["Retry-After"]) >= 1
+        patient = await started(limiter.acquire("interactive"))
+        await asyncio.sleep(0.1)
+        assert not patient.done()
+        limiter.release()
+        await asyncio.wait_for(patient, 1)
+        assert limiter.stats()["waiting"] == 0
+
+    asyncio.run(scenario())
+
+
+def test_joining_caller_that_may_not_be_shed_keeps_the_run_queued():
+    async def scenario():
+        limiter = PriorityLimiter("test", 1, queue_timeout=0.05)
+        await limiter.acquire("interactive")
+        terms = limiter.terms("interactive", shed=True)
+        waiting = await started(limiter._acquire(terms))
+        terms.join("batch", shed=False)
+        await asyncio.sleep(0.1)
+        assert not waiting.done()
+        limiter.release()
+        await asyncio.wait_for(waiting, 1)
+
+    asyncio.run(scenario())
+
+
+def test_interactive_caller_promotes_a_waiting_batch_run():
+    async def scenario():
+        limiter = PriorityLimiter("test", 2, reserve=1)
+        await limiter.acquire("interactive")
+        terms = limiter.terms("batch")
+        waiting = await started(limiter._acquire(terms))
+        assert not waiting.done()
+        terms.join("interactive", shed=False)
+        await asyncio.wait_for(waiting, 1)
+        assert terms.priority == "interactive"
+        assert limiter.in_use == 2
+
+    asyncio.run(scenario())
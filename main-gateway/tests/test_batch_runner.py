@@ -0,0 +1,36 @@
+import json
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from batch_runner import load_completed_ids, load_items
+
+
+def test_resume_skips_truncated_and_failed_lines(tmp_path):
+    output = tmp_path / "results.jsonl"
+    output.write_text(
+        json.dumps({"id": 1, "success": True}) + "\n"
+        + json.dumps({"id": "2", "success": False, "error": "timeout"}) + "\n"
+        + json.dumps({"id": "3", "success": True}) + "\n"
+        + '{"id": "4", "success": tr',
+        encoding="utf-8",
+    )
+    assert load_completed_ids(str(output)) == {"1", "3"}
+
+
+def test_no_output_file_means_nothing_completed(tmp_path):
+    assert load_completed_ids(str(tmp_path / "missing.jsonl")) == set()
+
+
+def test_items_default_to_line_number_and_model(tmp_path):
+    intents = tmp_path / "intents.jsonl"
+    intents.write_text(
+        json.dumps({"intent": "sales by region"}) + "\n\n"
+        + json.dumps({"id": "churn", "intent": "monthly churn", "model": "gpt-4o"}) + "\n",
+        encoding="utf-8",
+    )
+    assert load_items(str(intents), "gpt-4o-mini") == [
+        {"id": "1", "intent": "sales by region", "model": "gpt-4o-mini"},
+        {"id": "churn", "intent": "monthly churn", "model": "gpt-4o"},
+    ]
@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+from jobs import FairQueue
+
+
+async def drain(queue: FairQueue):
+    return [await queue.get() for _ in range(len(queue))]
+
+
+def test_tenants_take_turns_within_a_priority():
+    async def scenario():
+        queue = FairQueue()
+        for job_id in ("a1", "a2", "a3"):
+            await queue.put(job_id, "tenant-a", "batch")
+        await queue.put("b1", "tenant-b", "batch")
+        await queue.put("c1", "tenant-c", "batch")
+        return await drain(queue)
+
+    assert asyncio.run(scenario()) == ["a1", "b1", "c1", "a2", "a3"]
+
+
+def test_interactive_jobs_run_before_batch_jobs():
+    async def scenario():
+        queue = FairQueue()
+        await queue.put("batch-1", "tenant-a", "batch")
+        await queue.put("interactive-1", "tenant-b", "interactive")
+        await queue.put("batch-2", "tenant-b", "batch")
+        await queue.put("interactive-2", "tenant-a", "interactive")
+        depth = queue.depth()
+        return depth, await drain(queue)
+
+    depth, order = asyncio.run(scenario())
+    assert depth == {"interactive": 2, "batch": 2}
+    assert order == ["interactive-1", "interactive-2", "batch-1", "batch-2"]
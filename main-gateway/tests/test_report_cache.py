@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import text
+
+from common import data_version
+from common.data_version import UNKNOWN_VERSION, DataVersion
+from report_cache import ReportCache
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ReportCache(str(tmp_path / "reports.sqlite3"), ttl=60, stale_ttl=60)
+
+
+def test_entries_are_fresh_then_stale_then_gone(cache, monkeypatch):
+    cache.put("key", "sales by region", "gpt-4o-mini", "v1", {"html_report": "<p>"})
+    entry = cache.get("key")
+    assert entry.fresh and entry.payload == {"html_report": "<p>"}
+
+    now = cache._connect().execute("SELECT created_at FROM reports").fetchone()[0]
+    monkeypatch.setattr("report_cache.time.time", lambda: now + 90)
+    entry = cache.get("key")
+    assert entry is not None and not entry.fresh
+
+    monkeypatch.setattr("report_cache.time.time", lambda: now + 130)
+    assert cache.get("key") is None
+    assert cache.evict_expired() == 1
+
+
+def test_invalidate_by_intent(cache):
+    cache.put("a", "sales", "gpt-4o-mini", "v1", {})
+    cache.put("b", "sales", "gpt-4o", "v1", {})
+    cache.put("c", "churn", "gpt-4o-mini", "v1", {})
+    assert cache.invalidate("sales") == 2
+    assert cache.stats()["entries"] == 1
+
+
+def test_data_change_drops_reports_on_older_data(cache, tmp_path, monkeypatch):
+    db_path = tmp_path / "data.db"
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("CREATE TABLE orders (id INTEGER)")
+    # Stand-in for the pg_stat_user_tables fingerprint: changes whenever a row is added.
+    monkeypatch.setattr(data_version, "DATA_VERSION_SQL", text("SELECT 'v' || COUNT(*) FROM orders"))
+    version = DataVersion(f"sqlite:///{db_path}", ttl=0)
+    version.subscribe(cache.on_data_version_change)
+
+    first = version.get()
+    cache.put("old", "sales", "gpt-4o-mini", first, {})
+    with sqlite3.connect(db_path) as conn:
+        conn.execute("INSERT INTO orders VALUES (1)")
+    second = version.get()
+    cache.put("new", "sales", "gpt-4o-mini", second, {})
+
+    assert first != second
+    assert cache.get("old") is None
+    assert cache.get("new") is not None
+
+
+def test_unreadable_version_is_unknown(tmp_path, monkeypatch):
+    monkeypatch.setattr(data_version, "DATA_VERSION_SQL", text("SELECT missing FROM nowhere"))
+    assert DataVersion(f"sqlite:///{tmp_path / 'empty.db'}").get() == UNKNOWN_VERSION
@@ -0,0 +1,25 @@
+import pytest
+
+pytest.importorskip("prometheus_client")
+
+from speculation import content_words, intents_equivalent, similarity
+
+
+def test_stopwords_and_plurals_are_ignored():
+    assert content_words("Show me the total sales for each country") == {"sale", "country"}
+    assert similarity("Show total sales by country", "List sales per country") == 1.0
+
+
+def test_rephrasing_keeps_the_speculative_sql():
+    assert intents_equivalent("top products", "Top Products ")
+    assert intents_equivalent("Show total sales by country", "Display the sales for each country")
+
+
+def test_changed_numbers_discard_it():
+    assert not intents_equivalent("top 5 customers by orders", "top 10 customers by orders")
+    assert not intents_equivalent("sales by month in 2023", "sales by month in 2024")
+    assert not intents_equivalent("sales by month", "sales by month in 2024")
+
+
+def test_different_questions_discard_it():
+    assert not intents_equivalent("sales by country", "average freight per shipper")
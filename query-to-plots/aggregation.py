@@ -0,0 +1,197 @@
+import datetime
+import os
+import re
+from typing import TYPE_CHECKING, Any, Dict, Optional
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Push histogram, box plot, heatmap and time-series aggregation into Postgres.
+CHART_SQL_AGGREGATION = os.getenv("CHART_SQL_AGGREGATION", "true").strip().lower() in ("1", "true", "yes")
+# Results with at most this many rows are charted from the raw rows, exactly as before.
+CHART_AGGREGATE_MIN_ROWS = int(os.getenv("CHART_AGGREGATE_MIN_ROWS", "5000"))
+# Bins per numeric histogram computed with width_bucket.
+CHART_HISTOGRAM_BINS = int(os.getenv("CHART_HISTOGRAM_BINS", "50"))
+# Time series are truncated (date_trunc) to the finest grain that gives at most this many points.
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "1000"))
+
+# date_trunc fields from finest to coarsest, with their approximate length in seconds.
+TIME_GRAINS = [
+    ("second", 1), ("minute", 60), ("hour", 3600), ("day", 86400), ("week", 604800),
+    ("month", 2629800), ("quarter", 7889400), ("year", 31557600),
+]
+
+
+# Column names of measures that must not be summed across rows (averages, prices, ratios...).
+NON_ADDITIVE = re.compile(
+    r"(^|[^a-z])(avg|average|mean|median|rate|ratio|pct|percent|percentage|share|price|score)s?([^a-z]|$)",
+    re.IGNORECASE,
+)
+
+
+class AggregatePlan:
+    """Wrapper query computing what a chart draws, and the utils function that draws it (None: the chart's own)."""
+
+    def __init__(self, sql: str, renderer: Optional[str] = None):
+        self.sql = sql
+        self.renderer = renderer
+
+
+def quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def base_query(sql: str) -> str:
+    """The user's query, usable as a subquery or CTE body."""
+    return sql.strip().rstrip(";").strip()
+
+
+def preview_sql(sql: str, rows: int = 5) -> str:
+    return f"SELECT * FROM ({base_query(sql)}) AS q LIMIT {int(rows)}"
+
+
+def count_sql(sql: str) -> str:
+    return f"SELECT count(*) AS row_count FROM ({base_query(sql)}) AS q"
+
+
+def column_kind(preview: "pd.DataFrame", column: str) -> str:
+    """Kind of ``column`` (numeric, date, datetime or other), judged from the preview rows."""
+    from pandas.api import types
+
+    series = preview[column]
+    if types.is_bool_dtype(series):
+        return "other"
+    if types.is_numeric_dtype(series):
+        return "numeric"
+    if types.is_datetime64_any_dtype(series):
+        return "datetime"
+    values = series.dropna()
+    if not values.empty and all(isinstance(v, datetime.date) for v in values):
+        # psycopg2 returns DATE columns as datetime.date objects (object dtype).
+        return "datetime" if all(isinstance(v, datetime.datetime) for v in values) else "date"
+    return "other"
+
+
+def histogram_sql(sql: str, x: str, x_kind: str, group_by: Optional[str]) -> str:
+    """Numeric x: width_bucket bins (midpoint, width, count); anything else: a count per value."""
+    groups = [quote(group_by)] if group_by else []
+    if x_kind != "numeric":
+        keys = ", ".join([quote(x), *groups])
+        return (
+            f"WITH q AS ({base_query(sql)})\n"
+            f"SELECT {keys}, count(*) AS _count FROM q WHERE {quote(x)} IS NOT NULL\n"
+            f"GROUP BY {keys} ORDER BY {keys}"
+        )
+    bins = CHART_HISTOGRAM_BINS
+    selected = "".join(f"q.{g}, " for g in groups)
+    grouped = "".join(f"k.{g}, " for g in groups)
+    return (
+        f"WITH q AS ({base_query(sql)}),\n"
+        f"b AS (SELECT min({quote(x)})::float8 AS lo, max({quote(x)})::float8 AS hi FROM q),\n"
+        # width_bucket puts the maximum in bucket bins + 1 and rejects lo = hi.
+        f"k AS (SELECT {selected}CASE WHEN b.hi > b.lo\n"
+        f"        THEN least(width_bucket(q.{quote(x)}::float8, b.lo, b.hi, {bins}), {bins}) ELSE 1 END AS bucket\n"
+        f"      FROM q, b WHERE q.{quote(x)} IS NOT NULL)\n"
+        f"SELECT {grouped}b.lo + (k.bucket - 0.5) * (b.hi - b.lo) / {bins} AS {quote(x)},\n"
+        f"       (b.hi - b.lo) / {bins} AS _bin_width, count(*) AS _count\n"
+        f"FROM k, b GROUP BY {grouped}k.bucket, b.lo, b.hi ORDER BY {grouped}k.bucket"
+    )
+
+
+def box_plot_sql(sql: str, y: str, x: Optional[str]) -> str:
+    """Quartiles per box with percentile_cont, and Tukey whiskers (furthest values within 1.5 IQR)."""
+    yv = f"q.{quote(y)}::float8"
+    group_select = f"q.{quote(x)}, " if x else ""
+    group_by = f" GROUP BY q.{quote(x)}" if x else ""
+    match = f"q.{quote(x)} IS NOT DISTINCT FROM s.{quote(x)} AND " if x else ""
+    keys = f"s.{quote(x)}, " if x else ""
+    return (
+        f"WITH q AS ({base_query(sql)}),\n"
+        f"s AS (SELECT {group_select}percentile_cont(0.25) WITHIN GROUP (ORDER BY {yv}) AS _q1,\n"
+        f"             percentile_cont(0.5) WITHIN GROUP (ORDER BY {yv}) AS _median,\n"
+        f"             percentile_cont(0.75) WITHIN GROUP (ORDER BY {yv}) AS _q3\n"
+        f"      FROM q WHERE q.{quote(y)} IS NOT NULL{group_by})\n"
+        f"SELECT {keys}s._q1, s._median, s._q3, min({yv}) AS _lowerfence, max({yv}) AS _upperfence\n"
+        f"FROM s JOIN q ON {match}{yv} BETWEEN s._q1 - 1.5 * (s._q3 - s._q1) AND s._q3 + 1.5 * (s._q3 - s._q1)\n"
+        f"GROUP BY {keys}s._q1, s._median, s._q3" + (f" ORDER BY s.{quote(x)}" if x else "")
+    )
+
+
+def heatmap_sql(sql: str, x: str, y: str, z: str) -> str:
+    """
+    One row per cell holding avg(z). The raw chart pivots the rows and needs one per cell,
+    so a result it could draw passes through unchanged; a cell with several rows shows
+    their mean, which (unlike a sum) is right for prices and ratios and invents no totals.
+    """
+    return (
+        f"WITH q AS ({base_query(sql)})\n"
+        f"SELECT {quote(x)}, {quote(y)}, avg({quote(z)}) AS {quote(z)} FROM q\n"
+        f"GROUP BY {quote(x)}, {quote(y)}"
+    )
+
+
+def time_series_sql(sql: str, x: str, x_kind: str, y: str, group_by: Optional[str]) -> str:
+    """
+    y per date_trunc bucket of x; the grain is picked from the time span in the same statement.
+
+    Buckets hold sum(y) only when the rows repeat x (within a group), i.e. the query returned
+    individual events to be totalled. A series with one row per x was already aggregated by
+    the query, so, like measures named as averages, prices or ratios, its buckets hold avg(y).
+    """
+    xv = f"q.{quote(x)}::timestamp" if x_kind == "date" else f"q.{quote(x)}"
+    grain = "CASE " + " ".join(
+        f"WHEN span <= {CHART_MAX_POINTS * seconds} THEN '{field}'" for field, seconds in TIME_GRAINS[:-1]
+    ) + f" ELSE '{TIME_GRAINS[-1][0]}' END"
+    groups = f"q.{quote(group_by)}, " if group_by else ""
+    keys = "1, 2" if group_by else "1"
+    if NON_ADDITIVE.search(y):
+        repeated, value = "", f"avg(q.{quote(y)})"
+    else:
+        distinct = f"({quote(x)}, {quote(group_by)})" if group_by else quote(x)
+        repeated = f",\n             count({quote(x)}) > count(DISTINCT {distinct}) FILTER (WHERE {quote(x)} IS NOT NULL) AS repeated"
+        value = f"CASE WHEN bool_or(b.repeated) THEN sum(q.{quote(y)}) ELSE avg(q.{quote(y)}) END"
+    return (
+        f"WITH q AS ({base_query(sql)}),\n"
+        f"b AS (SELECT coalesce(extract(epoch FROM max({quote(x)})::timestamp - min({quote(x)})::timestamp), 0) AS span"
+        f"{repeated} FROM q),\n"
+        f"g AS (SELECT {grain} AS grain FROM b)\n"
+        f"SELECT date_trunc(g.grain, {xv}) AS {quote(x)}, {groups}{value} AS {quote(y)}\n"
+        f"FROM q, b, g WHERE q.{quote(x)} IS NOT NULL GROUP BY {keys} ORDER BY {keys}"
+    )
+
+
+def plan_chart(sql: str, chart_type: str, kwargs: Dict[str, Any], preview: "pd.DataFrame") -> Optional[AggregatePlan]:
+    """Aggregating query for a suggested chart, or None when the chart needs the raw rows."""
+    columns = set(preview.columns)
+
+    def usable(*names: Optional[str]) -> bool:
+        return all(isinstance(n, str) and n in columns for n in names if n is not None)
+
+    group_by = kwargs.get("group_by")
+    if chart_type == "histogram":
+        x = kwargs.get("x")
+        if x is None or not usable(x, group_by):
+            return None
+        return AggregatePlan(histogram_sql(sql, x, column_kind(preview, x), group_by), "histogram_binned")
+    if chart_type == "box_plot":
+        y, x = kwargs.get("y"), kwargs.get("x")
+        if y is None or not usable(y, x) or column_kind(preview, y) != "numeric":
+            return None
+        return AggregatePlan(box_plot_sql(sql, y, x), "box_plot_quartiles")
+    if chart_type == "heatmap":
+        x, y, z = kwargs.get("x"), kwargs.get("y"), kwargs.get("z")
+        if None in (x, y, z) or not usable(x, y, z) or column_kind(preview, z) != "numeric":
+            return None
+        return AggregatePlan(heatmap_sql(sql, x, y, z))
+    if chart_type in ("line_chart", "area_chart"):
+        x, y = kwargs.get("x"), kwargs.get("y")
+        # area_chart draws a single series, so only line charts keep their group_by column.
+        group_by = group_by if chart_type == "line_chart" else None
+        if None in (x, y) or not usable(x, y, group_by):
+            return None
+        x_kind = column_kind(preview, x)
+        if x_kind not in ("date", "datetime") or column_kind(preview, y) != "numeric":
+            return None
+        return AggregatePlan(time_series_sql(sql, x, x_kind, y, group_by))
+    return None
+
@@ -1,44 +1,86 @@
 from fastapi import FastAPI
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Tuple, Dict, Any, Callable, TYPE_CHECKING
+from contextlib import asynccontextmanager
+import asyncio
 import os
-import pandas as pd
-import plotly.io as pio
-from sqlalchemy import create_engine
 from dotenv import load_dotenv
-from openai import OpenAI
-from utils import bar_chart, line_chart, pie_chart, scatter_plot, histogram, box_plot, heatmap, treemap, area_chart, upload_image_to_minio
 import re
 import json
-import base64
-from io import BytesIO
 from fastapi.middleware.gzip import GZipMiddleware
 
+from common.concurrency import run_blocking
+from common.data_version import DataVersion
+from common.db import get_engine
+from common.llm import add_llm_stats_route, add_priority_middleware, get_llm_gateway, model_router
+from common.metrics import CHART_RENDER_SECONDS, add_metrics
+from common.readiness import Readiness, add_health_routes
+from common.resilience import add_deadline_middleware
+from common.singleflight import SingleFlight, make_key, normalize_text
+from common.tracing import add_tracing, span
+from aggregation import CHART_AGGREGATE_MIN_ROWS, CHART_SQL_AGGREGATION, AggregatePlan, plan_chart, preview_sql
+
+if TYPE_CHECKING:
+    import pandas as pd
+    from common.streaming import StreamResult
+
 
 # === Load environment variables ===
 load_dotenv()
 POSTGRES_URI = os.getenv("POSTGRES_URI", "postgresql://postgres:postgres@db:5432/northwind")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# === Initialize OpenAI client ===
-client = OpenAI(api_key=OPENAI_API_KEY)
+data_version = DataVersion(POSTGRES_URI)
+
+readiness = Readiness("query-to-plots")
+visualize_flight = SingleFlight("visualize")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    readiness.start()
+    yield
+    await readiness.stop()
+    await get_llm_gateway().aclose()
 
 # === Initialize FastAPI app ===
-app = FastAPI(title="Visualization Agent API")
+app = FastAPI(title="Visualization Agent API", lifespan=lifespan)
 app.add_middleware(GZipMiddleware, minimum_size=1000)  # Compress if response > 1KB
-
-# === Chart functions registry ===
-chart_map = {
-    "bar_chart": bar_chart,
-    "line_chart": line_chart,
-    "pie_chart": pie_chart,
-    "scatter_plot": scatter_plot,
-    "histogram": histogram,
-    "box_plot": box_plot,
-    "heatmap": heatmap,
-    "treemap": treemap,
-    "area_chart": area_chart
-}
+add_health_routes(app, readiness)
+add_priority_middleware(app)
+add_tracing(app, "query-to-plots")
+add_metrics(app)
+add_deadline_middleware(app)
+add_llm_stats_route(app)
+
+# === Chart functions registry (loaded by the renderer warm-up) ===
+CHART_TYPES = [
+    "bar_chart",
+    "line_chart",
+    "pie_chart",
+    "scatter_plot",
+    "histogram",
+    "box_plot",
+    "heatmap",
+    "treemap",
+    "area_chart"
+]
+# Draw histograms and box plots from bins and quartiles computed in SQL (see aggregation.py).
+AGGREGATE_RENDERERS = ["histogram_binned", "box_plot_quartiles"]
+
+def load_renderer() -> Dict[str, Callable]:
+    """Import pandas/Plotly/boto3 and render a tiny chart once so Kaleido is warm."""
+    import pandas as pd
+    import plotly.io as pio
+    import utils
+
+    chart_map = {name: getattr(utils, name) for name in CHART_TYPES + AGGREGATE_RENDERERS}
+
+    fig = chart_map["bar_chart"](pd.DataFrame({"x": ["a", "b"], "y": [1, 2]}), x="x", y="y", title="warm-up")
+    pio.to_html(fig, full_html=False)
+    fig.to_image(format="png", engine="kaleido")
+    return chart_map
+
+readiness.register("renderer", load_renderer)
 
 chart_descriptions = {
     "bar_chart": (
@@ -82,88 +124,87 @@ chart_descriptions = {
 class VisualizationRequest(BaseModel):
     sql_query: str
     intent: str
-    model: Optional[str] = "gpt-4o-mini"
+    model: Optional[str] = None  # routed to the stage default when omitted
+    chart_specs: Optional[List[Dict[str, Any]]] = None  # render these (e.g. a saved report's) instead of asking the LLM
 
 class VisualizationResponse(BaseModel):
     status: str  # "success", "error"
     html_plots: List[str]
     image_urls: Optional[List[str]] = None
     error_message: Optional[str] = None
+    model: Optional[str] = None  # model that chose the charts
+    chart_specs: Optional[List[Dict[str, Any]]] = None  # specs of the charts that rendered, in order
+
+
+# Instructions and chart catalog form a static prefix, built once; the intent and data
+# preview go last so every call shares a byte-identical prefix for provider prompt caching.
+CHART_PROMPT_PREFIX = f"""You are a skilled data visualization assistant.
+
+Your task is to analyze a given user intent and a preview of query result data, and then suggest the most relevant chart configurations. These charts will be rendered using Plotly in a dashboard.
+
+You are provided with:
+- A user intent describing what the person wants to see
+- A sample of the SQL query result data (first 5 rows)
+- A list of supported chart types and their purposes
+
+Your job:
+- Suggest the 4 to 5 most appropriate chart configurations
+- Use only the available chart types listed below
+- Use the actual column names and data types from the data preview
+- Only suggest charts that are logically valid and meaningful for the given data
+- DO NOT hallucinate chart types, column names, or configurations that are not present in the data
+- DO NOT include charts if the required columns are not available
+- DO NOT suggest duplicate charts
+- Include an appropriate chart title for each chart
+- If a grouping column is relevant (e.g., for color), include it
+- Respond **only** in valid JSON (no markdown, no comments, no extra text)
+
+Supported Chart Types:
+{json.dumps(chart_descriptions, indent=2, ensure_ascii=False)}
+
+Respond with a JSON list like this:
+
+[
+{{
+    "chart_type": "bar_chart",
+    "x": "category_name",
+    "y": "product_count",
+    "title": "Bar Chart of Products by Category",
+    "group_by": optional_grouping_column
+}},
+{{
+    "chart_type": "treemap",
+    "path": ["category_name"],
+    "values": "product_count",
+    "title": "Treemap of Products by Category"
+}},
+{{
+    "chart_type": "area_chart",
+    "x": "date",
+    "y": "sales",
+    "title": "Area Chart of Sales Over Time"
+}},
+{{
+    "chart_type": "pie_chart",
+    "names": "category_name",
+    "values": "product_count",
+    "title": "Pie Chart of Products by Category",
+    "group_by": optional_grouping_column
+}}
+]"""
+
+async def suggest_chart(intent: str, data_preview: list, model: str) -> dict:
+    request_text = (
+        f"User Intent:\n\"{intent}\"\n\n"
+        f"Data Preview:\n{json.dumps(data_preview, default=str)}"
+    )
 
-
-def suggest_chart(intent: str, data_preview: list, model: str) -> dict:
-    prompt = f"""
-        You are a skilled data visualization assistant.
-
-        Your task is to analyze a given user intent and a preview of query result data, and then suggest the most relevant chart configurations. These charts will be rendered using Plotly in a dashboard.
-
-        You are provided with:
-        - A user intent describing what the person wants to see
-        - A sample of the SQL query result data (first 5 rows)
-        - A list of supported chart types and their purposes
-
-        Your job:
-        - Suggest the 4 to 5 most appropriate chart configurations
-        - Use only the available chart types listed below
-        - Use the actual column names and data types from the data preview
-        - Only suggest charts that are logically valid and meaningful for the given data
-        - DO NOT hallucinate chart types, column names, or configurations that are not present in the data
-        - DO NOT include charts if the required columns are not available
-        - DO NOT suggest duplicate charts
-        - Include an appropriate chart title for each chart
-        - If a grouping column is relevant (e.g., for color), include it
-        - Respond **only** in valid JSON (no markdown, no comments, no extra text)
-
-        ---
-
-        User Intent:
-        "{intent}"
-
-        Data Preview:
-        {data_preview}
-
-        Supported Chart Types:
-        {chart_descriptions}
-
-        ---
-
-        Respond with a JSON list like this:
-
-        [
-        {{
-            "chart_type": "bar_chart",
-            "x": "category_name",
-            "y": "product_count",
-            "title": "Bar Chart of Products by Category",
-            "group_by": optional_grouping_column
-        }},
-        {{
-            "chart_type": "treemap",
-            "path": ["category_name"],
-            "values": "product_count",
-            "title": "Treemap of Products by Category"
-        }},
-        {{
-            "chart_type": "area_chart",
-            "x": "date",
-            "y": "sales",
-            "title": "Area Chart of Sales Over Time"
-        }},
-        {{
-            "chart_type": "pie_chart",
-            "names": "category_name",
-            "values": "product_count",
-            "title": "Pie Chart of Products by Category",
-            "group_by": optional_grouping_column
-        }}
-        ]
-    """
-
-    response = client.chat.completions.create(
+    response = await get_llm_gateway().chat(
         model=model,
+        stage="plots",
         messages=[
-            {"role": "system", "content": "You are an expert at choosing the best chart for a dataset."},
-            {"role": "user", "content": prompt.strip()}
+            {"role": "system", "content": CHART_PROMPT_PREFIX},
+            {"role": "user", "content": request_text}
         ],
         temperature=0.3
     )
@@ -172,14 +213,115 @@ def suggest_chart(intent: str, data_preview: list, model: str) -> dict:
 
     content = re.sub(r"^```(?:json)?|```$", "", content, flags=re.MULTILINE).strip()
 
-    return json.loads(content)
+    charts = json.loads(content)
+    if not isinstance(charts, list):
+        raise ValueError("Chart suggestion is not a JSON list")
+    return charts
+
+async def suggest_chart_routed(intent: str, data_preview: list, model: str) -> Tuple[list, str]:
+    """Suggest charts, retrying once on the stronger model if the reply is not a valid JSON list."""
+    try:
+        return await suggest_chart(intent, data_preview, model=model), model
+    except ValueError as e:  # includes json.JSONDecodeError
+        stronger = model_router.escalate(model)
+        if not stronger:
+            raise
+        print(f"Chart suggestion from {model} was invalid ({e}); escalating to {stronger}")
+        return await suggest_chart(intent, data_preview, model=stronger), stronger
+
+def run_sql(sql_query: str, track: bool = True, wrap: Optional[Callable[[str], str]] = None) -> "StreamResult":
+    """Run ``sql_query`` (or ``wrap`` applied to it), reading a rollup in its place where one serves it.
+
+    Only the user's statements count towards rollups: ``track=False`` marks SQL we generated.
+    """
+    from common.rollups import get_rollups
+    from common.streaming import stream_query
+
+    rollups = get_rollups(POSTGRES_URI, data_version)
+    if rollups is not None:
+        sql_query = rollups.rewrite(sql_query, track=track)
+    return stream_query(wrap(sql_query) if wrap else sql_query, get_engine(POSTGRES_URI))
+
+def load_dataframe(sql_query: str, track: bool = True) -> "pd.DataFrame":
+    """Load the query result, from the shared result cache when the data is unchanged (blocking).
+
+    Results larger than the streaming memory budget come back as a uniform sample.
+    """
+    from common.result_cache import get_result_cache
+
+    cache = get_result_cache(data_version)
+    if cache is None:
+        result = run_sql(sql_query, track)
+    else:
+        result, _ = cache.read_sql(sql_query, data_version, lambda sql: run_sql(sql, track))
+    if result.sampled:
+        print(f"Charting a {len(result.frame)}-row sample of {result.total_rows} rows")
+    return result.frame
+
+def load_head(sql_query: str, rows: int) -> Tuple["pd.DataFrame", bool]:
+    """Load at most ``rows + 1`` rows; returns (frame, whether that is the whole result) (blocking).
+
+    A whole result is stored in the result cache under the query itself, so the report
+    service still reuses it. A larger one is charted from SQL aggregates where possible.
+    """
+    from common.data_version import UNKNOWN_VERSION
+    from common.result_cache import get_result_cache
+
+    cache = get_result_cache(data_version)
+    version = data_version.get() if cache is not None else UNKNOWN_VERSION
+    if version != UNKNOWN_VERSION:
+        df = cache.get(sql_query, version)
+        if df is not None:
+            return df, True
+    try:
+        # The preview wraps the user's statement (or the rollup read replacing it), which is what gets counted.
+        frame = run_sql(sql_query, wrap=lambda sql: preview_sql(sql, rows + 1)).frame
+    except Exception as e:
+        # Not every statement can be wrapped in a subquery; load it as before.
+        print(f"Could not preview query ({e}); loading every row")
+        return load_dataframe(sql_query), True
+    if len(frame) > rows:
+        return frame, False
+    if version != UNKNOWN_VERSION:
+        cache.put(sql_query, version, frame)
+    return frame, True
+
+
+def render_chart(chart_fn: Callable, df: "pd.DataFrame", title: str, kwargs: Dict[str, Any]) -> Tuple[str, str]:
+    """Build a chart, export it to HTML and PNG and upload the image (blocking, run it on the executor)."""
+    import plotly.io as pio
+    from utils import upload_image_to_minio
+
+    chart_type = chart_fn.__name__
+    with span("chart.render", **{"chart.type": chart_type, "chart.rows": len(df)}), \
+            CHART_RENDER_SECONDS.labels(chart_type, "render").time():
+        fig = chart_fn(df, title=title, **kwargs)
+        html = pio.to_html(fig, full_html=False)
+
+    with span("chart.export_png", **{"chart.type": chart_type}), CHART_RENDER_SECONDS.labels(chart_type, "export").time():
+        image_bytes = fig.to_image(format="png", engine="kaleido")
+    image_url = upload_image_to_minio(image_bytes)
+    return html, image_url
 
 # === FastAPI Endpoint ===
 @app.post("/visualize", response_model=VisualizationResponse)
-def visualize_query(request: VisualizationRequest):
+async def visualize_query(request: VisualizationRequest):
+    key = make_key(
+        normalize_text(request.sql_query, lowercase=False),
+        normalize_text(request.intent),
+        model_router.route("plots", request.model),
+        json.dumps(request.chart_specs, sort_keys=True) if request.chart_specs is not None else None,
+    )
+    return await visualize_flight.do(key, lambda: build_visualizations(request))
+
+async def build_visualizations(request: VisualizationRequest) -> VisualizationResponse:
+    chart_map = await readiness.get("renderer")
+
     try:
-        engine = create_engine(POSTGRES_URI)
-        df = pd.read_sql(request.sql_query, con=engine)
+        if CHART_SQL_AGGREGATION:
+            df, complete = await run_blocking(load_head, request.sql_query, CHART_AGGREGATE_MIN_ROWS)
+        else:
+            df, complete = await run_blocking(load_dataframe, request.sql_query), True
     except Exception as e:
         return VisualizationResponse(
             status="error",
@@ -196,17 +338,22 @@ def visualize_query(request: VisualizationRequest):
 
     preview_data = df.head(5).to_dict(orient="records")
 
+    model = model_router.route("plots", request.model)
     try:
-        chart_infos = suggest_chart(request.intent, preview_data, model=request.model)
+        if request.chart_specs is not None:
+            # Specs that rendered before (saved reports): no LLM call, just the data.
+            chart_infos, model = request.chart_specs, None
+        else:
+            chart_infos, model = await suggest_chart_routed(request.intent, preview_data, model)
     except Exception as e:
         return VisualizationResponse(
             status="error",
             html_plots=["<p>Chart suggestion failed.</p>"],
-            error_message=str(e)
+            error_message=str(e),
+            model=model
         )
 
-    html_plots = []
-    image_urls = []
+    chart_jobs = []
     seen_charts = set()
     for chart_info in chart_infos:
         chart_type = chart_info.get("chart_type")
@@ -216,37 +363,83 @@ def visualize_query(request: VisualizationRequest):
             continue
         seen_charts.add((chart_type, title))
 
-        if chart_type not in chart_map:
+        if chart_type not in CHART_TYPES:
             continue
 
         kwargs = {
             k: v for k, v in chart_info.items()
             if k not in ("chart_type", "title") and v is not None
         }
+        chart_jobs.append((chart_type, title, kwargs))
+
+    raw_rows: List[asyncio.Future] = []
+
+    def all_rows() -> asyncio.Future:
+        # Large results are loaded in full at most once, and only if some chart needs the rows.
+        if not raw_rows:
+            raw_rows.append(asyncio.ensure_future(run_blocking(load_dataframe, request.sql_query)))
+        return raw_rows[0]
+
+    async def render_job(chart_type: str, title: str, kwargs: Dict[str, Any], plan: Optional[AggregatePlan]):
+        if plan is not None:
+            try:
+                frame = await run_blocking(load_dataframe, plan.sql, False)
+            except Exception as e:
+                print(f"Aggregate query for {chart_type} failed ({e}); charting the rows instead")
+            else:
+                return await run_blocking(render_chart, chart_map[plan.renderer or chart_type], frame, title, kwargs)
+        frame = df if complete else await all_rows()
+        return await run_blocking(render_chart, chart_map[chart_type], frame, title, kwargs)
+
+    # Small results are charted from their rows; larger ones from SQL aggregates where the chart allows.
+    plans = [
+        None if complete else plan_chart(request.sql_query, chart_type, kwargs, df)
+        for chart_type, _, kwargs in chart_jobs
+    ]
+    if not complete:
+        print(f"Result exceeds {CHART_AGGREGATE_MIN_ROWS} rows; "
+              f"{sum(p is not None for p in plans)} of {len(plans)} charts aggregated in SQL")
+
+    # Charts render in parallel on the bounded executor; results keep the suggested order.
+    results = await asyncio.gather(
+        *(render_job(chart_type, title, kwargs, plan) for (chart_type, title, kwargs), plan in zip(chart_jobs, plans)),
+        return_exceptions=True,
+    )
 
-        try:
-            fig = chart_map[chart_type](df, title=title, **kwargs)
-
-            html = pio.to_html(fig, full_html=False)
-            html_plots.append(html)
-
-            image_bytes = fig.to_image(format="png", engine="kaleido")
-            image_url = upload_image_to_minio(image_bytes)
-            image_urls.append(image_url)
-
-        except Exception as e:
-            print(f"Failed to render {chart_type}: {str(e)}")
+    html_plots = []
+    image_urls = []
+    chart_specs = []
+    for (chart_type, title, kwargs), result in zip(chart_jobs, results):
+        if isinstance(result, Exception):
+            print(f"Failed to render {chart_type}: {str(result)}")
             continue
+        html, image_url = result
+        html_plots.append(html)
+        image_urls.append(image_url)
+        chart_specs.append({"chart_type": chart_type, "title": title, **kwargs})
 
     if not html_plots:
         return VisualizationResponse(
             status="error",
             html_plots=["<p>No charts could be generated from the input.</p>"],
-            error_message="All suggested charts failed to render."
+            error_message="All suggested charts failed to render.",
+            model=model
         )
 
     return VisualizationResponse(
         status="success",
         html_plots=html_plots,
         image_urls=image_urls,
+        model=model,
+        chart_specs=chart_specs,
     )
+
+@app.get("/rollups/stats")
+async def rollup_stats():
+    """Most repeated query shapes and the materialized rollups serving them."""
+    from common.rollups import get_rollups
+
+    rollups = get_rollups(POSTGRES_URI, data_version)
+    if rollups is None:
+        return {"enabled": False}
+    return await run_blocking(rollups.stats)
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Services run from their own directory, with the repository root on the path for common/.
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [SERVICE_DIR, os.path.dirname(SERVICE_DIR)]
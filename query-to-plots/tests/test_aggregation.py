@@ -0,0 +1,165 @@
+import datetime
+import os
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+
+from aggregation import CHART_HISTOGRAM_BINS, column_kind, heatmap_sql, histogram_sql, plan_chart, time_series_sql
+
+PREVIEW = pd.DataFrame({
+    "order_date": [datetime.date(2024, 1, 1), datetime.date(2024, 1, 2)],
+    "amount": [10.5, 7.0],
+    "region": ["EMEA", "APAC"],
+    "active": [True, False],
+})
+
+
+def test_column_kind_of_preview_values():
+    assert column_kind(PREVIEW, "amount") == "numeric"
+    assert column_kind(PREVIEW, "order_date") == "date"
+    assert column_kind(PREVIEW, "region") == "other"
+    assert column_kind(PREVIEW, "active") == "other"
+    timestamps = pd.DataFrame({"at": [datetime.datetime(2024, 1, 1, 12)]})
+    assert column_kind(timestamps, "at") == "datetime"
+
+
+def test_numeric_histogram_clamps_the_maximum_and_handles_a_single_value():
+    sql = histogram_sql("SELECT amount FROM orders;", "amount", "numeric", None)
+    bins = CHART_HISTOGRAM_BINS
+    # width_bucket puts the maximum in bucket bins + 1, and rejects lo = hi outright.
+    assert f"least(width_bucket(q.\"amount\"::float8, b.lo, b.hi, {bins}), {bins})" in sql
+    assert "CASE WHEN b.hi > b.lo" in sql and "ELSE 1 END AS bucket" in sql
+    assert "WITH q AS (SELECT amount FROM orders)" in sql
+
+
+def test_non_numeric_histogram_counts_each_value():
+    sql = histogram_sql("SELECT country, region FROM customers", "country", "other", "region")
+    assert "count(*) AS _count" in sql
+    assert 'GROUP BY "country", "region"' in sql
+    assert "width_bucket" not in sql
+
+
+def test_heatmap_averages_cells():
+    sql = heatmap_sql("SELECT * FROM sales", "month", "region", "total")
+    assert 'avg("total") AS "total"' in sql
+    assert 'GROUP BY "month", "region"' in sql
+
+
+def test_time_series_sums_only_repeated_dates():
+    sql = time_series_sql("SELECT order_date, amount FROM orders", "order_date", "date", "amount", None)
+    assert 'count("order_date") > count(DISTINCT "order_date")' in sql
+    assert 'CASE WHEN bool_or(b.repeated) THEN sum(q."amount") ELSE avg(q."amount") END' in sql
+    grouped = time_series_sql("SELECT * FROM orders", "order_date", "date", "amount", "region")
+    assert 'count(DISTINCT ("order_date", "region"))' in grouped
+
+
+def test_time_series_averages_non_additive_measures():
+    for column in ("unit_price", "avg_freight", "discount_rate", "Share"):
+        sql = time_series_sql("SELECT * FROM products", "day", "datetime", column, None)
+        assert f'avg(q."{column}")' in sql
+        assert "sum(" not in sql and "repeated" not in sql
+
+
+def test_plans_draw_with_a_renderer_from_utils():
+    utils = pytest.importorskip("utils")
+    histogram = plan_chart("SELECT * FROM orders", "histogram", {"x": "amount"}, PREVIEW)
+    by_region = plan_chart("SELECT * FROM orders", "histogram", {"x": "region"}, PREVIEW)
+    box = plan_chart("SELECT * FROM orders", "box_plot", {"y": "amount", "x": "region"}, PREVIEW)
+    assert histogram.renderer == by_region.renderer == "histogram_binned"
+    assert "width_bucket" in histogram.sql and "width_bucket" not in by_region.sql
+    assert box.renderer == "box_plot_quartiles"
+    for plan in (histogram, box):
+        assert callable(getattr(utils, plan.renderer))
+
+
+def test_heatmap_and_time_series_keep_the_charts_own_renderer():
+    heatmap = plan_chart("SELECT * FROM orders", "heatmap", {"x": "order_date", "y": "region", "z": "amount"}, PREVIEW)
+    line = plan_chart("SELECT * FROM orders", "line_chart", {"x": "order_date", "y": "amount", "group_by": "region"},
+                      PREVIEW)
+    assert heatmap.renderer is None and line.renderer is None
+    # DATE columns come back as datetime.date objects and are cast for date_trunc.
+    assert 'date_trunc(g.grain, q."order_date"::timestamp)' in line.sql
+    assert 'q."region", ' in line.sql
+
+
+def test_area_chart_drops_group_by():
+    plan = plan_chart("SELECT * FROM orders", "area_chart", {"x": "order_date", "y": "amount", "group_by": "region"},
+                      PREVIEW)
+    assert '"region"' not in plan.sql
+    assert "GROUP BY 1 ORDER BY 1" in plan.sql
+
+
+@pytest.mark.parametrize("chart_type, kwargs", [
+    ("box_plot", {"y": "region"}),
+    ("heatmap", {"x": "order_date", "y": "region", "z": "region"}),
+    ("line_chart", {"x": "order_date", "y": "region"}),
+    ("line_chart", {"x": "amount", "y": "amount"}),
+])
+def test_non_numeric_measures_are_charted_from_raw_rows(chart_type, kwargs):
+    assert plan_chart("SELECT * FROM orders", chart_type, kwargs, PREVIEW) is None
+
+
+@pytest.mark.parametrize("chart_type, kwargs", [
+    ("histogram", {"x": "missing"}),
+    ("histogram", {"x": "amount", "group_by": "missing"}),
+    ("histogram", {}),
+    ("box_plot", {"y": ["amount"]}),
+    ("heatmap", {"x": "order_date", "y": "region"}),
+    ("line_chart", {"x": "order_date", "y": "amount", "group_by": "missing"}),
+    ("bar_chart", {"x": "region", "y": "amount"}),
+])
+def test_unusable_columns_and_other_charts_are_not_aggregated(chart_type, kwargs):
+    assert plan_chart("SELECT * FROM orders", chart_type, kwargs, PREVIEW) is None
+
+
+# The SQL itself only runs on Postgres (width_bucket, percentile_cont, date_trunc).
+@pytest.fixture
+def pg():
+    uri = os.getenv("TEST_POSTGRES_URI")
+    if not uri:
+        pytest.skip("TEST_POSTGRES_URI is not set")
+    from sqlalchemy import create_engine, text
+
+    engine = create_engine(uri)
+    yield lambda sql: pd.read_sql_query(text(sql), engine)
+    engine.dispose()
+
+
+def test_histogram_bins_every_row_on_postgres(pg):
+    bins = pg(histogram_sql("SELECT v::float8 AS v FROM (VALUES (1), (2), (3), (10)) AS t(v)", "v", "numeric", None))
+    assert bins["_count"].sum() == 4
+    assert bins["v"].max() == pytest.approx(1 + (CHART_HISTOGRAM_BINS - 0.5) * 9 / CHART_HISTOGRAM_BINS)
+    single = pg(histogram_sql("SELECT 5.0::float8 AS v", "v", "numeric", None))
+    assert single[["v", "_bin_width", "_count"]].values.tolist() == [[5.0, 0.0, 1]]
+
+
+def test_box_plot_quartiles_match_pandas_on_postgres(pg):
+    from aggregation import box_plot_sql
+
+    values = [1, 2, 3, 4, 5, 6, 7, 8, 9, 100]
+    rows = ", ".join(f"({v})" for v in values)
+    box = pg(box_plot_sql(f"SELECT v::float8 AS v FROM (VALUES {rows}) AS t(v)", "v", None)).iloc[0]
+    series = pd.Series(values, dtype="float64")
+    assert box["_q1"] == pytest.approx(series.quantile(0.25))
+    assert box["_median"] == pytest.approx(series.median())
+    assert box["_q3"] == pytest.approx(series.quantile(0.75))
+    assert (box["_lowerfence"], box["_upperfence"]) == (1.0, 9.0)
+
+
+def test_heatmap_cells_hold_the_mean_on_postgres(pg):
+    cells = pg(heatmap_sql("SELECT * FROM (VALUES ('a', 'x', 2.0::float8), ('a', 'x', 4.0), ('b', 'x', 5.0)) "
+                           "AS t(m, r, total)", "m", "r", "total"))
+    assert dict(zip(cells["m"], cells["total"])) == {"a": 3.0, "b": 5.0}
+
+
+def test_time_series_sums_events_and_averages_aggregates_on_postgres(pg):
+    # A span of almost a day puts both early timestamps in the same hourly bucket.
+    aggregated = ("SELECT at::timestamp AS at, v::float8 AS v FROM (VALUES "
+                  "('2024-01-01 00:10', 2), ('2024-01-01 00:20', 4), ('2024-01-02 00:00', 6)) AS t(at, v)")
+    events = aggregated.replace("VALUES ", "VALUES ('2024-01-01 00:10', 1), ")
+    first = pd.Timestamp("2024-01-01 00:00")
+    averaged = pg(time_series_sql(aggregated, "at", "datetime", "v", None)).set_index("at")["v"]
+    summed = pg(time_series_sql(events, "at", "datetime", "v", None)).set_index("at")["v"]
+    assert averaged[first] == 3.0
+    assert summed[first] == 7.0
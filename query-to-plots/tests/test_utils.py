@@ -0,0 +1,41 @@
+from decimal import Decimal
+
+import pytest
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("plotly")
+pytest.importorskip("boto3")
+
+import utils
+from utils import render_mode, scatter_plot, typed_columns
+
+
+def frame(rows):
+    return pd.DataFrame({"x": range(rows), "y": [float(i) for i in range(rows)]})
+
+
+def test_render_mode_forces_webgl_only_past_the_threshold(monkeypatch):
+    monkeypatch.setattr(utils, "WEBGL_POINT_THRESHOLD", 200)
+    assert render_mode(frame(200)) == "auto"
+    assert render_mode(frame(201)) == "webgl"
+
+
+def test_small_charts_keep_plotly_auto_switching():
+    threshold = utils.WEBGL_POINT_THRESHOLD
+    assert threshold <= 1000
+    assert scatter_plot(frame(threshold), "x", "y", "t").data[0].type == "scatter"
+    assert scatter_plot(frame(threshold + 1), "x", "y", "t").data[0].type == "scattergl"
+    # Plotly's own "auto" switches at 1000 rows whatever the threshold.
+    assert scatter_plot(frame(1001), "x", "y", "t").data[0].type == "scattergl"
+
+
+def test_decimal_and_nullable_columns_become_numpy_numbers():
+    df = pd.DataFrame({
+        "price": [Decimal("1.50"), Decimal("2.25"), None],
+        "qty": pd.array([1, None, 3], dtype="Int64"),
+        "name": ["a", "b", "c"],
+    })
+    converted = typed_columns(df, "price", "qty", "name", None)
+    assert converted["price"].dtype == "float64"
+    assert converted["qty"].dtype == "float64"
+    assert converted["name"].dtype == df["name"].dtype
@@ -5,6 +5,35 @@ import boto3
 from botocore.client import Config
 import uuid
 import os
+from functools import lru_cache
+
+from common.tracing import span
+
+# Scatter and line charts with more points than this always use WebGL (Scattergl). Smaller
+# charts keep Plotly's "auto" mode, which itself switches to WebGL above 1000 rows.
+WEBGL_POINT_THRESHOLD = int(os.getenv("WEBGL_POINT_THRESHOLD", "1000"))
+
+def render_mode(df: pd.DataFrame) -> str:
+    return "webgl" if len(df) > WEBGL_POINT_THRESHOLD else "auto"
+
+def typed_columns(df: pd.DataFrame, *columns: str) -> pd.DataFrame:
+    """Numeric columns as plain NumPy dtypes, which Plotly embeds as base64 typed arrays.
+
+    Decimal (object) and nullable extension columns would otherwise be written out as JSON
+    number lists, several times larger and slower for the browser to parse.
+    """
+    converted = {}
+    for col in columns:
+        if col is None or col not in df.columns:
+            continue
+        series = df[col]
+        if isinstance(series.dtype, pd.api.extensions.ExtensionDtype) and pd.api.types.is_numeric_dtype(series):
+            converted[col] = series.astype("float64")
+        elif series.dtype == object:
+            numbers = pd.to_numeric(series, errors="coerce")
+            if numbers.notna().sum() == series.notna().sum() and series.notna().any():
+                converted[col] = numbers
+    return df.assign(**converted) if converted else df
 
 def bar_chart(df: pd.DataFrame, x: str, y: str, title: str, **kwargs) -> go.Figure:
     """Creates a bar chart using Plotly."""
@@ -14,7 +43,8 @@ def bar_chart(df: pd.DataFrame, x: str, y: str, title: str, **kwargs) -> go.Figu
 def line_chart(df: pd.DataFrame, x: str, y: str, title: str, **kwargs) -> go.Figure:
     """Creates a line chart using Plotly."""
     color = kwargs.get("group_by")
-    return px.line(df, x=x, y=y, title=title, color=color)
+    df = typed_columns(df, x, y)
+    return px.line(df, x=x, y=y, title=title, color=color, render_mode=render_mode(df))
 
 def pie_chart(df: pd.DataFrame, names: str, values: str, title: str) -> go.Figure:
     """Creates a pie chart using Plotly."""
@@ -23,7 +53,8 @@ def pie_chart(df: pd.DataFrame, names: str, values: str, title: str) -> go.Figur
 def scatter_plot(df: pd.DataFrame, x: str, y: str, title: str, **kwargs) -> go.Figure:
     """Creates a scatter plot using Plotly."""
     color = kwargs.get("group_by")
-    return px.scatter(df, x=x, y=y, title=title, color=color)
+    df = typed_columns(df, x, y)
+    return px.scatter(df, x=x, y=y, title=title, color=color, render_mode=render_mode(df))
 
 def histogram(df: pd.DataFrame, x: str, title: str, **kwargs) -> go.Figure:
     """Creates a histogram using Plotly."""
@@ -54,23 +85,48 @@ def treemap(df: pd.DataFrame, path: str, values: str, title: str) -> go.Figure:
     path = [path] if isinstance(path, str) else path
     return px.treemap(df, path=path, values=values, title=title)
 
-s3_client = boto3.client(
-    's3',
-    endpoint_url=os.getenv("MINIO_ENDPOINT", 'http://minio:9000'),  # inside Docker use service name, for local use 'localhost'
-    aws_access_key_id=os.getenv("MINIO_USRER", 'minioadmin'),
-    aws_secret_access_key=os.getenv("MINIO_PWD", 'minioadmin'),
-    config=Config(signature_version='s3v4'),
-    region_name='us-east-1'
-)
+def histogram_binned(df: pd.DataFrame, x: str, title: str, **kwargs) -> go.Figure:
+    """Draws a histogram from bins counted in SQL (x, _count and, for numeric x, _bin_width)."""
+    color = kwargs.get("group_by")
+    fig = px.bar(df, x=x, y="_count", title=title, color=color, labels={"_count": "count"})
+    if "_bin_width" in df.columns and not df.empty and df["_bin_width"].iloc[0] > 0:
+        fig.update_traces(width=float(df["_bin_width"].iloc[0]))
+    return fig.update_layout(bargap=0)
+
+def box_plot_quartiles(df: pd.DataFrame, y: str, x: str = None, title: str = "") -> go.Figure:
+    """Draws a box plot from quartiles and whiskers computed in SQL."""
+    return go.Figure(data=go.Box(
+        x=df[x] if x else [y] * len(df),
+        q1=df["_q1"],
+        median=df["_median"],
+        q3=df["_q3"],
+        lowerfence=df["_lowerfence"],
+        upperfence=df["_upperfence"],
+        name=y,
+    )).update_layout(title=title, xaxis_title=x, yaxis_title=y)
+
+@lru_cache(maxsize=1)
+def get_s3_client():
+    """Create the MinIO client on first upload rather than at import time."""
+    return boto3.client(
+        's3',
+        endpoint_url=os.getenv("MINIO_ENDPOINT", 'http://minio:9000'),  # inside Docker use service name, for local use 'localhost'
+        aws_access_key_id=os.getenv("MINIO_USRER", 'minioadmin'),
+        aws_secret_access_key=os.getenv("MINIO_PWD", 'minioadmin'),
+        config=Config(signature_version='s3v4'),
+        region_name='us-east-1'
+    )
 
 def upload_image_to_minio(image_bytes: bytes, bucket: str = "charts", suffix: str = "png") -> str:
     key = f"{uuid.uuid4()}.{suffix}"
+    s3_client = get_s3_client()
 
     try:
         s3_client.head_bucket(Bucket=bucket)
     except s3_client.exceptions.NoSuchBucket:
         s3_client.create_bucket(Bucket=bucket)
 
-    s3_client.put_object(Bucket=bucket, Key=key, Body=image_bytes, ContentType="image/png")
+    with span("s3.put_object", **{"s3.bucket": bucket, "s3.bytes": len(image_bytes)}):
+        s3_client.put_object(Bucket=bucket, Key=key, Body=image_bytes, ContentType="image/png")
 
     return f"http://localhost:9000/{bucket}/{key}"
@@ -1,13 +1,24 @@
 import os
+import re
 import logging
+from contextlib import asynccontextmanager
+from functools import lru_cache
 from typing import Optional
 
 from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from sqlalchemy import create_engine, inspect
-from openai import OpenAI, OpenAIError
-from tenacity import retry, stop_after_attempt, wait_fixed, retry_if_exception_type
+from sqlalchemy import text
+from openai import OpenAIError
+
+from common.db import get_engine
+from common.llm import add_llm_stats_route, add_priority_middleware, get_llm_gateway, model_router
+from common.metrics import add_metrics
+from common.readiness import Readiness, add_health_routes
+from common.resilience import add_deadline_middleware
+from common.schema_index import SchemaIndexProvider
+from common.singleflight import SingleFlight, make_key, normalize_text
+from common.tracing import add_tracing
 
 load_dotenv()
 
@@ -17,66 +28,81 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-try:
-    client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-except Exception as e:
-    logger.critical("Failed to initialize OpenAI client: %s", e)
-    raise
-
 POSTGRES_URI = os.getenv("POSTGRES_URI", "postgresql://postgres:postgres@db:5432/northwind")
 
-app = FastAPI(title="Intent Reformulation API")
+readiness = Readiness("reformulate-intent")
+reformulate_flight = SingleFlight("reformulate")
 
 
-def get_postgres_schema(uri: str) -> str:
-    try:
-        engine = create_engine(uri)
-        inspector = inspect(engine)
+def warm_database() -> None:
+    """Open the first pooled connection so the first request does not pay for it."""
+    with get_engine(POSTGRES_URI).connect() as conn:
+        conn.execute(text("SELECT 1"))
 
-        schema_parts = []
-        for table_name in inspector.get_table_names():
-            columns = inspector.get_columns(table_name)
-            column_names = [col["name"] for col in columns]
-            schema_parts.append(f"- {table_name}({', '.join(column_names)})")
 
-        logger.info("Extracted schema from PostgreSQL")
-        return "Tables:\n" + "\n".join(schema_parts)
-    except Exception as e:
-        logger.error("Failed to extract schema: %s", e)
-        raise HTTPException(status_code=500, detail="Failed to extract schema from database")
+readiness.register("database", warm_database)
 
+# Column types, keys and sample values per table; pruned to the intent's tables on wide schemas.
+schema_provider = SchemaIndexProvider(POSTGRES_URI)
+readiness.register("schema", schema_provider.load)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    readiness.start()
+    yield
+    await readiness.stop()
+    await get_llm_gateway().aclose()
+
+
+app = FastAPI(title="Intent Reformulation API", lifespan=lifespan)
+add_health_routes(app, readiness)
+add_priority_middleware(app)
+add_tracing(app, "reformulate-intent")
+add_metrics(app)
+add_deadline_middleware(app)
+add_llm_stats_route(app)
+
+
+# Output that starts like a SQL statement breaks the "NEVER return SQL" rule.
+SQL_LIKE = re.compile(r"^\s*(```|select\b|with\b.+\bas\s*\()", re.IGNORECASE | re.DOTALL)
 
-# Retry logic for OpenAI API
-@retry(
-    stop=stop_after_attempt(3),
-    wait=wait_fixed(2),
-    retry=retry_if_exception_type(OpenAIError),
-    reraise=True,
-)
-def reformulate_intent(user_intent: str, schema: str, model: str = "gpt-4") -> str:
-    system_prompt = f"""
-    You are a helpful assistant that reformulates vague or underspecified user intents into precise, well-structured, and SQL-queryable natural language questions. 
-    You are provided with a database schema. Use it to infer and clarify the user's likely intent as accurately as possible.
-
-    Your task is to:
-    - Reformulate vague questions into detailed, database-ready ones.
-    - Assume common-sense defaults where necessary (e.g., "top products" → "products with the highest total sales").
-    - Use relevant table and column names from the schema.
-    - Include filters or metrics implied by the question (e.g., totals, counts, dates).
-    - NEVER ask the user for clarification.
-    - NEVER return SQL.
-    - NEVER include markdown or meta commentary.
-    - ONLY return the rewritten, improved natural language question.
-
-    Schema:
-    {schema}
-    """
 
+def is_valid_reformulation(text: str) -> bool:
+    return bool(text) and not SQL_LIKE.match(text)
+
+
+# Static part of the system prompt. The schema follows it and the intent goes in the user
+# message, so every call for the same schema sends a byte-identical prefix that the
+# provider can serve from its prompt cache.
+REFORMULATE_INSTRUCTIONS = """You are a helpful assistant that reformulates vague or underspecified user intents into precise, well-structured, and SQL-queryable natural language questions.
+You are provided with a database schema. Use it to infer and clarify the user's likely intent as accurately as possible.
+
+Your task is to:
+- Reformulate vague questions into detailed, database-ready ones.
+- Assume common-sense defaults where necessary (e.g., "top products" → "products with the highest total sales").
+- Use relevant table and column names from the schema.
+- Include filters or metrics implied by the question (e.g., totals, counts, dates).
+- NEVER ask the user for clarification.
+- NEVER return SQL.
+- NEVER include markdown or meta commentary.
+- ONLY return the rewritten, improved natural language question."""
+
+
+@lru_cache(maxsize=8)
+def build_system_prompt(schema: str) -> str:
+    """Built once per schema text and reused across calls."""
+    return f"{REFORMULATE_INSTRUCTIONS}\n\nSchema:\n{schema}"
+
+
+# Rate limiting and retries (429s, timeouts, 5xx) are handled by the shared LLM gateway
+async def reformulate_intent(user_intent: str, schema: str, model: str) -> str:
     try:
-        response = client.chat.completions.create(
+        response = await get_llm_gateway().chat(
             model=model,
+            stage="reformulate",
             messages=[
-                {"role": "system", "content": system_prompt.strip()},
+                {"role": "system", "content": build_system_prompt(schema)},
                 {"role": "user", "content": user_intent.strip()}
             ],
             temperature=0.3
@@ -91,20 +117,35 @@ def reformulate_intent(user_intent: str, schema: str, model: str = "gpt-4") -> s
 
 class IntentRequest(BaseModel):
     intent: str
-    model: Optional[str] = "gpt-4o-mini"
+    model: Optional[str] = None  # routed to the stage default when omitted
 
 
 class ReformulatedResponse(BaseModel):
     reformulated_intent: str
+    model: str
+
+
+async def run_reformulation(request: IntentRequest) -> ReformulatedResponse:
+    await readiness.get("schema")
+    schema_index = await schema_provider.get()
+    tables = await schema_index.prune(request.intent, get_llm_gateway())
+    schema_text = schema_index.render(tables)
+    model = model_router.route("reformulate", request.model)
+    new_intent = await reformulate_intent(request.intent, schema_text, model=model)
+    stronger = model_router.escalate(model)
+    if not is_valid_reformulation(new_intent) and stronger:
+        logger.warning("Reformulation from %s failed validation; escalating to %s", model, stronger)
+        model = stronger
+        new_intent = await reformulate_intent(request.intent, schema_text, model=model)
+    return ReformulatedResponse(reformulated_intent=new_intent, model=model)
 
 
 @app.post("/reformulate", response_model=ReformulatedResponse)
-def api_reformulate(request: IntentRequest):
+async def api_reformulate(request: IntentRequest):
     logger.info("Received reformulation request: intent='%s', model='%s'", request.intent, request.model)
     try:
-        schema_text = get_postgres_schema(POSTGRES_URI)
-        new_intent = reformulate_intent(request.intent, schema_text, model=request.model)
-        return ReformulatedResponse(reformulated_intent=new_intent)
+        key = make_key(normalize_text(request.intent), normalize_text(request.model or ""))
+        return await reformulate_flight.do(key, lambda: run_reformulation(request))
     except HTTPException as e:
         raise e
     except Exception as e: